@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+
+# Archives the finished and abandoned games once, for deploys running it from
+# cron with ARCHIVE_INTERVAL=0 rather than from every worker.
+import logging
+import os
+import sys
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if __name__ == "__main__":
+    sys.path.insert(0, BASE_DIR)
+
+    from src.archive import run_archiver
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    num_archived = run_archiver()
+    print(f"Archived {num_archived} games", file=sys.stderr)
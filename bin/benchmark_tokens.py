@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Microbenchmark of the session token formats: tokens verified per second by
+# each, uncached (every token new to the worker) and through the JWT cache.
+#
+#   python ./bin/benchmark_tokens.py --tokens 20000
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def tokens_per_second(verify: Callable[[str], object], tokens: List[str]) -> float:
+    start = time.perf_counter()
+    for token in tokens:
+        verify(token)
+    return len(tokens) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session token microbenchmark")
+    parser.add_argument("--tokens", type=int, default=20_000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BASE_DIR)
+    from src.config import get_settings
+    from src.schemas import GameSession
+    from src.session_token import CompactSessionToken, GameSessionJWT
+
+    settings = get_settings()
+    sessions = [
+        GameSession(game_id=i // 8 + 1, player_id=i + 1, is_master=i % 8 == 0)
+        for i in range(args.tokens)
+    ]
+
+    jwt_session = GameSessionJWT(settings)
+    compact_session = CompactSessionToken(settings)
+    jwt_tokens = [jwt_session.to_public_token(i) for i in sessions]
+    compact_tokens = [compact_session.to_public_token(i) for i in sessions]
+
+    jwt_session.cache.clear()
+    results = {
+        "jwt": tokens_per_second(jwt_session.decode, jwt_tokens),
+        "jwt, cached": None,
+        "compact": tokens_per_second(compact_session.decode, compact_tokens),
+    }
+    for token in jwt_tokens:
+        jwt_session.from_token_str(token)
+    results["jwt, cached"] = tokens_per_second(jwt_session.from_token_str, jwt_tokens)
+
+    print(f"{'format':<14}{'tokens/s':>12}{'vs jwt':>9}{'length':>8}")
+    for name, rate in results.items():
+        length = len((compact_tokens if name == "compact" else jwt_tokens)[0])
+        print(f"{name:<14}{rate:>12,.0f}{rate / results['jwt']:>8.1f}x{length:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+# Brings the database schema up to date. Run it once per deploy, before the
+# workers start with MIGRATE_ON_STARTUP=false, rather than from every worker.
+import logging
+import os
+import sys
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if __name__ == "__main__":
+    sys.path.insert(0, BASE_DIR)
+
+    from src.db import get_engine
+    from src.migrations import migrate
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    applied = migrate(get_engine())
+    print(f"Applied {len(applied)} migrations", file=sys.stderr)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Imports and exports the statement bank, in the database of DATABASE_URI.
+# Files are CSV (with a `statement,topic` header) or JSON lines
+# (`{"statement": ..., "topic": ...}`), read and written as streams.
+#
+#   python ./bin/statements.py import bank.csv
+#   python ./bin/statements.py export bank.jsonl
+#   cat bank.jsonl | python ./bin/statements.py import - --format jsonl
+import argparse
+import os
+import sys
+import time
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def file_format(path: str, given: str) -> str:
+    if given:
+        return given
+    extension = os.path.splitext(path)[1].lstrip(".")
+    if extension not in FORMATS:
+        sys.exit(f"Can't tell the format of {path}, pass --format")
+    return extension
+
+
+def import_statements(args):
+    with open_file(args.file, "r") as file:
+        rows = read_statements(file, file_format(args.file, args.format))
+        with get_engine().begin() as connection:
+            if connection.dialect.name == "sqlite":
+                # Inserting at random keys touches pages all over the indexes
+                cache_size = -args.sqlite_cache_mb * 1024
+                connection.exec_driver_sql(f"PRAGMA cache_size={cache_size}")
+            return add_statements(connection, rows, batch_size=args.batch_size)
+
+
+def export_statements(args):
+    num_rows = 0
+
+    def counted(rows):
+        nonlocal num_rows
+        for num_rows, row in enumerate(rows, start=1):
+            yield row
+
+    with open_file(args.file, "w") as file, get_engine().connect() as connection:
+        rows = iter_statements(connection, batch_size=args.batch_size)
+        write_statements(counted(rows), file, file_format(args.file, args.format))
+    return num_rows
+
+
+def open_file(path: str, mode: str):
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        return os.fdopen(os.dup(stream.fileno()), mode, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, BASE_DIR)
+
+    from src.db import get_engine
+    from src.migrations import migrate
+    from src.statement_bank import (
+        DEFAULT_BATCH_SIZE,
+        FORMATS,
+        add_statements,
+        iter_statements,
+        read_statements,
+        write_statements,
+    )
+
+    parser = argparse.ArgumentParser(description="Imports and exports statements")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("file", help="path to the bank file, - for stdin/stdout")
+    parser.add_argument(
+        "--format", choices=FORMATS, help="from the extension by default"
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--sqlite-cache-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    migrate(get_engine())
+
+    start = time.perf_counter()
+    if args.command == "import":
+        num_rows = import_statements(args)
+        message = f"Added {num_rows} statements"
+    else:
+        num_rows = export_statements(args)
+        message = f"Exported {num_rows} statements"
+    print(f"{message} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
@@ -0,0 +1,134 @@
+"""
+Admission control, so that one flooding client can't starve the threadpool
+and the database pool shared by every game: token buckets per player and per
+game, checked as the session token is read, and a cap on the requests
+holding a database session. Both turn requests away at once, before any
+database work, rather than queueing them.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Hashable, Iterator, Optional
+
+from src.cache import TTLCache
+from src.config import get_settings
+from src.lifecycle import on_game_released
+from src.schemas import JWTPayload
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    ...
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    A token bucket per key, refilled at `rate` tokens a second up to `burst`.
+    Buckets are dropped once full again, a full one being as good as none.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets: TTLCache[TokenBucket] = TTLCache(maxsize=maxsize)
+
+    def take(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Takes a token from `key`'s bucket. Returns 0, or the seconds until
+        there's one to take if the bucket is empty.
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.time() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key) or TokenBucket(self.burst, now)
+            tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+
+            bucket.tokens, bucket.updated = tokens, now
+            # On the cache's clock, `now` may be another
+            full_in = (self.burst - tokens) / self.rate
+            self._buckets.set(key, bucket, expires_at=time.time() + full_in)
+        return wait
+
+    def discard(self, key: Hashable):
+        self._buckets.pop(key)
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class Admission:
+    """Caps the requests holding a database session, 0 for no cap"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Holds a slot for the block, raises Overloaded when there's none"""
+        with self._lock:
+            if 0 < self.limit <= self.active:
+                raise Overloaded
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@lru_cache
+def get_player_rate_limiter() -> RateLimiter:
+    settings = get_settings()
+    return RateLimiter(
+        settings.player_rate_limit,
+        settings.player_rate_burst,
+        maxsize=settings.rate_limit_buckets,
+    )
+
+
+@lru_cache
+def get_game_rate_limiter() -> RateLimiter:
+    settings = get_settings()
+    limiter = RateLimiter(
+        settings.game_rate_limit,
+        settings.game_rate_burst,
+        maxsize=settings.rate_limit_buckets,
+    )
+    on_game_released(lambda released: limiter.discard(released.game_id))
+    return limiter
+
+
+@lru_cache
+def get_admission() -> Admission:
+    return Admission(get_settings().max_concurrent_requests)
+
+
+def check_rate_limits(jwt_payload: JWTPayload):
+    """Takes a token for the player and one for their game, or raises RateLimited"""
+    wait = get_player_rate_limiter().take(
+        (jwt_payload.game_id, jwt_payload.player_id)
+    ) or get_game_rate_limiter().take(jwt_payload.game_id)
+    if wait:
+        raise RateLimited(math.ceil(wait))
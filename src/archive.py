@@ -0,0 +1,126 @@
+"""
+Archival of the games that are over: finished ones, and those abandoned long
+enough ago. Each is stored as a single compressed JSON row in
+`archived_games`, then purged from the hot tables, in the same transaction,
+a batch at a time, keeping the hot tables and their indexes to the games
+being played.
+"""
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.orm import Session
+
+from src.config import get_settings
+from src.constants import Status
+from src.db import get_session_local, not_found_converter, transaction
+from src.game_state import get_game_state_store
+from src.lifecycle import GameReleased, release_game
+from src.models import (
+    ArchivedGameModel,
+    GameModel,
+    PlayerModel,
+    RoundModel,
+    VoteModel,
+    game_topics,
+)
+from src.schemas import ArchivedGame
+from src.snapshots import dumps
+from src.timers import Periodic
+from src.use_cases import GAME_PLAYERS, GAME_ROUNDS_DETAILS, ROUND_IN_PLAY
+
+
+def archive_batch(
+    db_session: Session, abandoned_before: datetime, batch_size: int
+) -> List[GameReleased]:
+    """Archives up to `batch_size` games, returns them to release"""
+    with transaction(db_session):
+        games = (
+            db_session.query(GameModel)
+            .options(GAME_PLAYERS, GAME_ROUNDS_DETAILS)
+            .filter(
+                or_(
+                    GameModel.status == Status.FINISHED,
+                    GameModel.created_at < abandoned_before,
+                )
+            )
+            .limit(batch_size)
+            # Other workers archiving meanwhile take other games
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not games:
+            return []
+
+        game_ids = [i.id for i in games]
+        db_session.add_all(
+            ArchivedGameModel(
+                game_id=i.id,
+                created_at=i.created_at,
+                data=zlib.compress(dumps(ArchivedGame.from_orm(i).dict(by_alias=True))),
+            )
+            for i in games
+        )
+        db_session.flush()
+
+        round_ids = select(RoundModel.id).where(RoundModel.game_id.in_(game_ids))
+        for statement in (
+            delete(VoteModel).where(VoteModel.round_id.in_(round_ids)),
+            delete(RoundModel).where(RoundModel.game_id.in_(game_ids)),
+            delete(PlayerModel).where(PlayerModel.game_id.in_(game_ids)),
+            delete(game_topics).where(game_topics.c.game_id.in_(game_ids)),
+            delete(GameModel).where(GameModel.id.in_(game_ids)),
+        ):
+            db_session.execute(statement.execution_options(synchronize_session=False))
+
+    # Abandoned games may have had rounds in play
+    return [
+        GameReleased(i.id, tuple(r.id for r in i.rounds if r.status in ROUND_IN_PLAY))
+        for i in games
+    ]
+
+
+def archive_games(db_session: Session, now: Optional[datetime] = None) -> int:
+    """Archives every game that's over, returns how many"""
+    settings = get_settings()
+    now = now or datetime.utcnow()
+    abandoned_before = now - timedelta(seconds=settings.archive_abandoned_after_secs)
+
+    if settings.game_state_store:
+        # Nothing of theirs left to write behind
+        get_game_state_store().writer.flush()
+
+    num_archived = 0
+    while True:
+        archived = archive_batch(
+            db_session, abandoned_before, settings.archive_batch_size
+        )
+        for released in archived:
+            release_game(released)
+        num_archived += len(archived)
+        if len(archived) < settings.archive_batch_size:
+            return num_archived
+
+
+def run_archiver() -> int:
+    db_session = get_session_local()
+    try:
+        return archive_games(db_session)
+    finally:
+        db_session.close()
+
+
+@not_found_converter
+def get_archived_game(db_session: Session, game_id: int) -> bytes:
+    """The JSON of an archived game"""
+    data = db_session.execute(
+        select(ArchivedGameModel.data).where(ArchivedGameModel.game_id == game_id)
+    ).scalar_one()
+    return zlib.decompress(data)
+
+
+@lru_cache
+def get_archiver() -> Periodic:
+    return Periodic(get_settings().archive_interval, run_archiver, "Archiving")
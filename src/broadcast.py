@@ -0,0 +1,173 @@
+"""
+Broadcast backends carrying game events between the workers.
+
+Backends are picked by `broadcast_url`: `memory://` (one process),
+`redis://` (needs redis) or `postgresql://` (LISTEN/NOTIFY, needs psycopg2).
+"""
+import logging
+import select
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, List
+
+from sqlalchemy.engine import make_url
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "devils_advocate_events"
+# Postgres rejects NOTIFY payloads from 8000 bytes on
+PG_NOTIFY_MAX_PAYLOAD = 7999
+RECONNECT_DELAY = 1
+
+Callback = Callable[[str], None]
+
+
+class MessageTooLarge(ValueError):
+    ...
+
+
+class BroadcastBackend(ABC):
+    # Publishing waits on the network: it's done from a thread of its own
+    blocking = True
+
+    @abstractmethod
+    def publish(self, message: str):
+        ...
+
+    @abstractmethod
+    def listen(self, callback: Callback):
+        """Calls `callback` with every message published, by any worker"""
+
+    def close(self):
+        ...
+
+
+class MemoryBackend(BroadcastBackend):
+    """Delivers in process, to every listener of the same backend"""
+
+    blocking = False
+
+    def __init__(self):
+        self._callbacks: List[Callback] = []
+
+    def publish(self, message: str):
+        for callback in list(self._callbacks):
+            callback(message)
+
+    def listen(self, callback: Callback):
+        self._callbacks.append(callback)
+
+
+class ListenerThreadMixin:
+    def start_listener(self, receive: Callable[[], None]):
+        def run():
+            while not self._closed:
+                try:
+                    receive()
+                except Exception:
+                    if self._closed:
+                        return
+                    logger.exception("Broadcast listener failed, reconnecting")
+                    time.sleep(RECONNECT_DELAY)
+
+        self._closed = False
+        threading.Thread(target=run, name="broadcast-listener", daemon=True).start()
+
+
+class RedisBackend(ListenerThreadMixin, BroadcastBackend):
+    def __init__(self, url: str, channel: str = CHANNEL):
+        if redis is None:
+            raise RuntimeError("The redis package is required by redis:// backends")
+        self.channel = channel
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, message: str):
+        self.client.publish(self.channel, message)
+
+    def listen(self, callback: Callback):
+        def receive():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.channel)
+            try:
+                for message in pubsub.listen():
+                    callback(message["data"].decode())
+            finally:
+                pubsub.close()
+
+        self.start_listener(receive)
+
+    def close(self):
+        self._closed = True
+        self.client.close()
+
+
+class PostgresBackend(ListenerThreadMixin, BroadcastBackend):
+    def __init__(self, url: str, channel: str = CHANNEL):
+        if psycopg2 is None:
+            raise RuntimeError(
+                "The psycopg2 package is required by postgresql:// backends"
+            )
+        # psycopg2 doesn't know about SQLAlchemy's driver suffixes
+        self.dsn = str(make_url(url).set(drivername="postgresql"))
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def publish(self, message: str):
+        if len(message.encode()) > PG_NOTIFY_MAX_PAYLOAD:
+            raise MessageTooLarge
+
+        with self._lock:
+            if self._connection is None or self._connection.closed:
+                self._connection = self.connect()
+            with self._connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, message))
+
+    def listen(self, callback: Callback):
+        def receive():
+            connection = self.connect()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                while not self._closed:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        callback(connection.notifies.pop(0).payload)
+            finally:
+                connection.close()
+
+        self.start_listener(receive)
+
+    def connect(self):
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        return connection
+
+    def close(self):
+        self._closed = True
+        if self._connection is not None:
+            self._connection.close()
+
+
+def get_broadcast_backend(url: str) -> BroadcastBackend:
+    scheme = url.split("://", 1)[0].split("+", 1)[0]
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme in ("redis", "rediss"):
+        return RedisBackend(url)
+    if scheme in ("postgres", "postgresql"):
+        return PostgresBackend(url)
+    raise ValueError(f"Unknown broadcast backend: {url}")
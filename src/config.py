@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import List
 
 from pydantic import BaseSettings
 
@@ -6,12 +7,77 @@ from pydantic import BaseSettings
 class Settings(BaseSettings):
     debug: bool = True
     default_secs_per_round: int = 90
+    # jwt, or compact: fixed layout binary tokens signed with HMAC-SHA256
+    session_token_format: str = "jwt"
     session_token_algorithm: str = "HS256"
     session_token_key: str = (
         "ae1cbe817d9f0792b569a7504a07deb42d09dab609c92b949972cad1787c9b2c"
     )
+    # Days a session lasts, whatever the format
     session_token_exp_time: int = 180
+    # Decoded session tokens kept in memory, 0 disables it
+    session_token_cache_size: int = 10_000
     database_uri = "sqlite:///database.db"
+    # Read replicas of `database_uri`, serving the GET routes; a player's own
+    # reads stay on the primary for a while after each of their writes
+    database_replica_uris: List[str] = []
+    replica_read_your_writes_secs: float = 5
+    # Serves requests through an AsyncSession (aiosqlite / asyncpg)
+    database_async: bool = False
+    # Connection pool, unused by in-memory SQLite databases
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: int = 30
+    database_pool_recycle: int = 1800
+    # A round-trip on each checkout, only worth it when the server drops
+    # idle connections before `database_pool_recycle`
+    database_pool_pre_ping: bool = False
+    # Brings the schema up to date as each worker starts, one at a time on
+    # Postgres; turn it off when `bin/migrate.py` runs once per deploy instead
+    migrate_on_startup: bool = True
+    sqlite_journal_mode: str = "wal"
+    sqlite_synchronous: str = "normal"
+    # Carries game events between workers: memory://, redis://, postgresql://
+    broadcast_url: str = "memory://"
+    # Serves games from memory, votes and scores are written behind in batches
+    game_state_store: bool = False
+    game_state_flush_interval: float = 0.2
+    game_state_flush_size: int = 500
+    # Rounds go from playing (the debate, `secs_per_round` long) to voting,
+    # then finish `voting_secs` later unless every vote is in before
+    round_timers: bool = True
+    voting_secs: int = 60
+    # Games nobody joined or started a round of for `game_idle_timeout_secs`
+    # are finished, checked every `idle_sweep_interval` seconds (0 turns it off)
+    game_idle_timeout_secs: int = 3600
+    idle_sweep_interval: float = 60
+    # Finished games, and any game older than `archive_abandoned_after_secs`,
+    # are moved to `archived_games` every `archive_interval` seconds (0 turns
+    # it off, bin/archive.py runs it once) in batches of `archive_batch_size`
+    archive_interval: float = 3600
+    archive_abandoned_after_secs: int = 7 * 24 * 3600
+    archive_batch_size: int = 500
+    # Responses kept for the retries of POSTs with an Idempotency-Key
+    idempotency_cache_size: int = 10_000
+    idempotency_ttl: int = 3600
+    # Larger bodies are turned away from POSTs with an Idempotency-Key
+    idempotency_max_body: int = 64 * 1024
+    # Token buckets per player and per game: requests a second, and how many
+    # can come at once; a rate of 0 turns the limit off
+    player_rate_limit: float = 10
+    player_rate_burst: int = 50
+    game_rate_limit: float = 100
+    game_rate_burst: int = 500
+    rate_limit_buckets: int = 100_000
+    # Requests holding a database session at once, the ones beyond are turned
+    # away with a 503 rather than queued for the pool; 0 for no cap
+    max_concurrent_requests: int = 64
+    # Serializes game reads with orjson, caches them per game revision and
+    # answers If-None-Match with 304
+    fast_json: bool = False
+    snapshot_cache_size: int = 10_000
+    # Reads cached per game: pages of rounds are keyed by their query string
+    snapshot_resources_per_game: int = 32
 
     class Config:
         env_file = ".env"
@@ -1,9 +1,12 @@
 from enum import Enum
 
 GAME_SESSION_KEY = "GAMESESSION"
+# Until when the client's reads stay on the primary, as a Unix time
+PRIMARY_READS_KEY = "READPRIMARY"
 
 
 class Status(str, Enum):
     PENDING = "pending"
     PLAYING = "playing"
+    VOTING = "voting"
     FINISHED = "finished"
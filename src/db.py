@@ -1,40 +1,309 @@
+import contextvars
 import functools
-from contextlib import contextmanager
+import itertools
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
 from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, Tuple, TypeVar, Union
 
+from sqlalchemy import event
+from sqlalchemy.engine import make_url, URL, Engine
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.future import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, Session, scoped_session
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.orm.exc import (
     MultipleResultsFound as SQLAlchemyMultipleResultsFound,
     NoResultFound as SQLAlchemyNoResultFound,
 )
+from starlette.concurrency import run_in_threadpool
 
-from src.config import get_settings
+from src.admission import get_admission
+from src.config import get_settings, Settings
+from src.metrics import instrument_engine
 
 Base = declarative_base()
 
+T = TypeVar("T")
+
+# Round robin over the replicas
+_replica_turns = itertools.count()
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+class PoolMetrics:
+    """Checkout counters of a connection pool, wait included"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+class MeteredPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except SQLAlchemyTimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+    def status_metrics(self) -> Dict[str, float]:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "checkouts": self.metrics.checkouts,
+            "timeouts": self.metrics.timeouts,
+            "wait_seconds": self.metrics.wait_seconds,
+            "max_wait_seconds": self.metrics.max_wait_seconds,
+        }
+
+
+class MeteredQueuePool(MeteredPoolMixin, QueuePool):
+    ...
+
+
+class MeteredAsyncQueuePool(MeteredPoolMixin, AsyncAdaptedQueuePool):
+    ...
+
+
+def is_sqlite_memory(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(url: URL, settings: Settings, is_async: bool = False) -> dict:
+    options = {"pool_pre_ping": settings.database_pool_pre_ping}
+    if is_sqlite_memory(url):
+        # In-memory databases are tied to one connection, keep the dialect's pool
+        return options
+
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+
+    options.update(
+        poolclass=MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+        pool_recycle=settings.database_pool_recycle,
+    )
+    return options
+
+
+def set_sqlite_pragmas(engine: Engine, settings: Settings):
+    if engine.url.get_backend_name() != "sqlite" or is_sqlite_memory(engine.url):
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.close()
+
+
+def create_metered_engine(database_uri: str) -> Engine:
+    settings = get_settings()
+    url = make_url(database_uri)
+    engine = create_engine(url, **engine_options(url, settings))
+    set_sqlite_pragmas(engine, settings)
+    instrument_engine(engine)
+    return engine
+
 
 @lru_cache
 def get_engine():
-    return create_engine(
-        get_settings().database_uri,
-        pool_pre_ping=True,
-        # connect_args={"check_same_thread": False},
+    return create_metered_engine(get_settings().database_uri)
+
+
+@lru_cache
+def get_replica_engines() -> Tuple[Engine, ...]:
+    return tuple(create_metered_engine(i) for i in get_settings().database_replica_uris)
+
+
+def get_replica_engine() -> Engine:
+    """The next replica in turn, the primary if there are none"""
+    engines = get_replica_engines()
+    if not engines:
+        return get_engine()
+    return engines[next(_replica_turns) % len(engines)]
+
+
+@lru_cache
+def get_session_factory() -> sessionmaker:
+    # Sessions last one request: what has just been committed is what gets
+    # serialized, reloading it after the commit would only cost queries.
+    return sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=get_engine()
     )
 
 
-def get_session_local():
-    return scoped_session(
-        sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
-    )()
+def get_session_local(replica: bool = False) -> Session:
+    if replica:
+        return get_session_factory()(bind=get_replica_engine())
+    return get_session_factory()()
+
+
+def async_database_url(database_uri: str) -> URL:
+    url = make_url(database_uri)
+    if "+" in url.drivername:
+        return url
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+
+
+def create_metered_async_engine(database_uri: str) -> AsyncEngine:
+    settings = get_settings()
+    url = async_database_url(database_uri)
+    engine = create_async_engine(url, **engine_options(url, settings, is_async=True))
+    set_sqlite_pragmas(engine.sync_engine, settings)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+@lru_cache
+def get_async_engine():
+    return create_metered_async_engine(get_settings().database_uri)
+
+
+@lru_cache
+def get_async_replica_engines() -> Tuple[AsyncEngine, ...]:
+    return tuple(
+        create_metered_async_engine(i) for i in get_settings().database_replica_uris
+    )
+
+
+def get_async_replica_engine() -> AsyncEngine:
+    engines = get_async_replica_engines()
+    if not engines:
+        return get_async_engine()
+    return engines[next(_replica_turns) % len(engines)]
+
+
+@lru_cache
+def get_async_session_factory() -> sessionmaker:
+    return sessionmaker(
+        class_=AsyncSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=get_async_engine(),
+    )
+
 
+def get_async_session_local(replica: bool = False) -> AsyncSession:
+    if replica:
+        return get_async_session_factory()(bind=get_async_replica_engine())
+    return get_async_session_factory()()
 
-def get_db():
+
+def pool_metrics() -> Dict[str, Dict[str, float]]:
+    """Metrics of the pools in use, keyed by engine"""
+    pools = {"sync": get_engine().pool}
+    for i, engine in enumerate(get_replica_engines()):
+        pools[f"sync_replica_{i}"] = engine.pool
+    if get_settings().database_async:
+        pools["async"] = get_async_engine().pool
+        for i, engine in enumerate(get_async_replica_engines()):
+            pools[f"async_replica_{i}"] = engine.pool
+    return {
+        name: pool.status_metrics()
+        for name, pool in pools.items()
+        if isinstance(pool, MeteredPoolMixin)
+    }
+
+
+async def get_async_db(replica: bool = False):
     try:
-        db = get_session_local()
+        db = get_async_session_local(replica)
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def open_session(
+    replica: bool = False,
+) -> AsyncIterator[Union[Session, AsyncSession]]:
+    """
+    Yields an AsyncSession when `database_async` is set, a Session otherwise,
+    on the primary or one of the replicas. Either way, the work on it goes
+    through `run_db`. Raises Overloaded when `max_concurrent_requests`
+    already hold one.
+    """
+    with get_admission().slot():
+        if get_settings().database_async:
+            async for db in get_async_db(replica):
+                yield db
+            return
+
+        db = get_session_local(replica)
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+
+async def get_session() -> AsyncIterator[Union[Session, AsyncSession]]:
+    """A session on the primary, for the routes that write"""
+    async for db in open_session():
+        yield db
+
+
+async def get_replica_session() -> AsyncIterator[Union[Session, AsyncSession]]:
+    """A session on a replica, for reads that needn't be the latest"""
+    async for db in open_session(replica=True):
+        yield db
+
+
+session_scope = asynccontextmanager(get_session)
+
+
+async def run_db(
+    db_session: Union[Session, AsyncSession],
+    func: Callable[..., T],
+    *args,
+    **kwargs,
+) -> T:
+    """
+    Runs `func(session, *args, **kwargs)`, where session is a sync Session.
+
+    With an AsyncSession the function runs through `run_sync`, which drives its
+    IO (lazy loads included) from the event loop without a thread. A sync
+    Session is handed over to the threadpool as FastAPI does with sync routes,
+    within a copy of the caller's context (see `src.metrics`).
+    ORM objects must not leave `func`: anything touching the database after it
+    returns would do so outside the async bridge.
+    """
+    if isinstance(db_session, AsyncSession):
+        return await db_session.run_sync(func, *args, **kwargs)
+    context = contextvars.copy_context()
+    return await run_in_threadpool(context.run, func, db_session, *args, **kwargs)
 
 
 @contextmanager
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from queue import Full, Queue
+from typing import Any, AsyncIterator, Callable, DefaultDict, Dict, List, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from src.broadcast import BroadcastBackend, MessageTooLarge, get_broadcast_backend
+from src.config import get_settings
+from src.lifecycle import GAME_FINISHED, release_remote_game
+from src.models import PlayerModel, RoundModel
+from src.schemas import GameRound, Player, Standing
+
+logger = logging.getLogger(__name__)
+
+EVENTS_QUEUE_SIZE = 100
+# Events waiting to be broadcast, past which they're dropped
+PUBLISH_QUEUE_SIZE = 10_000
+
+Subscriber = Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Dict[str, Any]]"]
+ChangeListener = Callable[[int, Dict[str, Any]], None]
+
+
+class GameEventBroker:
+    """
+    Fans out game events to the websocket connections of each game.
+
+    Events are delivered to this worker's connections straight away and
+    published through the broadcast backend for the other workers, which
+    also notify their change listeners (e.g. to invalidate caches).
+
+    Use cases run in the threadpool, or on the event loop with
+    `database_async` (`AsyncSession.run_sync`). Events are handed over to the
+    subscriber's event loop with `call_soon_threadsafe`, and broadcast in
+    order from a thread of the broker's, so that a backend waiting on the
+    network never blocks the loop.
+    """
+
+    def __init__(self, backend: BroadcastBackend):
+        self.origin = uuid.uuid4().hex
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._subscribers: DefaultDict[int, Set[Subscriber]] = defaultdict(set)
+        self._change_listeners: List[ChangeListener] = []
+        self._outbox: "Queue[Tuple[int, Dict[str, Any]]]" = Queue(
+            maxsize=PUBLISH_QUEUE_SIZE
+        )
+        backend.listen(self._receive)
+        if backend.blocking:
+            threading.Thread(
+                target=self._run_publisher, name="broadcast-publisher", daemon=True
+            ).start()
+
+    @asynccontextmanager
+    async def subscribe(self, game_id: int) -> AsyncIterator["asyncio.Queue"]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[game_id].add(subscriber)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                self._subscribers[game_id].discard(subscriber)
+                if not self._subscribers[game_id]:
+                    del self._subscribers[game_id]
+
+    def on_remote_change(self, listener: ChangeListener):
+        """Calls `listener` with the events of games changed by other workers"""
+        self._change_listeners.append(listener)
+
+    def publish(self, game_id: int, event: Dict[str, Any]):
+        self._deliver(game_id, event)
+        if not self.backend.blocking:
+            self._broadcast(game_id, event)
+            return
+        try:
+            self._outbox.put_nowait((game_id, event))
+        except Full:
+            logger.error("Broadcasting is behind, dropped an event of game %s", game_id)
+
+    def _run_publisher(self):
+        while True:
+            self._broadcast(*self._outbox.get())
+
+    def _broadcast(self, game_id: int, event: Dict[str, Any]):
+        # The change is committed already, failing to broadcast mustn't fail it
+        try:
+            try:
+                self.backend.publish(self._message(game_id, event))
+            except MessageTooLarge:
+                self.backend.publish(
+                    self._message(game_id, game_event("game_changed", None))
+                )
+        except Exception:
+            logger.exception("Broadcasting the event of game %s failed", game_id)
+
+    def _message(self, game_id: int, event: Dict[str, Any]) -> str:
+        return json.dumps({"origin": self.origin, "gameId": game_id, "event": event})
+
+    def _receive(self, message: str):
+        payload = json.loads(message)
+        if payload["origin"] == self.origin:
+            return
+
+        game_id, event = payload["gameId"], payload["event"]
+        for listener in self._change_listeners:
+            listener(game_id, event)
+        self._deliver(game_id, event)
+
+    def _deliver(self, game_id: int, event: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers.get(game_id, ()))
+
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(_offer, queue, event)
+
+
+def _offer(queue: asyncio.Queue, event: Dict[str, Any]):
+    # A client that can't keep up loses events rather than memory;
+    # it can always recover through a fresh snapshot.
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+@lru_cache
+def get_broker() -> GameEventBroker:
+    broker = GameEventBroker(get_broadcast_backend(get_settings().broadcast_url))
+    broker.on_remote_change(release_remote_game)
+    return broker
+
+
+def game_event(event_type: str, data: Any) -> Dict[str, Any]:
+    return {"type": event_type, "data": jsonable_encoder(data, by_alias=True)}
+
+
+def publish_player_joined(player: PlayerModel):
+    get_broker().publish(
+        player.game_id, game_event("player_joined", Player.from_orm(player))
+    )
+
+
+def publish_round_started(game_round: RoundModel):
+    get_broker().publish(
+        game_round.game_id, game_event("round_started", GameRound.from_orm(game_round))
+    )
+
+
+def publish_round_updated(game_round: RoundModel):
+    """The round moved on to its next phase as time ran out"""
+    get_broker().publish(
+        game_round.game_id, game_event("round_updated", GameRound.from_orm(game_round))
+    )
+
+
+def publish_round_voted(game_round: RoundModel):
+    get_broker().publish(
+        game_round.game_id, game_event("round_voted", GameRound.from_orm(game_round))
+    )
+
+
+def publish_game_finished(game_id: int, standings: List[Standing]):
+    get_broker().publish(game_id, game_event(GAME_FINISHED, standings))
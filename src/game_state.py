@@ -0,0 +1,565 @@
+"""
+In-process game state.
+
+Games are small and hot, so with `game_state_store` on they are served from
+compact mirrors of the models kept in memory. Their attributes follow the
+models, so the use cases validate on them and the schemas serialize them as
+they do with the ORM objects.
+
+New rounds are written through (they need their id), votes, verdicts and
+scores are written behind in batches. Whatever is still queued when the
+process dies is lost, the state is rebuilt from the database on startup.
+Being per process, it suits a single worker.
+"""
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload, joinedload
+
+from src.config import get_settings
+from src.constants import Status
+from src.db import get_session_local, transaction, not_found_converter
+from src.lifecycle import on_game_released
+from src.events import get_broker
+from src.leaderboard import count_round_results
+from src.models import GameModel, PlayerModel, RoundModel, VoteModel
+from src.participants import ParticipationQueue
+from src.statement_bank import next_statement
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerState:
+    __slots__ = (
+        "id",
+        "game_id",
+        "name",
+        "score",
+        "is_master",
+        "num_rows",
+        "num_for",
+        "num_against",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        game_id: int,
+        name: str,
+        score: int,
+        is_master: bool,
+        num_rows: int = 0,
+        num_for: int = 0,
+        num_against: int = 0,
+    ):
+        self.id = id
+        self.game_id = game_id
+        self.name = name
+        self.score = score
+        self.is_master = is_master
+        self.num_rows = num_rows
+        self.num_for = num_for
+        self.num_against = num_against
+
+    @classmethod
+    def from_model(cls, player: PlayerModel) -> "PlayerState":
+        return cls(
+            id=player.id,
+            game_id=player.game_id,
+            name=player.name,
+            score=player.score or 0,
+            is_master=bool(player.is_master),
+            num_rows=player.num_rows or 0,
+            num_for=player.num_for or 0,
+            num_against=player.num_against or 0,
+        )
+
+
+class VoteState:
+    __slots__ = ("player_id", "verdict")
+
+    def __init__(self, player_id: int, verdict: bool):
+        self.player_id = player_id
+        self.verdict = verdict
+
+
+class RoundState:
+    __slots__ = (
+        "id",
+        "game",
+        "statement",
+        "verdict",
+        "created_at",
+        "status",
+        "player_for",
+        "player_against",
+        "votes",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        game: "GameState",
+        statement: str,
+        created_at: datetime,
+        player_for: PlayerState,
+        player_against: PlayerState,
+        status: Status = Status.PLAYING,
+        verdict: Optional[bool] = None,
+        votes: Optional[List[VoteState]] = None,
+    ):
+        self.id = id
+        self.game = game
+        self.statement = statement
+        self.created_at = created_at
+        self.player_for = player_for
+        self.player_against = player_against
+        self.status = status
+        self.verdict = verdict
+        self.votes = votes or []
+
+    @property
+    def game_id(self) -> int:
+        return self.game.id
+
+    @property
+    def player_for_id(self) -> int:
+        return self.player_for.id
+
+    @property
+    def player_against_id(self) -> int:
+        return self.player_against.id
+
+    @property
+    def num_votes(self) -> int:
+        return len(self.votes)
+
+
+class GameState:
+    __slots__ = (
+        "id",
+        "status",
+        "secs_per_round",
+        "join_token",
+        "statement_start",
+        "statement_cursor",
+        "revision",
+        "players",
+        "rounds",
+        "round_pending",
+        "participation",
+        "lock",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        status: Status,
+        secs_per_round: int,
+        join_token: str,
+        statement_start: int,
+        statement_cursor: Optional[int] = None,
+        revision: int = 0,
+    ):
+        self.id = id
+        self.status = status
+        self.secs_per_round = secs_per_round
+        self.join_token = join_token
+        self.statement_start = statement_start
+        self.statement_cursor = statement_cursor
+        self.revision = revision
+        self.players: List[PlayerState] = []
+        self.rounds: List[RoundState] = []
+        # Set while a new round is being written, so no other one starts
+        self.round_pending = False
+        self.participation = ParticipationQueue()
+        self.lock = threading.Lock()
+
+    @property
+    def join_link(self) -> str:
+        return f"/game/join/{self.join_token}"
+
+    @property
+    def current_round(self) -> Optional[RoundState]:
+        if self.rounds:
+            return self.rounds[-1]
+        return None
+
+    def player(self, player_id: int) -> Optional[PlayerState]:
+        return next((i for i in self.players if i.id == player_id), None)
+
+    @classmethod
+    def from_model(cls, game: GameModel) -> "GameState":
+        game_state = cls(
+            id=game.id,
+            status=game.status,
+            secs_per_round=game.secs_per_round,
+            join_token=game.join_token,
+            statement_start=game.statement_start,
+            statement_cursor=game.statement_cursor,
+            revision=game.revision,
+        )
+        game_state.players = [PlayerState.from_model(i) for i in game.players]
+        game_state.participation = ParticipationQueue.from_players(game_state.players)
+        players = {i.id: i for i in game_state.players}
+        game_state.rounds = [
+            RoundState(
+                id=i.id,
+                game=game_state,
+                statement=i.statement,
+                created_at=i.created_at,
+                player_for=players[i.player_for_id],
+                player_against=players[i.player_against_id],
+                status=i.status,
+                verdict=i.verdict,
+                votes=[VoteState(v.player_id, v.verdict) for v in i.votes],
+            )
+            for i in game.rounds
+        ]
+        return game_state
+
+
+class WriteBehind:
+    """
+    Queues votes, round verdicts and scores, and writes them in one
+    transaction per batch, from a background thread.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._votes: List[dict] = []
+        self._tallies: Counter = Counter()
+        self._verdicts: Dict[int, Optional[bool]] = {}
+        self._scores: Counter = Counter()
+        self._revisions: Counter = Counter()
+
+    def add_vote(self, game_id: int, round_id: int, player_id: int, verdict: bool):
+        def queue():
+            self._votes.append(
+                {
+                    "round_id": round_id,
+                    "player_id": player_id,
+                    "verdict": verdict,
+                    "created_at": datetime.utcnow(),
+                }
+            )
+            self._tallies[(round_id, verdict)] += 1
+            self._revisions[game_id] += 1
+
+        self._queue(queue)
+
+    def add_revision(self, game_id: int):
+        def queue():
+            self._revisions[game_id] += 1
+
+        self._queue(queue)
+
+    def finish_round(
+        self, round_id: int, verdict: Optional[bool], winner_id: Optional[int]
+    ):
+        def queue():
+            self._verdicts[round_id] = verdict
+            if winner_id is not None:
+                self._scores[winner_id] += 1
+
+        self._queue(queue)
+
+    def _queue(self, add):
+        with self._lock:
+            add()
+            pending = len(self._votes)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="game-state-writer", daemon=True
+                )
+                self._thread.start()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing the game state behind failed")
+
+    def flush(self):
+        # Batches are written in order, one at a time
+        with self._flush_lock:
+            with self._lock:
+                votes, self._votes = self._votes, []
+                tallies, self._tallies = self._tallies, Counter()
+                verdicts, self._verdicts = self._verdicts, {}
+                scores, self._scores = self._scores, Counter()
+                revisions, self._revisions = self._revisions, Counter()
+
+            if not votes and not verdicts:
+                return
+
+            try:
+                try:
+                    self._write(votes, tallies, verdicts, scores, revisions)
+                except IntegrityError:
+                    # A vote that can never be written mustn't hold up the rest
+                    self._write_apart(votes, verdicts, scores, revisions)
+            except Exception:
+                with self._lock:
+                    self._votes[:0] = votes
+                    self._tallies.update(tallies)
+                    self._verdicts = {**verdicts, **self._verdicts}
+                    self._scores.update(scores)
+                    self._revisions.update(revisions)
+                raise
+
+    def _write_apart(
+        self,
+        votes: List[dict],
+        verdicts: Dict[int, Optional[bool]],
+        scores: Counter,
+        revisions: Counter,
+    ):
+        """
+        Writes the votes one at a time, with their tallies, dropping those
+        that fail: already cast, or for a round archived meanwhile. Requeued
+        after a failure, the votes written are dropped as already cast.
+        """
+        for vote in votes:
+            tally = Counter({(vote["round_id"], vote["verdict"]): 1})
+            try:
+                self._write([vote], tally, {}, Counter(), Counter())
+            except IntegrityError:
+                logger.exception("Dropping a vote that can't be written: %s", vote)
+        self._write([], Counter(), verdicts, scores, revisions)
+
+    @staticmethod
+    def _write(
+        votes: List[dict],
+        tallies: Counter,
+        verdicts: Dict[int, Optional[bool]],
+        scores: Counter,
+        revisions: Counter,
+    ):
+        db_session = get_session_local()
+        try:
+            with transaction(db_session):
+                if votes:
+                    db_session.execute(insert(VoteModel.__table__), votes)
+                for (round_id, verdict), num_votes in tallies.items():
+                    tally = (
+                        RoundModel.num_votes_for
+                        if verdict
+                        else RoundModel.num_votes_against
+                    )
+                    db_session.execute(
+                        update(RoundModel)
+                        .where(RoundModel.id == round_id)
+                        .values({tally: tally + num_votes})
+                    )
+                for round_id, verdict in verdicts.items():
+                    db_session.execute(
+                        update(RoundModel)
+                        .where(RoundModel.id == round_id)
+                        .values(status=Status.FINISHED, verdict=verdict)
+                    )
+                if verdicts:
+                    count_round_results(db_session, list(verdicts))
+                for player_id, points in scores.items():
+                    db_session.execute(
+                        update(PlayerModel)
+                        .where(PlayerModel.id == player_id)
+                        .values(score=PlayerModel.score + points)
+                    )
+                for game_id, num_changes in revisions.items():
+                    db_session.execute(
+                        update(GameModel)
+                        .where(GameModel.id == game_id)
+                        .values(revision=GameModel.revision + num_changes)
+                    )
+        finally:
+            db_session.close()
+
+
+def count_participation(
+    db_session: Session, player_for_id: int, player_against_id: int
+):
+    db_session.execute(
+        update(PlayerModel)
+        .where(PlayerModel.id == player_for_id)
+        .values(num_rows=PlayerModel.num_rows + 1, num_for=PlayerModel.num_for + 1)
+    )
+    db_session.execute(
+        update(PlayerModel)
+        .where(PlayerModel.id == player_against_id)
+        .values(
+            num_rows=PlayerModel.num_rows + 1,
+            num_against=PlayerModel.num_against + 1,
+        )
+    )
+
+
+class GameStateStore:
+    def __init__(self, writer: WriteBehind):
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._games: Dict[int, GameState] = {}
+
+    def get(self, game_id: int) -> Optional[GameState]:
+        return self._games.get(game_id)
+
+    @not_found_converter
+    def load(self, db_session: Session, game_id: int) -> GameState:
+        game = self.get_query(db_session).filter(GameModel.id == game_id).one()
+        if game.status == Status.FINISHED:
+            # Served, but not kept: finished games are released
+            return GameState.from_model(game)
+        state = GameState.from_model(game)
+        # Loaded outside the lock: a concurrent load of the same game wins
+        with self._lock:
+            kept = self._games.setdefault(game_id, state)
+        if kept is state:
+            # Players who joined as it loaded found no game to be added to
+            newer = db_session.query(PlayerModel).filter(
+                PlayerModel.game_id == game_id,
+                PlayerModel.id > max((i.id for i in state.players), default=0),
+            )
+            for player in newer.order_by(PlayerModel.id):
+                self.add_player(player)
+        return kept
+
+    def reload(self, db_session: Session) -> int:
+        """Rebuilds the state of every unfinished game, returns how many"""
+        self.writer.flush()
+        games = (
+            self.get_query(db_session).filter(GameModel.status != Status.FINISHED).all()
+        )
+        with self._lock:
+            self._games = {i.id: GameState.from_model(i) for i in games}
+            return len(self._games)
+
+    @staticmethod
+    def get_query(db_session: Session):
+        return db_session.query(GameModel).options(
+            selectinload(GameModel.players),
+            selectinload(GameModel.rounds).options(
+                joinedload(RoundModel.player_for),
+                joinedload(RoundModel.player_against),
+                selectinload(RoundModel.votes),
+            ),
+        )
+
+    def add_player(self, player: PlayerModel):
+        game = self.get(player.game_id)
+        if game is not None:
+            with game.lock:
+                # Added already by the load that found it
+                if game.player(player.id) is not None:
+                    return
+                game.players.append(PlayerState.from_model(player))
+                game.participation.add(player.id)
+                # join_game has bumped the stored one already
+                game.revision += 1
+
+    def insert_round(
+        self,
+        db_session: Session,
+        game: GameState,
+        player_for_id: int,
+        player_against_id: int,
+    ) -> RoundState:
+        """
+        Writes through a round whose start was validated under `game.lock`.
+        No other round of the game starts meanwhile, so the game's statement
+        cursor is this round's to move.
+        """
+        created_at = datetime.utcnow()
+        try:
+            with transaction(db_session):
+                statement = next_statement(db_session, game)
+                db_session.execute(
+                    update(GameModel)
+                    .where(GameModel.id == game.id)
+                    .values(
+                        status=Status.PLAYING,
+                        statement_cursor=statement.shuffle_key,
+                        revision=GameModel.revision + 1,
+                    )
+                )
+                game_round = RoundModel(
+                    statement=statement.text,
+                    statement_id=statement.id,
+                    player_for_id=player_for_id,
+                    player_against_id=player_against_id,
+                    game_id=game.id,
+                    created_at=created_at,
+                )
+                db_session.add(game_round)
+                count_participation(db_session, player_for_id, player_against_id)
+        except Exception:
+            game.round_pending = False
+            raise
+
+        round_state = RoundState(
+            id=game_round.id,
+            game=game,
+            statement=statement.text,
+            created_at=created_at,
+            player_for=game.player(player_for_id),
+            player_against=game.player(player_against_id),
+        )
+        with game.lock:
+            game.rounds.append(round_state)
+            game.status = Status.PLAYING
+            game.statement_cursor = statement.shuffle_key
+            game.revision += 1
+            game.participation.count_round(player_for_id, player_against_id)
+            round_state.player_for.num_rows += 1
+            round_state.player_for.num_for += 1
+            round_state.player_against.num_rows += 1
+            round_state.player_against.num_against += 1
+            game.round_pending = False
+        return round_state
+
+    def discard(self, game_ids: Set[int]):
+        with self._lock:
+            for game_id in game_ids:
+                self._games.pop(game_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+
+@lru_cache
+def get_game_state_store() -> GameStateStore:
+    settings = get_settings()
+    store = GameStateStore(
+        WriteBehind(
+            interval=settings.game_state_flush_interval,
+            batch_size=settings.game_state_flush_size,
+        )
+    )
+    # Games changed by another worker are reloaded on their next use
+    get_broker().on_remote_change(lambda game_id, event: store.discard({game_id}))
+    on_game_released(lambda released: store.discard({released.game_id}))
+    return store
+
+
+def reload_game_states() -> int:
+    db_session = get_session_local()
+    try:
+        return get_game_state_store().reload(db_session)
+    finally:
+        db_session.close()
@@ -0,0 +1,183 @@
+"""
+`Idempotency-Key` support for the POST endpoints, so that clients can retry
+a request whose response they didn't get without doing its work twice.
+"""
+import asyncio
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from starlette import status
+from starlette.datastructures import Headers
+from starlette.requests import cookie_parser
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.cache import TTLCache
+from src.config import get_settings
+from src.constants import GAME_SESSION_KEY
+
+IDEMPOTENCY_KEY_HEADER = "idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+# Not outcomes of the request, but of when it came: its retries run again
+RETRIED_STATUSES = {
+    status.HTTP_409_CONFLICT,
+    status.HTTP_429_TOO_MANY_REQUESTS,
+}
+
+# Key, path and session of a request, and the client of one without a session
+CacheKey = Tuple[str, str, Optional[str], Optional[str]]
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: bytes
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+@lru_cache
+def get_idempotency_cache() -> TTLCache[StoredResponse]:
+    settings = get_settings()
+    return TTLCache(
+        maxsize=settings.idempotency_cache_size, ttl=settings.idempotency_ttl
+    )
+
+
+class IdempotencyMiddleware:
+    """
+    Replays the response of a POST with an `Idempotency-Key` to its retries,
+    cookies included, without running it again. Responses are kept by key,
+    path and session, unless they failed with a 5xx, a 409 or a 429 so that
+    those can be retried. Those of requests without a session (creating and joining a
+    game) are kept by client too, its address and user agent, so another
+    client sending the same key never gets their session cookie. A retry
+    arriving while the first attempt runs waits for it, and reusing a key
+    for another body is rejected. Bodies are kept in memory to compare
+    retries on, up to `idempotency_max_body` bytes.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._in_flight: Dict[CacheKey, asyncio.Event] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(IDEMPOTENCY_KEY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        session = cookie_parser(headers.get("cookie", "")).get(GAME_SESSION_KEY)
+        client = None if session else get_client(scope, headers)
+        cache_key = (idempotency_key, scope["path"], session, client)
+        body = await read_body(receive, get_settings().idempotency_max_body)
+        if body is None:
+            response = JSONResponse(
+                content={"error": "Request body too large"},
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+            await response(scope, receive, send)
+            return
+        fingerprint = hashlib.sha256(body).digest()
+
+        cache = get_idempotency_cache()
+        while cache_key in self._in_flight:
+            await self._in_flight[cache_key].wait()
+
+        stored = cache.get(cache_key)
+        if stored is not None:
+            await replay(stored, fingerprint, scope, receive, send)
+            return
+
+        self._in_flight[cache_key] = done = asyncio.Event()
+        try:
+            response = await self.run(scope, body, receive, send)
+            if response is not None and is_final(response[0]):
+                cache.set(cache_key, StoredResponse(fingerprint, *response))
+        finally:
+            del self._in_flight[cache_key]
+            done.set()
+
+    async def run(
+        self, scope: Scope, body: bytes, receive: Receive, send: Send
+    ) -> Optional[Tuple[int, List[Tuple[bytes, bytes]], bytes]]:
+        """Runs the request, returns the response it sent"""
+        body_sent = False
+        response_status = None
+        response_headers: List[Tuple[bytes, bytes]] = []
+        chunks: List[bytes] = []
+
+        async def receive_body() -> Message:
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send_and_keep(message: Message):
+            nonlocal response_status, response_headers
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive_body, send_and_keep)
+        if response_status is None:
+            return None
+        return response_status, response_headers, b"".join(chunks)
+
+
+def is_final(response_status: int) -> bool:
+    return response_status < 500 and response_status not in RETRIED_STATUSES
+
+
+def get_client(scope: Scope, headers: Headers) -> str:
+    host = scope["client"][0] if scope.get("client") else ""
+    return f"{host} {headers.get('user-agent', '')}"
+
+
+async def read_body(receive: Receive, max_size: int) -> Optional[bytes]:
+    """Reads the request's body, None past `max_size` bytes"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_size:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def replay(
+    stored: StoredResponse,
+    fingerprint: bytes,
+    scope: Scope,
+    receive: Receive,
+    send: Send,
+):
+    if stored.fingerprint != fingerprint:
+        response = JSONResponse(
+            content={"error": "Idempotency key reused for another request"},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+        await response(scope, receive, send)
+        return
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": stored.status,
+            "headers": stored.headers + [REPLAYED_HEADER],
+        }
+    )
+    await send({"type": "http.response.body", "body": stored.body})
@@ -0,0 +1,261 @@
+"""
+Leaderboards across games: win rates of the for and against sides of every
+statement, stats per topic, and players by name.
+
+They're aggregates kept up to date rather than computed on read: the rounds
+getting their verdict are added to them in the transaction that settles
+them, with upserts incrementing the stored counts. Reads are index seeks,
+paged with keyset cursors, at a cost per page whatever the number of games
+played.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+from sqlalchemy import Float, and_, case, cast, func, or_, select, true
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.models import (
+    PlayerModel,
+    PlayerStatsModel,
+    RoundModel,
+    StatementModel,
+    StatementStatsModel,
+    TopicModel,
+    TopicStatsModel,
+)
+from src.schemas import PlayerStats, StatementStats, TopicStats
+from src.statement_bank import DIALECT_INSERTS
+
+SIDES = ("for", "against")
+
+
+def count_round_results(connection: Union[Session, Connection], round_ids: Any):
+    """
+    Adds rounds that just got their verdict to the leaderboards: `round_ids`
+    is a list or a select of them. Doesn't commit.
+    """
+    if isinstance(connection, Session):
+        connection = connection.connection()
+    dialect_insert = DIALECT_INSERTS[connection.dialect.name]
+    rounds = RoundModel.id.in_(round_ids)
+
+    num_rounds = func.count(RoundModel.id)
+    wins_for = func.sum(case((RoundModel.verdict.is_(True), 1), else_=0))
+    wins_against = func.sum(case((RoundModel.verdict.is_(False), 1), else_=0))
+    num_votes = func.sum(RoundModel.num_votes_for + RoundModel.num_votes_against)
+
+    stats = StatementStatsModel.__table__.c
+    insert = dialect_insert(StatementStatsModel).from_select(
+        [
+            "statement_id",
+            "num_rounds",
+            "wins_for",
+            "wins_against",
+            "for_win_rate",
+            "against_win_rate",
+        ],
+        select(
+            RoundModel.statement_id,
+            num_rounds,
+            wins_for,
+            wins_against,
+            cast(wins_for, Float) / num_rounds,
+            cast(wins_against, Float) / num_rounds,
+        )
+        .where(rounds, RoundModel.statement_id.isnot(None))
+        .group_by(RoundModel.statement_id),
+    )
+    total = stats.num_rounds + insert.excluded.num_rounds
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=["statement_id"],
+            set_={
+                "num_rounds": total,
+                "wins_for": stats.wins_for + insert.excluded.wins_for,
+                "wins_against": stats.wins_against + insert.excluded.wins_against,
+                "for_win_rate": cast(stats.wins_for + insert.excluded.wins_for, Float)
+                / total,
+                "against_win_rate": cast(
+                    stats.wins_against + insert.excluded.wins_against, Float
+                )
+                / total,
+            },
+        )
+    )
+
+    stats = TopicStatsModel.__table__.c
+    insert = dialect_insert(TopicStatsModel).from_select(
+        ["topic_id", "num_rounds", "wins_for", "wins_against", "num_votes"],
+        select(StatementModel.topic_id, num_rounds, wins_for, wins_against, num_votes)
+        .join(StatementModel, StatementModel.id == RoundModel.statement_id)
+        .where(rounds, StatementModel.topic_id.isnot(None))
+        .group_by(StatementModel.topic_id),
+    )
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=["topic_id"],
+            set_={
+                i: getattr(stats, i) + getattr(insert.excluded, i)
+                for i in ("num_rounds", "wins_for", "wins_against", "num_votes")
+            },
+        )
+    )
+
+    won = case(
+        (
+            and_(
+                RoundModel.verdict.is_(True),
+                PlayerModel.id == RoundModel.player_for_id,
+            ),
+            1,
+        ),
+        (
+            and_(
+                RoundModel.verdict.is_(False),
+                PlayerModel.id == RoundModel.player_against_id,
+            ),
+            1,
+        ),
+        else_=0,
+    )
+    stats = PlayerStatsModel.__table__.c
+    insert = dialect_insert(PlayerStatsModel).from_select(
+        ["name", "num_rounds", "num_wins"],
+        select(PlayerModel.name, num_rounds, func.sum(won))
+        .join(
+            PlayerModel,
+            or_(
+                PlayerModel.id == RoundModel.player_for_id,
+                PlayerModel.id == RoundModel.player_against_id,
+            ),
+        )
+        .where(rounds)
+        .group_by(PlayerModel.name),
+    )
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=["name"],
+            set_={
+                "num_rounds": stats.num_rounds + insert.excluded.num_rounds,
+                "num_wins": stats.num_wins + insert.excluded.num_wins,
+            },
+        )
+    )
+
+
+def encode_cursor(key: Tuple) -> str:
+    """The opaque cursor of the page after the row of sort key `key`"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: Tuple[Any, Any]) -> List:
+    """The sort key of a cursor, checked against the `types` of its values"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != len(types):
+        raise ValueError("Invalid cursor")
+    for value, expected in zip(key, types):
+        # JSON booleans are ints to Python
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise ValueError("Invalid cursor")
+    return key
+
+
+def after(ranking, tiebreak, cursor: Optional[str], types: Tuple[Any, Any]):
+    """Seeks past a cursor, in `ranking` descending then `tiebreak` order"""
+    if cursor is None:
+        return true()
+    value, tiebreak_value = decode_cursor(cursor, types)
+    # The first bound seeks the index, the second only skips the ties seen
+    return and_(ranking <= value, or_(ranking < value, tiebreak > tiebreak_value))
+
+
+def paginate(
+    rows: List, limit: int, key: Callable[[Any], Tuple]
+) -> Tuple[List, Optional[str]]:
+    """A page of the rows fetched `limit + 1` at most, and the next cursor"""
+    page = rows[:limit]
+    if len(rows) > limit:
+        return page, encode_cursor(key(page[-1]))
+    return page, None
+
+
+def top_players(
+    db_session: Session, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[PlayerStats], Optional[str]]:
+    """Players by rounds won"""
+    stats = PlayerStatsModel
+    rows = db_session.execute(
+        select(stats.name, stats.num_rounds, stats.num_wins)
+        .where(after(stats.num_wins, stats.name, cursor, (int, str)))
+        .order_by(stats.num_wins.desc(), stats.name)
+        .limit(limit + 1)
+    ).all()
+    page = [
+        PlayerStats(name=name, rounds_played=num_rounds, wins=num_wins)
+        for name, num_rounds, num_wins in rows
+    ]
+    return paginate(page, limit, lambda i: (i.wins, i.name))
+
+
+def top_statements(
+    db_session: Session, side: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[StatementStats], Optional[str]]:
+    """Statements by the win rate of the `side` arguing them"""
+    if side not in SIDES:
+        raise ValueError(f"Unknown side: {side}")
+    stats = StatementStatsModel
+    win_rate = stats.for_win_rate if side == "for" else stats.against_win_rate
+    rows = db_session.execute(
+        select(stats, StatementModel.text, TopicModel.name)
+        .join(StatementModel, StatementModel.id == stats.statement_id)
+        .outerjoin(TopicModel, TopicModel.id == StatementModel.topic_id)
+        .where(after(win_rate, stats.statement_id, cursor, ((int, float), int)))
+        .order_by(win_rate.desc(), stats.statement_id)
+        .limit(limit + 1)
+    ).all()
+    page = [
+        StatementStats(
+            id=i.statement_id,
+            statement=text,
+            topic=topic,
+            rounds_played=i.num_rounds,
+            wins_for=i.wins_for,
+            wins_against=i.wins_against,
+            for_win_rate=i.for_win_rate,
+            against_win_rate=i.against_win_rate,
+        )
+        for i, text, topic in rows
+    ]
+    return paginate(page, limit, lambda i: (getattr(i, f"{side}_win_rate"), i.id))
+
+
+def top_topics(
+    db_session: Session, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[TopicStats], Optional[str]]:
+    """Topics by rounds played"""
+    stats = TopicStatsModel
+    rows = db_session.execute(
+        select(stats, TopicModel.name)
+        .join(TopicModel, TopicModel.id == stats.topic_id)
+        .where(after(stats.num_rounds, stats.topic_id, cursor, (int, int)))
+        .order_by(stats.num_rounds.desc(), stats.topic_id)
+        .limit(limit + 1)
+    ).all()
+    page = [
+        TopicStats(
+            id=i.topic_id,
+            topic=name,
+            rounds_played=i.num_rounds,
+            wins_for=i.wins_for,
+            wins_against=i.wins_against,
+            num_votes=i.num_votes,
+        )
+        for i, name in rows
+    ]
+    return paginate(page, limit, lambda i: (i.rounds_played, i.id))
@@ -0,0 +1,43 @@
+"""
+The end of games. Whatever a worker keeps per game (the in-memory store,
+snapshots, timers, rate limits) subscribes to their release, so that it's
+bounded by the games being played rather than by every game ever played.
+"""
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+GAME_FINISHED = "game_finished"
+
+
+class GameReleased(NamedTuple):
+    game_id: int
+    # The rounds it had in play, whose timers are due no more
+    round_ids: Tuple[int, ...] = ()
+
+
+ReleaseHook = Callable[[GameReleased], None]
+
+_release_hooks: List[ReleaseHook] = []
+
+
+def on_game_released(hook: ReleaseHook) -> ReleaseHook:
+    """Calls `hook` as games finish or are archived, on every worker"""
+    _release_hooks.append(hook)
+    return hook
+
+
+def release_game(released: GameReleased):
+    # The game is over already, a failing hook mustn't fail the others
+    for hook in list(_release_hooks):
+        try:
+            hook(released)
+        except Exception:
+            logger.exception("Releasing game %s failed", released.game_id)
+
+
+def release_remote_game(game_id: int, event: Dict[str, Any]):
+    """Releases the games finished by other workers, as their events arrive"""
+    if event["type"] == GAME_FINISHED:
+        release_game(GameReleased(game_id))
@@ -1,24 +1,39 @@
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from starlette import status
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from starlette.responses import JSONResponse
 
+from src.admission import Overloaded, RateLimited
+from src.archive import get_archiver
 from src.config import get_settings
-from src.db import Base, get_engine, NoResultFound
+from src.db import get_engine, NoResultFound
+from src.game_state import get_game_state_store, reload_game_states
+from src.idempotency import IdempotencyMiddleware
+from src.metrics import MetricsMiddleware
+from src.migrations import migrate
 from src.routes import router
+from src.timers import get_timers
+from src.use_cases import get_idle_sweeper, rebuild_round_timers
 
 
 def get_app() -> FastAPI:
-    Base.metadata.create_all(get_engine())
-    app = FastAPI()
+    settings = get_settings()
+    app = FastAPI(
+        default_response_class=ORJSONResponse if settings.fast_json else JSONResponse
+    )
     app.include_router(router)
 
     return app
 
 
 app = get_app()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Checked as files are served rather than as the app is built
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
+# Inside CORS, so that replays get the headers of their own origin
+app.add_middleware(IdempotencyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3000/"],
@@ -26,33 +41,109 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, routes=app.routes)
 
 
-@app.middleware("http")
-async def error_handling_middleware(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except PermissionError:
-        return JSONResponse(
-            content={"error": "Not allowed"},
-            status_code=status.HTTP_401_UNAUTHORIZED,
-        )
-    except NoResultFound:
-        return JSONResponse(
-            content={"error": "Not found"},
-            status_code=status.HTTP_404_NOT_FOUND,
-        )
-    except ValueError:
-        return JSONResponse(
-            content={"error": "Value error"},
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-        )
-    except Exception:
-        if get_settings().debug:
-            raise
-
-        return JSONResponse(
-            content={"error": "Something went wrong"},
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        )
+@app.on_event("startup")
+async def migrate_schema():
+    if get_settings().migrate_on_startup:
+        await run_in_threadpool(migrate, get_engine())
+
+
+@app.on_event("startup")
+async def load_game_states():
+    if get_settings().game_state_store:
+        await run_in_threadpool(reload_game_states)
+
+
+@app.on_event("startup")
+async def start_round_timers():
+    if get_settings().round_timers:
+        await run_in_threadpool(rebuild_round_timers)
+        get_timers().start()
+
+
+@app.on_event("startup")
+async def start_idle_sweeper():
+    get_idle_sweeper().start()
+
+
+@app.on_event("startup")
+async def start_archiver():
+    get_archiver().start()
+
+
+@app.on_event("shutdown")
+async def stop_archiver():
+    await get_archiver().stop()
+
+
+@app.on_event("shutdown")
+async def stop_idle_sweeper():
+    await get_idle_sweeper().stop()
+
+
+@app.on_event("shutdown")
+async def stop_round_timers():
+    await get_timers().stop()
+
+
+@app.on_event("shutdown")
+async def flush_game_states():
+    await run_in_threadpool(get_game_state_store().writer.flush)
+
+
+# Registered as exception handlers rather than caught in an http middleware:
+# since starlette 0.16 `call_next` runs the app in a task group, so exceptions
+# raised by the endpoints no longer reach the middleware.
+@app.exception_handler(PermissionError)
+async def permission_error_handler(request: Request, exc: PermissionError):
+    return JSONResponse(
+        content={"error": "Not allowed"},
+        status_code=status.HTTP_401_UNAUTHORIZED,
+    )
+
+
+@app.exception_handler(NoResultFound)
+async def not_found_handler(request: Request, exc: NoResultFound):
+    return JSONResponse(
+        content={"error": "Not found"},
+        status_code=status.HTTP_404_NOT_FOUND,
+    )
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        content={"error": "Too many requests"},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        content={"error": "Overloaded"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(ValueError)
+async def value_error_handler(request: Request, exc: ValueError):
+    return JSONResponse(
+        content={"error": "Value error"},
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+
+@app.exception_handler(Exception)
+async def error_handler(request: Request, exc: Exception):
+    if get_settings().debug:
+        raise exc
+
+    return JSONResponse(
+        content={"error": "Something went wrong"},
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+    )
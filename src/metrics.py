@@ -0,0 +1,270 @@
+"""
+Request instrumentation: latency per route, database queries and session
+token decoding. Exposed in Prometheus' text format on `/metrics`, and per
+response in the `Server-Timing` header.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.routing import BaseRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+JWT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Pool figures growing for as long as the process lives
+POOL_COUNTERS = {"checkouts", "timeouts", "wait_seconds"}
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: Sequence[float],
+        label_names: Sequence[str] = (),
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        # Per label values: the count of every bucket (+Inf last) and the sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            counts, total = self._series.setdefault(
+                label_values, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [(k, list(c), t[0]) for k, (c, t) in self._series.items()]
+
+        for label_values, counts, total in sorted(series):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = format_labels(labels + [("le", str(bucket))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\""))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.request_duration = Histogram(
+            "http_request_duration_seconds",
+            "Time to serve a request",
+            LATENCY_BUCKETS,
+            ("method", "route", "status"),
+        )
+        self.request_db_queries = Histogram(
+            "http_request_db_queries",
+            "Database queries run by a request",
+            QUERIES_BUCKETS,
+            ("method", "route"),
+        )
+        self.request_db_duration = Histogram(
+            "http_request_db_duration_seconds",
+            "Time a request spends running database queries",
+            LATENCY_BUCKETS,
+            ("method", "route"),
+        )
+        self.db_query_duration = Histogram(
+            "db_query_duration_seconds",
+            "Time to run a database query, background work included",
+            LATENCY_BUCKETS,
+        )
+        self.jwt_decode_duration = Histogram(
+            "jwt_decode_duration_seconds",
+            "Time to read a session token, cache lookup included",
+            JWT_BUCKETS,
+        )
+
+    def observe_request(
+        self,
+        method: str,
+        route: str,
+        status_code: int,
+        seconds: float,
+        timings: "RequestTimings",
+    ):
+        self.request_duration.observe(seconds, method, route, str(status_code))
+        self.request_db_queries.observe(timings.db_queries, method, route)
+        self.request_db_duration.observe(timings.db_seconds, method, route)
+
+    def render(self, pools: Dict[str, Dict[str, float]]) -> str:
+        lines = []
+        for histogram in (
+            self.request_duration,
+            self.request_db_queries,
+            self.request_db_duration,
+            self.db_query_duration,
+            self.jwt_decode_duration,
+        ):
+            lines.extend(histogram.render())
+
+        metric_names = sorted({name for pool in pools.values() for name in pool})
+        for name in metric_names:
+            if name in POOL_COUNTERS:
+                metric, metric_type = f"db_pool_{name}_total", "counter"
+            else:
+                metric, metric_type = f"db_pool_{name}", "gauge"
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for engine, pool in sorted(pools.items()):
+                lines.append(
+                    f"{metric}{format_labels([('engine', engine)])} {pool[name]}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+@lru_cache
+def get_metrics() -> Metrics:
+    return Metrics()
+
+
+class RequestTimings:
+    """Where the time of the current request goes"""
+
+    __slots__ = ("db_queries", "db_seconds", "jwt_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.jwt_seconds = 0.0
+
+    def server_timing(self, app_seconds: float) -> str:
+        return ", ".join(
+            (
+                f"app;dur={app_seconds * 1000:.2f}",
+                f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_queries} queries"',
+                f"jwt;dur={self.jwt_seconds * 1000:.2f}",
+            )
+        )
+
+
+# Set by the middleware; the threadpool work of `run_db` runs in a copy of
+# the request's context, so it updates the same timings.
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_query(seconds: float):
+    get_metrics().db_query_duration.observe(seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.db_queries += 1
+        timings.db_seconds += seconds
+
+
+def record_jwt_decode(seconds: float):
+    get_metrics().jwt_decode_duration.observe(seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.jwt_seconds += seconds
+
+
+def instrument_engine(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        record_query(time.perf_counter() - conn.info["query_start"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+class MetricsMiddleware:
+    """
+    Times every http request, labelled by its route template rather than
+    its path so that the number of series stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp, routes: List[BaseRoute]):
+        self.app = app
+        self.routes = routes
+        self._route_paths: Optional[Dict[object, str]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", []))
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    timings.server_timing(time.perf_counter() - start),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+            get_metrics().observe_request(
+                scope["method"],
+                self.route_path(scope),
+                status_code,
+                time.perf_counter() - start,
+                timings,
+            )
+
+    def route_path(self, scope: Scope) -> str:
+        # The router leaves the matched endpoint in the scope
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None) or getattr(route, "app"): route.path
+                for route in self.routes
+                if hasattr(route, "path")
+            }
+        return self._route_paths.get(scope.get("endpoint"), UNMATCHED_ROUTE)
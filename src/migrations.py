@@ -0,0 +1,361 @@
+"""
+Schema migrations.
+
+An empty database is created from the models and stamped with every
+migration. One created by `create_all` before migrations existed is taken
+as the baseline, the schema of the first release, and migrated from there.
+Each migration is applied in a transaction along with its record.
+
+Migrations check what's there before changing it, so they can be applied
+again: a version recorded under another migration's name, as left by an
+earlier numbering, is applied again under its current one. On Postgres,
+workers starting together migrate one at a time, under an advisory lock.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, List, NamedTuple, Sequence
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    String,
+    Table,
+    bindparam,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from src import statement_bank  # noqa: F401 the tables, and seeding the bank
+from src.constants import Status
+from src.db import Base
+from src.leaderboard import count_round_results
+from src.models import (
+    ArchivedGameModel,
+    GameModel,
+    PlayerModel,
+    PlayerStatsModel,
+    RoundModel,
+    StatementModel,
+    StatementStatsModel,
+    TopicModel,
+    TopicStatsModel,
+    VoteModel,
+    game_topics,
+    generate_shuffle_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# Key of the Postgres advisory lock held while migrating
+MIGRATION_LOCK_KEY = 0x6D696772617465
+
+schema_migrations = Table(
+    "schema_migrations",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def create_schema(connection: Connection):
+    Base.metadata.create_all(connection)
+
+
+def add_column(connection: Connection, table: str, column: str, ddl: str) -> bool:
+    """Adds the column unless it's there already, returns whether it was added"""
+    columns = [i["name"] for i in inspect(connection).get_columns(table)]
+    if column in columns:
+        return False
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def add_vote_tallies(connection: Connection):
+    added = [
+        add_column(connection, "rounds", column, "INTEGER NOT NULL DEFAULT 0")
+        for column in ("num_votes_for", "num_votes_against")
+    ]
+    if not any(added):
+        return
+    # Tallied from the votes cast so far
+    for column, verdict in (("num_votes_for", True), ("num_votes_against", False)):
+        connection.execute(
+            update(RoundModel).values(
+                {
+                    column: select(func.count(VoteModel.id))
+                    .where(VoteModel.round_id == RoundModel.id)
+                    .where(VoteModel.verdict.is_(verdict))
+                    .scalar_subquery()
+                }
+            )
+        )
+
+
+def add_participation_counters(connection: Connection):
+    added = [
+        add_column(connection, "players", column, "INTEGER NOT NULL DEFAULT 0")
+        for column in ("num_rows", "num_for", "num_against")
+    ]
+    if not any(added):
+        return
+    # Counted from the rounds played so far
+    for_rounds = (
+        select(func.count(RoundModel.id))
+        .where(RoundModel.player_for_id == PlayerModel.id)
+        .scalar_subquery()
+    )
+    against_rounds = (
+        select(func.count(RoundModel.id))
+        .where(RoundModel.player_against_id == PlayerModel.id)
+        .scalar_subquery()
+    )
+    connection.execute(
+        update(PlayerModel).values(
+            num_for=for_rounds,
+            num_against=against_rounds,
+            num_rows=for_rounds + against_rounds,
+        )
+    )
+
+
+def add_statement_bank(connection: Connection):
+    # Created seeded, see `statement_bank.seed_statements`
+    for table in (TopicModel.__table__, StatementModel.__table__, game_topics):
+        table.create(connection, checkfirst=True)
+
+    add_column(connection, "games", "statement_cursor", "BIGINT")
+    if add_column(connection, "games", "statement_start", "BIGINT NOT NULL DEFAULT 0"):
+        # Each game walks the bank from a random key of its own
+        game_ids = connection.execute(select(GameModel.id)).scalars().all()
+        if game_ids:
+            connection.execute(
+                update(GameModel.__table__)
+                .where(GameModel.id == bindparam("game_id"))
+                .values(statement_start=bindparam("key")),
+                [{"game_id": i, "key": generate_shuffle_key()} for i in game_ids],
+            )
+
+
+def add_game_revisions(connection: Connection):
+    add_column(connection, "games", "revision", "INTEGER NOT NULL DEFAULT 0")
+
+
+def add_hot_path_indexes(connection: Connection):
+    # Indexes duplicating the primary keys, written to on every insert
+    for table in ("games", "players", "rounds", "votes", "topics", "statements"):
+        connection.execute(text(f"DROP INDEX IF EXISTS ix_{table}_id"))
+
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_player_game_created"
+        " ON players (game_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_round_game_created"
+        " ON rounds (game_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_vote_round ON votes (round_id)",
+    ):
+        connection.execute(text(statement))
+
+
+def add_archived_games(connection: Connection):
+    ArchivedGameModel.__table__.create(connection, checkfirst=True)
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_game_status ON games (status)",
+        "CREATE INDEX IF NOT EXISTS idx_game_created ON games (created_at)",
+    ):
+        connection.execute(text(statement))
+
+
+def add_leaderboards(connection: Connection):
+    add_column(
+        connection,
+        "rounds",
+        "statement_id",
+        "INTEGER REFERENCES statements (id) ON DELETE SET NULL",
+    )
+
+    tables = [
+        i.__table__ for i in (StatementStatsModel, TopicStatsModel, PlayerStatsModel)
+    ]
+    if all(inspect(connection).has_table(i.name) for i in tables):
+        return
+    for table in tables:
+        table.create(connection, checkfirst=True)
+
+    # Rounds played so far only had their statement's text
+    connection.execute(
+        update(RoundModel)
+        .where(RoundModel.statement_id.is_(None))
+        .values(
+            statement_id=select(StatementModel.id)
+            .where(StatementModel.text == RoundModel.statement)
+            .scalar_subquery()
+        )
+    )
+    count_round_results(
+        connection,
+        select(RoundModel.id).where(RoundModel.status == Status.FINISHED),
+    )
+
+
+def rebuild_with_autoincrement(connection: Connection, table: Table):
+    """
+    SQLite only takes AUTOINCREMENT as a table is created: copies the table
+    into one created from its model. Foreign keys are left off, SQLite's
+    default, so the rows referencing it are left as they are.
+    """
+    created = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": table.name},
+    ).scalar_one()
+    if "AUTOINCREMENT" in created.upper():
+        return
+
+    new_name = f"{table.name}_new"
+    ddl = str(CreateTable(table).compile(connection))
+    connection.execute(
+        text(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1))
+    )
+    columns = ", ".join(i.name for i in table.columns)
+    connection.execute(
+        text(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}")
+    )
+    connection.execute(text(f"DROP TABLE {table.name}"))
+    connection.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(connection)
+
+
+def stop_id_reuse(connection: Connection):
+    if add_column(
+        connection, "archived_games", "game_id", "INTEGER NOT NULL DEFAULT 0"
+    ):
+        # Archives were keyed by their game's id
+        connection.execute(text("UPDATE archived_games SET game_id = id"))
+        connection.execute(
+            text("CREATE INDEX idx_archived_game ON archived_games (game_id)")
+        )
+        if connection.dialect.name == "postgresql":
+            # Their sequence was never used
+            connection.execute(
+                text(
+                    "SELECT setval(pg_get_serial_sequence('archived_games', 'id'),"
+                    " (SELECT coalesce(max(id), 0) + 1 FROM archived_games), false)"
+                )
+            )
+
+    # Postgres sequences never hand an id out twice, SQLite's rowids do
+    if connection.dialect.name != "sqlite":
+        return
+    for model in (GameModel, PlayerModel):
+        rebuild_with_autoincrement(connection, model.__table__)
+    # Nor the ids of games archived before now, newer than any left
+    connection.execute(
+        text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'games', 0"
+            " WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'games')"
+        )
+    )
+    connection.execute(
+        text(
+            "UPDATE sqlite_sequence SET seq = max(seq,"
+            " (SELECT coalesce(max(game_id), 0) FROM archived_games))"
+            " WHERE name = 'games'"
+        )
+    )
+
+
+MIGRATIONS = (
+    # The first release's schema, for databases created before migrations
+    Migration(1, "initial", create_schema),
+    Migration(2, "vote_tallies", add_vote_tallies),
+    Migration(3, "participation_counters", add_participation_counters),
+    Migration(4, "statement_bank", add_statement_bank),
+    Migration(5, "game_revisions", add_game_revisions),
+    Migration(6, "hot_path_indexes", add_hot_path_indexes),
+    Migration(7, "archived_games", add_archived_games),
+    Migration(8, "leaderboards", add_leaderboards),
+    Migration(9, "unique_ids", stop_id_reuse),
+)
+BASELINE = MIGRATIONS[0]
+
+
+@contextmanager
+def migration_lock(engine: Engine) -> Iterator[None]:
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    # Held by the session: released explicitly, not as a transaction ends
+    with engine.connect() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+        )
+        try:
+            yield
+        finally:
+            connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY}
+            )
+
+
+def migrate(engine: Engine) -> List[int]:
+    """Brings the schema up to date, returns the versions applied"""
+    with migration_lock(engine):
+        return apply_migrations(engine)
+
+
+def apply_migrations(engine: Engine) -> List[int]:
+    with engine.begin() as connection:
+        if not inspect(connection).has_table("games"):
+            create_schema(connection)
+            stamp(connection, MIGRATIONS)
+            return [i.version for i in MIGRATIONS]
+
+        schema_migrations.create(connection, checkfirst=True)
+        recorded = dict(
+            connection.execute(
+                select(schema_migrations.c.version, schema_migrations.c.name)
+            ).all()
+        )
+        if not recorded:
+            stamp(connection, [BASELINE])
+            recorded = {BASELINE.version: BASELINE.name}
+
+        renumbered = [
+            i.version
+            for i in MIGRATIONS
+            if i.version in recorded and recorded[i.version] != i.name
+        ]
+        connection.execute(
+            delete(schema_migrations).where(schema_migrations.c.version.in_(renumbered))
+        )
+        applied = {i.version for i in MIGRATIONS if recorded.get(i.version) == i.name}
+
+    pending = [i for i in MIGRATIONS if i.version not in applied]
+    for migration in pending:
+        logger.info("Applying migration %s %s", migration.version, migration.name)
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            stamp(connection, [migration])
+    return [i.version for i in pending]
+
+
+def stamp(connection: Connection, migrations: Sequence[Migration]):
+    connection.execute(
+        insert(schema_migrations),
+        [{"version": i.version, "name": i.name} for i in migrations],
+    )
@@ -1,19 +1,26 @@
 from __future__ import annotations
 
+import random
 import secrets
 from datetime import datetime
 from enum import Enum
 from typing import Optional, Any, List, Set
 
 from sqlalchemy import (
+    BigInteger,
     Column,
     Integer,
     String,
+    Table,
     TypeDecorator,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     UniqueConstraint,
     Boolean,
+    LargeBinary,
+    text,
 )
 from sqlalchemy.orm import relationship
 
@@ -25,8 +32,13 @@ def generate_join_token() -> str:
     return secrets.token_urlsafe(10)
 
 
+def generate_shuffle_key() -> int:
+    return random.getrandbits(62)
+
+
 class AsEnum(TypeDecorator):
     impl = String(50)
+    cache_ok = True
 
     def __init__(self, enumtype, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -44,19 +56,42 @@ class AsEnum(TypeDecorator):
         return value and self._enumtype(value)
 
 
+game_topics = Table(
+    "game_topics",
+    Base.metadata,
+    Column("game_id", ForeignKey("games.id", ondelete="CASCADE"), primary_key=True),
+    Column("topic_id", ForeignKey("topics.id", ondelete="CASCADE"), primary_key=True),
+)
+
+
 class GameModel(Base):
     __tablename__ = "games"
+    __table_args__ = (
+        # Finding the games to archive
+        Index("idx_game_status", "status"),
+        Index("idx_game_created", "created_at"),
+        # Ids of archived games are never handed out again, nor their sessions
+        {"sqlite_autoincrement": True},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     status = Column(AsEnum(Status), default=Status.PENDING, nullable=False)
     secs_per_round = Column(Integer, nullable=False)
     join_token = Column(
         String(50), nullable=False, default=generate_join_token, unique=True
     )
+    # Where the game's walk through the statement bank starts, and has got to
+    statement_start = Column(BigInteger, default=generate_shuffle_key, nullable=False)
+    statement_cursor = Column(BigInteger, nullable=True)
+    # Bumped by every change to the game, its players, rounds or votes
+    revision = Column(Integer, default=0, nullable=False)
 
     players: List[PlayerModel] = relationship(
-        "PlayerModel", order_by="PlayerModel.created_at", cascade="all, delete-orphan"
+        "PlayerModel",
+        order_by="PlayerModel.created_at",
+        back_populates="game",
+        cascade="all, delete-orphan",
     )  # type:ignore
 
     rounds: List[RoundModel] = relationship(
@@ -66,6 +101,11 @@ class GameModel(Base):
         cascade="all, delete-orphan",
     )  # type:ignore
 
+    # Statements are picked from these topics only, from any when empty
+    topics: List[TopicModel] = relationship(
+        "TopicModel", secondary=game_topics
+    )  # type:ignore
+
     @property
     def join_link(self) -> str:
         return f"/game/join/{self.join_token}"
@@ -85,13 +125,20 @@ class PlayerModel(Base):
             "game_id",
             name="idx_uniq_part_name_per_game",
         ),
+        # Players of a game in order
+        Index("idx_player_game_created", "game_id", "created_at"),
+        {"sqlite_autoincrement": True},
     )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     name = Column(String(100), nullable=False)
     score = Column(Integer, default=0)
     is_master = Column(Boolean, default=False)
+    # Rounds taken part in, counted atomically as they're created
+    num_rows = Column(Integer, default=0, nullable=False)
+    num_for = Column(Integer, default=0, nullable=False)
+    num_against = Column(Integer, default=0, nullable=False)
     game_id = Column(
         Integer,
         ForeignKey(
@@ -102,17 +149,28 @@ class PlayerModel(Base):
         nullable=False,
     )  # type:ignore
 
+    game: GameModel = relationship("GameModel", back_populates="players")
+
 
 class RoundModel(Base):
     __tablename__ = "rounds"
+    # Rounds of a game in order, and seeking a page of them
+    __table_args__ = (Index("idx_round_game_created", "game_id", "created_at"),)
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     statement = Column(String(500), nullable=False)
     verdict = Column(Boolean, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     status = Column(AsEnum(Status), default=Status.PLAYING, nullable=False)
+    # Denormalized tally, only ever changed with atomic increments
+    num_votes_for = Column(Integer, default=0, nullable=False)
+    num_votes_against = Column(Integer, default=0, nullable=False)
     player_for_id = Column(ForeignKey("players.id"), nullable=False)
     player_against_id = Column(ForeignKey("players.id"), nullable=False)
+    # The statement's leaderboard entry is kept by id, its text may change
+    statement_id = Column(
+        ForeignKey("statements.id", ondelete="SET NULL"), nullable=True
+    )
     game_id = Column(
         Integer,
         ForeignKey(
@@ -130,7 +188,7 @@ class RoundModel(Base):
         "PlayerModel", primaryjoin="RoundModel.player_against_id==PlayerModel.id"
     )
 
-    game: GameModel = relationship("GameModel")
+    game: GameModel = relationship("GameModel", back_populates="rounds")
 
     votes: List[VoteModel] = relationship(
         "VoteModel", back_populates="round", cascade="all, delete-orphan"
@@ -141,17 +199,18 @@ class RoundModel(Base):
         return {self.player_for, self.player_against}
 
     @property
-    def num_votes(self):
-        return len(self.votes)
+    def num_votes(self) -> int:
+        return (self.num_votes_for or 0) + (self.num_votes_against or 0)
 
 
 class VoteModel(Base):
     __tablename__ = "votes"
     __table_args__ = (
         UniqueConstraint("player_id", "round_id", name="uniq_player_round_vote"),
+        Index("idx_vote_round", "round_id"),
     )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     verdict = Column(Boolean, nullable=False)
     player_id = Column(ForeignKey("players.id"), nullable=False)
@@ -165,5 +224,90 @@ class VoteModel(Base):
         nullable=False,
     )  # type:ignore
 
-    round: RoundModel = relationship("RoundModel")
+    round: RoundModel = relationship("RoundModel", back_populates="votes")
     player: RoundModel = relationship("PlayerModel")
+
+
+class TopicModel(Base):
+    __tablename__ = "topics"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False, unique=True)
+
+
+class StatementModel(Base):
+    __tablename__ = "statements"
+    __table_args__ = (Index("idx_statement_topic_key", "topic_id", "shuffle_key"),)
+
+    id = Column(Integer, primary_key=True)
+    text = Column(String(500), nullable=False, unique=True)
+    topic_id = Column(ForeignKey("topics.id", ondelete="SET NULL"), nullable=True)
+    # Random: walking the statements by key walks a shuffled bank
+    shuffle_key = Column(
+        BigInteger, default=generate_shuffle_key, nullable=False, unique=True
+    )
+
+    topic: Optional[TopicModel] = relationship("TopicModel")  # type:ignore
+
+
+class ArchivedGameModel(Base):
+    """A game moved out of the hot tables, rounds and votes included"""
+
+    __tablename__ = "archived_games"
+    __table_args__ = (Index("idx_archived_game", "game_id"),)
+
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # zlib compressed JSON of the game, as served by `GET /game/archived`
+    data = Column(LargeBinary, nullable=False)
+
+
+# Leaderboards, added to as each round gets its verdict. Pages are read off
+# the indexes in leaderboard order, neither votes nor rounds are scanned.
+
+
+class StatementStatsModel(Base):
+    __tablename__ = "statement_stats"
+    __table_args__ = (
+        Index("idx_statement_stats_for", text("for_win_rate DESC"), "statement_id"),
+        Index(
+            "idx_statement_stats_against",
+            text("against_win_rate DESC"),
+            "statement_id",
+        ),
+    )
+
+    statement_id = Column(
+        ForeignKey("statements.id", ondelete="CASCADE"), primary_key=True
+    )
+    num_rounds = Column(Integer, default=0, nullable=False)
+    wins_for = Column(Integer, default=0, nullable=False)
+    wins_against = Column(Integer, default=0, nullable=False)
+    for_win_rate = Column(Float, default=0, nullable=False)
+    against_win_rate = Column(Float, default=0, nullable=False)
+
+
+class TopicStatsModel(Base):
+    __tablename__ = "topic_stats"
+    __table_args__ = (
+        Index("idx_topic_stats_rounds", text("num_rounds DESC"), "topic_id"),
+    )
+
+    topic_id = Column(ForeignKey("topics.id", ondelete="CASCADE"), primary_key=True)
+    num_rounds = Column(Integer, default=0, nullable=False)
+    wins_for = Column(Integer, default=0, nullable=False)
+    wins_against = Column(Integer, default=0, nullable=False)
+    num_votes = Column(Integer, default=0, nullable=False)
+
+
+class PlayerStatsModel(Base):
+    """Players across games, by name"""
+
+    __tablename__ = "player_stats"
+    __table_args__ = (Index("idx_player_stats_wins", text("num_wins DESC"), "name"),)
+
+    name = Column(String(100), primary_key=True)
+    num_rounds = Column(Integer, default=0, nullable=False)
+    num_wins = Column(Integer, default=0, nullable=False)
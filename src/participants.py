@@ -0,0 +1,60 @@
+import heapq
+from typing import Dict, Iterable, List, Tuple
+
+# (num_rows, player_id, num_for): heap order is participation, then id
+Entry = Tuple[int, int, int]
+
+
+class ParticipationQueue:
+    """
+    Candidates to take part in a round, least seen first.
+
+    Kept as a heap so the pair of a round comes out in O(log n). Counting a
+    round pushes fresh entries for its participants, the outdated ones are
+    dropped as they come up.
+    """
+
+    def __init__(self, entries: Iterable[Entry] = ()):
+        self._heap: List[Entry] = list(entries)
+        heapq.heapify(self._heap)
+        self._counters: Dict[int, Tuple[int, int]] = {
+            player_id: (num_rows, num_for)
+            for num_rows, player_id, num_for in self._heap
+        }
+
+    @classmethod
+    def from_players(cls, players: Iterable) -> "ParticipationQueue":
+        return cls((i.num_rows or 0, i.id, i.num_for or 0) for i in players)
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def add(self, player_id: int, num_rows: int = 0, num_for: int = 0):
+        self._counters[player_id] = (num_rows, num_for)
+        heapq.heappush(self._heap, (num_rows, player_id, num_for))
+
+    def next_pair(self) -> Tuple[int, int]:
+        """
+        The players for and against the next round: the two least seen,
+        the one who has been for less often goes for. Nothing is counted.
+        """
+        least_seen = [self._pop(), self._pop()]
+        for entry in least_seen:
+            heapq.heappush(self._heap, entry)
+
+        first, second = least_seen
+        if second[2] < first[2]:
+            first, second = second, first
+        return first[1], second[1]
+
+    def count_round(self, player_for_id: int, player_against_id: int):
+        for player_id, is_for in ((player_for_id, 1), (player_against_id, 0)):
+            num_rows, num_for = self._counters[player_id]
+            self.add(player_id, num_rows + 1, num_for + is_for)
+
+    def _pop(self) -> Entry:
+        while True:
+            entry = heapq.heappop(self._heap)
+            num_rows, player_id, num_for = entry
+            if self._counters[player_id] == (num_rows, num_for):
+                return entry
@@ -1,49 +1,222 @@
-from typing import Tuple, Optional, List
+import asyncio
+import math
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Optional,
+    List,
+    Mapping,
+    Tuple,
+    Union,
+)
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette import status
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, PlainTextResponse
 
+from src.admission import Overloaded, check_rate_limits
+from src.archive import get_archived_game
 from src.config import Settings, get_settings
-from src.constants import GAME_SESSION_KEY
-from src.db import get_db
-from src.models import GameModel, PlayerModel
+from src.constants import GAME_SESSION_KEY, PRIMARY_READS_KEY
+from src.db import (
+    NoResultFound,
+    get_replica_session,
+    get_session,
+    open_session,
+    pool_metrics,
+    run_db,
+    session_scope,
+)
+from src.events import get_broker, game_event
+from src.game_state import GameState
+from src.leaderboard import top_players, top_statements, top_topics
+from src.lifecycle import GAME_FINISHED
+from src.metrics import CONTENT_TYPE, get_metrics
+from src.models import GameModel
 from src.schemas import (
+    ArchivedGame,
     Game,
     NewGamePayload,
     GameSession,
     NewPlayerPayload,
     GameRound,
     VotePayload,
+    JWTPayload,
+    GameSnapshot,
+    PlayerStats,
+    Standing,
+    StatementStats,
+    TopicStats,
+)
+from fastapi import Response, Depends, APIRouter, Query, Request, WebSocket
+
+from src.session_token import ExpiredSession, SessionError, get_session_token
+from src.snapshots import (
+    JSON_MEDIA_TYPE,
+    Snapshot,
+    dumps,
+    etag_matches,
+    get_snapshot_cache,
+    snapshot_etag,
 )
-from fastapi import Response, Depends, APIRouter, Request
-
-from src.session_token import GameSessionJWT
 from src.use_cases import (
     create_game,
     join_game,
     info_from_jwt_payload,
     create_game_round,
+    finish_game,
+    get_standings,
     add_vote_to_round,
+    get_current_round,
+    get_rounds,
+    GAME_PLAYERS,
+    list_topics,
 )
 
 router = APIRouter()
 
+MAX_ROUNDS_PAGE = 100
+MAX_LEADERBOARD_PAGE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
-def info_from_request(
-    request: Request,
-    settings: Settings = Depends(get_settings),
-    db_session: Session = Depends(get_db),
-) -> Tuple[GameModel, PlayerModel]:
-    jwt_token = request.cookies.get(GAME_SESSION_KEY)
+# The data of a read, and its headers
+Serialized = Tuple[Any, Dict[str, str]]
+
+DBSession = Union[Session, AsyncSession]
+
+
+def jwt_payload_from_cookies(
+    cookies: Mapping[str, str], settings: Settings
+) -> JWTPayload:
+    jwt_token = cookies.get(GAME_SESSION_KEY)
 
     if not jwt_token:
         raise PermissionError
 
-    jwt_session = GameSessionJWT(settings)
-    jwt_payload = jwt_session.from_token_str(jwt_token)
+    jwt_session = get_session_token(settings)
+    return jwt_session.from_token_str(jwt_token)
+
+
+async def info_from_request(
+    request: Request,
+    settings: Settings = Depends(get_settings),
+) -> JWTPayload:
+    """
+    Authenticates and rate limits the request. Game and player are loaded from
+    the payload with `info_from_jwt_payload`, within the handler's database
+    work: declared before `get_session`, this runs before it opens one.
+    """
+    jwt_payload = jwt_payload_from_cookies(request.cookies, settings)
+    check_rate_limits(jwt_payload)
+    return jwt_payload
+
+
+async def get_read_session(
+    request: Request,
+    jwt_payload: JWTPayload = Depends(info_from_request),
+) -> AsyncIterator[DBSession]:
+    """
+    A session on a read replica, or on the primary for a client that wrote
+    lately so that they read their own writes whatever the replicas' lag.
+    The client carries that, whichever worker serves its reads.
+    """
+    try:
+        wrote = float(request.cookies.get(PRIMARY_READS_KEY, 0)) > time.time()
+    except ValueError:
+        wrote = False
+    async for db in open_session(replica=not wrote):
+        yield db
+
+
+def record_write(response: Response):
+    """Keeps the client's reads on the primary for a while"""
+    settings = get_settings()
+    if not settings.database_replica_uris:
+        return
+    secs = settings.replica_read_your_writes_secs
+    # Harmless if forged: it only sends the client's reads to the primary
+    response.set_cookie(
+        key=PRIMARY_READS_KEY, value=str(time.time() + secs), max_age=math.ceil(secs)
+    )
+
 
-    return info_from_jwt_payload(db_session, jwt_payload)
+def game_snapshot(db_session: Session, jwt_payload: JWTPayload) -> GameSnapshot:
+    game, player = info_from_jwt_payload(db_session, jwt_payload, GAME_PLAYERS)
+    current_round = get_current_round(db_session, game.id)
+
+    return GameSnapshot(
+        game=Game.from_orm(game),
+        current_round=current_round and GameRound.from_orm(current_round),
+    )
+
+
+async def snapshot_response(
+    request: Request,
+    db_session: DBSession,
+    jwt_payload: JWTPayload,
+    resource: str,
+    serialize: Callable[[Session, Union[GameModel, GameState]], Serialized],
+) -> Response:
+    """
+    Serves a read of the game from the snapshot cache, or a bare 304 when the
+    client holds the current revision. Only the game is loaded on a hit.
+    """
+    cache = get_snapshot_cache()
+    if_none_match = request.headers.get("if-none-match")
+
+    def read(sync_session: Session) -> Tuple[str, Optional[Snapshot]]:
+        game, player = info_from_jwt_payload(sync_session, jwt_payload)
+        etag = snapshot_etag(game.id, game.revision)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+
+        # Serialized after reading the revision, so a body can only be newer
+        # than the revision it's cached under, and revisions only grow.
+        snapshot = cache.get(game.id, resource, game.revision)
+        if snapshot is None:
+            data, headers = serialize(sync_session, game)
+            snapshot = dumps(data), headers
+            cache.set(game.id, resource, game.revision, snapshot)
+        return etag, snapshot
+
+    etag, snapshot = await run_db(db_session, read)
+    if snapshot is None:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    body, headers = snapshot
+    return Response(body, media_type=JSON_MEDIA_TYPE, headers={**headers, "ETag": etag})
+
+
+def serialize_game(
+    db_session: Session, game: Union[GameModel, GameState]
+) -> Serialized:
+    return Game.from_orm(game).dict(by_alias=True), {}
+
+
+def rounds_page(
+    db_session: Session,
+    game: Union[GameModel, GameState],
+    cursor: Optional[int],
+    since: Optional[int],
+    limit: Optional[int],
+) -> Tuple[List[GameRound], Dict[str, str]]:
+    game_rounds, next_cursor = get_rounds(db_session, game, cursor, since, limit)
+    headers = {}
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    return [GameRound.from_orm(i) for i in game_rounds], headers
+
+
+def serialize_current_round(
+    db_session: Session, game: Union[GameModel, GameState]
+) -> Serialized:
+    game_round = get_current_round(db_session, game.id)
+    return game_round and GameRound.from_orm(game_round).dict(by_alias=True), {}
 
 
 @router.get("/")
@@ -51,64 +224,141 @@ def main():
     return FileResponse("public/index.html")
 
 
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(
+        get_metrics().render(pool_metrics()), media_type=CONTENT_TYPE
+    )
+
+
 @router.post("/game", response_model=Game, status_code=status.HTTP_201_CREATED)
-def create_game_handler(
+async def create_game_handler(
     payload: NewGamePayload,
     response: Response,
-    db_session: Session = Depends(get_db),
+    db_session: DBSession = Depends(get_session),
     settings: Settings = Depends(get_settings),
 ):
-    new_game, player = create_game(
-        db_session=db_session,
-        player_schema=payload.player,
-        game_schema=payload.game,
-    )
-
-    jwt_session = GameSessionJWT(settings)
-    game_session = GameSession(
-        game_id=new_game.id,
-        player_id=player.id,
-        is_master=player.is_master,
-    )
-
+    def create(sync_session: Session):
+        new_game, player = create_game(
+            db_session=sync_session,
+            player_schema=payload.player,
+            game_schema=payload.game,
+        )
+        game_session = GameSession(
+            game_id=new_game.id,
+            player_id=player.id,
+            is_master=player.is_master,
+        )
+        return Game.from_orm(new_game), game_session
+
+    game, game_session = await run_db(db_session, create)
+    record_write(response)
+
+    jwt_session = get_session_token(settings)
     response.set_cookie(
         key=GAME_SESSION_KEY, value=jwt_session.to_public_token(game_session)
     )
 
-    return new_game
+    return game
+
+
+@router.get("/topics", response_model=List[str])
+async def get_topics_handler(db_session: DBSession = Depends(get_replica_session)):
+    return await run_db(db_session, list_topics)
+
+
+def leaderboard_page(
+    response: Response, page: Tuple[List[Any], Optional[str]]
+) -> List[Any]:
+    rows, next_cursor = page
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return rows
+
+
+@router.get("/leaderboard/players", response_model=List[PlayerStats])
+async def get_player_leaderboard_handler(
+    response: Response,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of a page"),
+    limit: int = Query(20, ge=1, le=MAX_LEADERBOARD_PAGE),
+    db_session: DBSession = Depends(get_replica_session),
+):
+    """Players across games, by name, most rounds won first"""
+    page = await run_db(db_session, top_players, limit, cursor)
+    return leaderboard_page(response, page)
+
+
+@router.get("/leaderboard/statements", response_model=List[StatementStats])
+async def get_statement_leaderboard_handler(
+    response: Response,
+    side: str = Query("for", regex="^(for|against)$"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of a page"),
+    limit: int = Query(20, ge=1, le=MAX_LEADERBOARD_PAGE),
+    db_session: DBSession = Depends(get_replica_session),
+):
+    """Statements by the win rate of the side arguing them"""
+    page = await run_db(db_session, top_statements, side, limit, cursor)
+    return leaderboard_page(response, page)
+
+
+@router.get("/leaderboard/topics", response_model=List[TopicStats])
+async def get_topic_leaderboard_handler(
+    response: Response,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of a page"),
+    limit: int = Query(20, ge=1, le=MAX_LEADERBOARD_PAGE),
+    db_session: DBSession = Depends(get_replica_session),
+):
+    """Topics, most played first"""
+    page = await run_db(db_session, top_topics, limit, cursor)
+    return leaderboard_page(response, page)
 
 
 @router.get("/game", response_model=Game)
-def get_game_handler(
-    session_info: Tuple[GameModel, PlayerModel] = Depends(info_from_request)
+async def get_game_handler(
+    request: Request,
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_read_session),
+    settings: Settings = Depends(get_settings),
 ):
-    game, player = session_info
-    return game
+    if settings.fast_json:
+        return await snapshot_response(
+            request, db_session, jwt_payload, "game", serialize_game
+        )
+
+    def get_game(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload, GAME_PLAYERS)
+        return Game.from_orm(game)
+
+    return await run_db(db_session, get_game)
 
 
 @router.post(
     "/game/join/{join_token}", response_model=Game, status_code=status.HTTP_201_CREATED
 )
-def join_game_handler(
+async def join_game_handler(
     join_token: str,
     payload: NewPlayerPayload,
     response: Response,
-    db_session: Session = Depends(get_db),
+    db_session: DBSession = Depends(get_session),
     settings: Settings = Depends(get_settings),
 ):
-    game, player = join_game(
-        db_session=db_session,
-        player_schema=payload.player,
-        join_token=join_token,
-    )
-
-    jwt_session = GameSessionJWT(settings)
-    game_session = GameSession(
-        game_id=game.id,
-        player_id=player.id,
-        is_master=player.is_master,
-    )
-
+    def join(sync_session: Session):
+        game, player = join_game(
+            db_session=sync_session,
+            player_schema=payload.player,
+            join_token=join_token,
+        )
+        game_session = GameSession(
+            game_id=game.id,
+            player_id=player.id,
+            is_master=player.is_master,
+        )
+        return Game.from_orm(game), game_session
+
+    game, game_session = await run_db(db_session, join)
+    record_write(response)
+
+    jwt_session = get_session_token(settings)
     response.set_cookie(
         key=GAME_SESSION_KEY, value=jwt_session.to_public_token(game_session)
     )
@@ -119,43 +369,197 @@ def join_game_handler(
 @router.post(
     "/game/rounds", response_model=GameRound, status_code=status.HTTP_201_CREATED
 )
-def start_round_handler(
-    db_session: Session = Depends(get_db),
-    session_info: Tuple[GameModel, PlayerModel] = Depends(info_from_request),
+async def start_round_handler(
+    response: Response,
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_session),
 ):
-    game, player = session_info
-    if not player.is_master:
-        raise PermissionError
+    def start_round(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload, GAME_PLAYERS)
+        if not player.is_master:
+            raise PermissionError
+
+        return GameRound.from_orm(create_game_round(sync_session, game))
 
-    return create_game_round(db_session, game)
+    game_round = await run_db(db_session, start_round)
+    record_write(response)
+    return game_round
 
 
 @router.get("/game/rounds/current", response_model=Optional[GameRound])
-def get_current_round_handler(
-    session_info: Tuple[GameModel, PlayerModel] = Depends(info_from_request),
+async def get_current_round_handler(
+    request: Request,
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_read_session),
+    settings: Settings = Depends(get_settings),
 ):
-    game, player = session_info
-    return game.current_round
+    if settings.fast_json:
+        return await snapshot_response(
+            request, db_session, jwt_payload, "current_round", serialize_current_round
+        )
+
+    def current_round(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload)
+        game_round = get_current_round(sync_session, game.id)
+        return game_round and GameRound.from_orm(game_round)
+
+    return await run_db(db_session, current_round)
 
 
 @router.get("/game/rounds", response_model=List[GameRound])
-def get_round_handler(
-    session_info: Tuple[GameModel, PlayerModel] = Depends(info_from_request),
+async def get_round_handler(
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = Query(None, description="X-Next-Cursor of a page"),
+    since: Optional[int] = Query(
+        None, description="Latest round fetched: that one and the ones after it"
+    ),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_ROUNDS_PAGE),
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_read_session),
+    settings: Settings = Depends(get_settings),
 ):
-    game, player = session_info
-    return game.rounds
+    """Every round of the game, or a page of them with `limit`"""
+
+    def serialize_rounds(
+        sync_session: Session, game: Union[GameModel, GameState]
+    ) -> Serialized:
+        game_rounds, headers = rounds_page(sync_session, game, cursor, since, limit)
+        return [i.dict(by_alias=True) for i in game_rounds], headers
+
+    if settings.fast_json:
+        return await snapshot_response(
+            request,
+            db_session,
+            jwt_payload,
+            f"rounds?cursor={cursor}&since={since}&limit={limit}",
+            serialize_rounds,
+        )
+
+    def get_rounds_page(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload)
+        return rounds_page(sync_session, game, cursor, since, limit)
+
+    game_rounds, headers = await run_db(db_session, get_rounds_page)
+    response.headers.update(headers)
+    return game_rounds
 
 
 @router.post(
     "/game/round/vote", response_model=GameRound, status_code=status.HTTP_201_CREATED
 )
-def vote_round_handler(
+async def vote_round_handler(
     vote: VotePayload,
-    db_session: Session = Depends(get_db),
-    session_info: Tuple[GameModel, PlayerModel] = Depends(info_from_request),
+    response: Response,
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_session),
+):
+    def vote_round(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload, GAME_PLAYERS)
+        game_round = add_vote_to_round(
+            sync_session, get_current_round(sync_session, game.id), player, vote.verdict
+        )
+        return GameRound.from_orm(game_round)
+
+    game_round = await run_db(db_session, vote_round)
+    record_write(response)
+    return game_round
+
+
+@router.post("/game/finish", response_model=List[Standing])
+async def finish_game_handler(
+    response: Response,
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_session),
+):
+    """Ends the game, returns its final standings"""
+
+    def finish(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload, GAME_PLAYERS)
+        if not player.is_master:
+            raise PermissionError
+        return finish_game(sync_session, game)
+
+    standings = await run_db(db_session, finish)
+    record_write(response)
+    return standings
+
+
+@router.get("/game/standings", response_model=List[Standing])
+async def get_standings_handler(
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_read_session),
+):
+    def standings(sync_session: Session):
+        game, player = info_from_jwt_payload(sync_session, jwt_payload)
+        return get_standings(sync_session, game.id)
+
+    return await run_db(db_session, standings)
+
+
+@router.get("/game/archived", response_model=ArchivedGame)
+async def get_archived_game_handler(
+    jwt_payload: JWTPayload = Depends(info_from_request),
+    db_session: DBSession = Depends(get_read_session),
+):
+    """The game of the session once archived, rounds and votes included"""
+    body = await run_db(db_session, get_archived_game, jwt_payload.game_id)
+    return Response(body, media_type=JSON_MEDIA_TYPE)
+
+
+@router.websocket("/game/events")
+async def game_events_handler(
+    websocket: WebSocket,
+    settings: Settings = Depends(get_settings),
 ):
-    game, player = session_info
-    return add_vote_to_round(db_session, game.current_round, player, vote.verdict)
+    """
+    Pushes a snapshot of the game on connect, then every join, new round
+    and vote of the game as they are committed.
+    """
+    try:
+        jwt_payload = jwt_payload_from_cookies(websocket.cookies, settings)
+    except (PermissionError, ExpiredSession, SessionError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Subscribing before taking the snapshot so no event falls in between
+    async with get_broker().subscribe(jwt_payload.game_id) as events:
+        try:
+            async with session_scope() as db_session:
+                snapshot = await run_db(db_session, game_snapshot, jwt_payload)
+        except NoResultFound:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        except Overloaded:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+
+        await websocket.accept()
+        await websocket.send_json(game_event("snapshot", snapshot))
+
+        async def send_events():
+            while True:
+                event = await events.get()
+                await websocket.send_json(event)
+                if event["type"] == GAME_FINISHED:
+                    return
+
+        async def receive_until_disconnect():
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+
+        sender = asyncio.create_task(send_events())
+        receiver = asyncio.create_task(receive_until_disconnect())
+        try:
+            done, pending = await asyncio.wait(
+                {sender, receiver}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            sender.cancel()
+            receiver.cancel()
+        if sender in done:
+            # The game is over: nothing more to send
+            await websocket.close()
 
 
 """
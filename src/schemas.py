@@ -32,7 +32,11 @@ class PlayerCreate(CamelModel):
 
 
 class GameCreate(CamelModel):
-    secs_per_round: Optional[int] = Field(default=get_settings().default_secs_per_round)
+    secs_per_round: Optional[int] = Field(
+        default_factory=lambda: get_settings().default_secs_per_round
+    )
+    # Names of the topics to pick the statements from, any when empty
+    topics: Optional[List[str]] = None
 
 
 class NewGamePayload(CamelModel):
@@ -87,6 +91,49 @@ class GameRound(CamelModel):
         orm_mode = True
 
 
+class Standing(CamelModel):
+    rank: int
+    player: Player
+    rounds_played: int
+    votes_cast: int
+
+
+class PlayerStats(CamelModel):
+    name: str
+    rounds_played: int
+    wins: int
+
+
+class StatementStats(CamelModel):
+    id: int
+    statement: str
+    topic: Optional[str]
+    rounds_played: int
+    wins_for: int
+    wins_against: int
+    for_win_rate: float
+    against_win_rate: float
+
+
+class TopicStats(CamelModel):
+    id: int
+    topic: str
+    rounds_played: int
+    wins_for: int
+    wins_against: int
+    num_votes: int
+
+
+class ArchivedGame(Game):
+    created_at: datetime
+    rounds: List[GameRound]
+
+
+class GameSnapshot(CamelModel):
+    game: Game
+    current_round: Optional[GameRound]
+
+
 class GameSession(CamelModel):
     game_id: int
     player_id: int
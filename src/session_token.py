@@ -1,11 +1,20 @@
 from __future__ import annotations
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Union
 
 from fastapi.encoders import jsonable_encoder
 from jose import ExpiredSignatureError, JWTError, jwt
 
-from src.config import Settings
+from src.cache import TTLCache
+from src.config import Settings, get_settings
+from src.metrics import record_jwt_decode
 from src.schemas import GameSession, JWTPayload
 
 
@@ -17,11 +26,18 @@ class SessionError(ValueError):
     ...
 
 
+@lru_cache
+def get_token_cache() -> TTLCache[JWTPayload]:
+    """Decoded payloads by token, each one until its `exp`"""
+    return TTLCache(maxsize=get_settings().session_token_cache_size)
+
+
 class GameSessionJWT:
     def __init__(self, settings: Settings):
         self.secret_key = settings.session_token_key
         self.algorithm = settings.session_token_algorithm
-        self.minutes_to_exp = settings.session_token_exp_time
+        self.session_lifetime = timedelta(days=settings.session_token_exp_time)
+        self.cache = get_token_cache()
 
     def to_public_token(self, game_session: GameSession):
         jwt_token = JWTPayload(
@@ -32,7 +48,14 @@ class GameSessionJWT:
         return self.to_jwt(jwt_token)
 
     def from_token_str(self, jwt_token: str) -> JWTPayload:
-        return self.decode(jwt_token)
+        start = time.perf_counter()
+        # A token seen before has had its signature verified already
+        jwt_payload = self.cache.get(jwt_token)
+        if jwt_payload is None:
+            jwt_payload = self.decode(jwt_token)
+            self.cache.set(jwt_token, jwt_payload, expires_at=jwt_payload.exp)
+        record_jwt_decode(time.perf_counter() - start)
+        return jwt_payload
 
     def encode(self, payload: dict) -> str:
         return jwt.encode(
@@ -58,7 +81,7 @@ class GameSessionJWT:
     def to_jwt(
         self, jwt_payload: JWTPayload, expires_delta: Optional[timedelta] = None
     ) -> str:
-        expires_delta = expires_delta or timedelta(self.minutes_to_exp)
+        expires_delta = expires_delta or self.session_lifetime
 
         # https://docs.python.org/3.8/library/datetime.html#datetime.datetime.utcnow
         expire = datetime.now(timezone.utc) + expires_delta
@@ -68,3 +91,79 @@ class GameSessionJWT:
             jsonable_encoder(jwt_payload.dict(exclude_none=True, by_alias=True))
         )
         return encoded_token
+
+
+class CompactSessionToken:
+    """
+    Fixed layout binary tokens: version, game id, player id, master flag and
+    expiry, then their HMAC-SHA256, base64url encoded. Verifying one takes an
+    HMAC and `hmac.compare_digest`, no JSON parsing nor validation.
+    """
+
+    VERSION = 1
+    LAYOUT = struct.Struct(">BQQ?Q")
+    SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+    def __init__(self, settings: Settings):
+        self.secret_key = settings.session_token_key.encode()
+        self.session_lifetime = timedelta(days=settings.session_token_exp_time)
+
+    def to_public_token(
+        self, game_session: GameSession, expires_delta: Optional[timedelta] = None
+    ) -> str:
+        expires_delta = expires_delta or self.session_lifetime
+        payload = self.LAYOUT.pack(
+            self.VERSION,
+            game_session.game_id,
+            game_session.player_id,
+            game_session.is_master,
+            int(time.time() + expires_delta.total_seconds()),
+        )
+        token = payload + self.sign(payload)
+        return base64.urlsafe_b64encode(token).rstrip(b"=").decode()
+
+    def from_token_str(self, token_str: str) -> JWTPayload:
+        start = time.perf_counter()
+        jwt_payload = self.decode(token_str)
+        record_jwt_decode(time.perf_counter() - start)
+        return jwt_payload
+
+    def decode(self, token_str: str, verify_exp=True) -> JWTPayload:
+        try:
+            token = base64.urlsafe_b64decode(token_str + "=" * (-len(token_str) % 4))
+        except (binascii.Error, ValueError):
+            raise SessionError
+        if len(token) != self.LAYOUT.size + self.SIGNATURE_SIZE:
+            raise SessionError
+
+        payload, signature = token[: self.LAYOUT.size], token[self.LAYOUT.size :]
+        if not hmac.compare_digest(signature, self.sign(payload)):
+            raise SessionError
+
+        version, game_id, player_id, is_master, exp = self.LAYOUT.unpack(payload)
+        if version != self.VERSION:
+            raise SessionError
+        if verify_exp and exp <= time.time():
+            raise ExpiredSession
+
+        # Signed by us, so valid already
+        return JWTPayload.construct(
+            game_id=game_id, player_id=player_id, is_master=is_master, exp=exp
+        )
+
+    def sign(self, payload: bytes) -> bytes:
+        return hmac.new(self.secret_key, payload, hashlib.sha256).digest()
+
+
+SESSION_TOKEN_FORMATS = {"jwt": GameSessionJWT, "compact": CompactSessionToken}
+
+
+def get_session_token(settings: Settings) -> Union[GameSessionJWT, CompactSessionToken]:
+    """The session tokens of the configured format"""
+    try:
+        token_class = SESSION_TOKEN_FORMATS[settings.session_token_format]
+    except KeyError:
+        raise ValueError(
+            f"Unknown session token format: {settings.session_token_format}"
+        )
+    return token_class(settings)
@@ -0,0 +1,100 @@
+"""
+Pre-serialized game reads.
+
+Every change to a game bumps its `revision`, so the JSON of a read is cached
+per game and revision, and served as is until the game changes again. Its
+ETag is the revision too: clients holding the current one get a 304.
+"""
+import json
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from src.cache import TTLCache
+from src.config import get_settings
+from src.lifecycle import on_game_released
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+
+# Serialized body and the headers that go with it
+Snapshot = Tuple[bytes, Dict[str, str]]
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(
+        jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def snapshot_etag(game_id: int, revision: int) -> str:
+    return f'"{game_id}.{revision}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header holds `etag`, compared weakly"""
+    if not if_none_match:
+        return False
+    tags = {i.strip().removeprefix("W/") for i in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+class SnapshotCache:
+    """Serialized reads by game and resource, for the revision they were taken at"""
+
+    def __init__(self, maxsize: int, max_resources: int):
+        self.max_resources = max_resources
+        self._lock = threading.Lock()
+        # Per game, its resources: the game's are dropped together
+        self._games: TTLCache[Dict[str, Tuple[int, Snapshot]]] = TTLCache(maxsize)
+
+    def get(self, game_id: int, resource: str, revision: int) -> Optional[Snapshot]:
+        entry = (self._games.get(game_id) or {}).get(resource)
+        if entry is None or entry[0] != revision:
+            return None
+        return entry[1]
+
+    def set(self, game_id: int, resource: str, revision: int, snapshot: Snapshot):
+        with self._lock:
+            entries = self._games.get(game_id)
+            if entries is None:
+                entries = {}
+                self._games.set(game_id, entries)
+            # Replicas lagging behind serve older revisions, keep the newest
+            entry = entries.get(resource)
+            if entry is not None and entry[0] > revision:
+                return
+
+            # Those of older revisions aren't read again
+            for key in [k for k, (r, _) in entries.items() if r < revision]:
+                del entries[key]
+            entries.pop(resource, None)
+            entries[resource] = (revision, snapshot)
+            # Clients choose the query strings: the oldest go past the cap
+            while len(entries) > self.max_resources:
+                del entries[next(iter(entries))]
+
+    def discard(self, game_id: int):
+        self._games.pop(game_id)
+
+    def clear(self):
+        self._games.clear()
+
+
+@lru_cache
+def get_snapshot_cache() -> SnapshotCache:
+    settings = get_settings()
+    cache = SnapshotCache(
+        maxsize=settings.snapshot_cache_size,
+        max_resources=settings.snapshot_resources_per_game,
+    )
+    on_game_released(lambda released: cache.discard(released.game_id))
+    return cache
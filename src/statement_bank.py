@@ -0,0 +1,254 @@
+"""
+The bank of debate statements.
+
+Statements carry a random, unique and indexed `shuffle_key`, so walking them
+by key walks a shuffled bank. Every game starts its walk at a random key of
+its own and wraps around once, keeping a cursor: picking the next unused
+statement is an index seek, whatever the size of the bank or the number of
+rounds played.
+"""
+import csv
+import json
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from sqlalchemy import event, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.models import (
+    StatementModel,
+    TopicModel,
+    game_topics,
+    generate_shuffle_key,
+)
+
+DEFAULT_BATCH_SIZE = 1000
+# Bank files: CSV with a `statement,topic` header, or JSON lines
+FORMATS = ("csv", "jsonl")
+
+Row = Tuple[str, Optional[str]]
+
+# Inserts supporting ON CONFLICT, per dialect
+DIALECT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+topics = {
+    "Abortion",
+    "Capitalism",
+    "Religion",
+    "Marriage",
+    "Feminism",
+    "Vaccination",
+    "Euthanasia",
+    "Porn",
+    "Prostitution",
+    "Guns",
+    "Free Speech",
+    "Government",
+    "Death Penalty",
+}
+
+# Statement: topic
+statements: Dict[str, Optional[str]] = {
+    "Testing on animals should be banned": None,
+    "The death penalty is sometimes justified": "Death Penalty",
+    "Women should be paid less than men in some professions": "Feminism",
+    "Assisted suicide should be made legal": "Euthanasia",
+    "The voting age should be reduced to 16": "Government",
+    "Smoking should be made illegal everywhere": None,
+    "Prisoners should be allowed to vote": "Government",
+    "Drug addicts should get help not punishment": None,
+    "Advertising to children should be banned": "Free Speech",
+    "Beauty competitions create unrealistic beauty standards": "Feminism",
+    "Police should be immune from prosecution": "Government",
+    "Violent video games should be banned": "Free Speech",
+    "Obese people should pay more for healthcare": None,
+    "Healthcare should be free for everyone": "Capitalism",
+    "Rich people should pay more taxes": "Capitalism",
+    "War is never justified": None,
+    "Some soft drugs should be made legal": None,
+    "Marriage is no longer necessary": "Marriage",
+    "Children should not have smart phones": None,
+    "If you have more money you will be happier": "Capitalism",
+    "Governments shouldn’t track its citizens": "Government",
+    "People should have to take a test to become a parent": None,
+    "Fast food should be banned": None,
+    "Men and women should be allowed to compete against each other in the Olympics": (
+        "Feminism"
+    ),
+    "Celebrities should earn less money": "Capitalism",
+    "All people should receive a basic income": "Capitalism",
+    "Everyone has the right to own a gun": "Guns",
+    "The age you can buy alcohol should be increased to 25": None,
+    "Eating meat is unethical": None,
+    "Social media has ruined society": "Free Speech",
+}
+"""
+https://blog.prepscholar.com/good-debate-topics
+https://games4esl.com/controversial-debate-topics/
+"""
+
+
+def next_statement(db_session: Session, game) -> StatementModel:
+    """
+    The game's next unused statement, from its topics if it has any.
+    Doesn't move the game's cursor. Raises ValueError when there are none left.
+    """
+    key = StatementModel.shuffle_key
+    topic_ids = select(game_topics.c.topic_id).where(game_topics.c.game_id == game.id)
+
+    def walk(*criteria):
+        return (
+            select(StatementModel.id)
+            .where(
+                or_(StatementModel.topic_id.in_(topic_ids), ~topic_ids.exists()),
+                *criteria,
+            )
+            .order_by(key)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    start, cursor = game.statement_start, game.statement_cursor
+    if cursor is None or cursor >= start:
+        # The rest of the walk, or its wrapped part when that's done, in the
+        # same round trip
+        ahead = walk(key >= start if cursor is None else key > cursor)
+        next_id = func.coalesce(ahead, walk(key < start))
+    else:
+        # Wrapped around already
+        next_id = walk(key > cursor, key < start)
+
+    statement = (
+        db_session.query(StatementModel).filter(StatementModel.id == next_id).first()
+    )
+    if statement is None:
+        raise ValueError("No statements left")
+    return statement
+
+
+def find_topics(db_session: Session, names: Sequence[str]) -> List[TopicModel]:
+    found = db_session.query(TopicModel).filter(TopicModel.name.in_(names)).all()
+    unknown = set(names) - {i.name for i in found}
+    if unknown:
+        raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}")
+    return found
+
+
+def add_statements(
+    connection: Union[Session, Connection],
+    rows: Iterable[Row],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    Adds `(statement, topic)` rows in batched inserts, creating the missing
+    topics. Statements in the bank already are skipped. Doesn't commit.
+    Returns how many were added.
+    """
+    if isinstance(connection, Session):
+        connection = connection.connection()
+
+    topic_ids: Dict[str, int] = dict(
+        connection.execute(select(TopicModel.name, TopicModel.id)).all()
+    )
+    batch: Dict[str, Optional[str]] = {}
+
+    # Compiled once and run through the driver's executemany: SQLAlchemy's
+    # processing of every row's parameters takes longer than the insert.
+    # Known statements are skipped by the database, as it checks the index.
+    columns = ("text", "topic_id", "shuffle_key")
+    dialect_insert = DIALECT_INSERTS[connection.dialect.name]
+    insert_statements = (
+        dialect_insert(StatementModel)
+        .on_conflict_do_nothing(index_elements=["text"])
+        .compile(dialect=connection.dialect, column_keys=columns, for_executemany=True)
+    )
+
+    def write() -> int:
+        if not batch:
+            return 0
+
+        for topic in set(batch.values()) - set(topic_ids) - {None}:
+            topic_ids[topic] = connection.execute(
+                insert(TopicModel).values(name=topic)
+            ).inserted_primary_key[0]
+
+        params = [
+            (text, topic and topic_ids[topic], generate_shuffle_key())
+            for text, topic in batch.items()
+        ]
+        batch.clear()
+        if not insert_statements.positional:
+            params = [dict(zip(columns, row)) for row in params]
+        return connection.exec_driver_sql(insert_statements.string, params).rowcount
+
+    added = 0
+    for text, topic in rows:
+        batch[text] = topic or None
+        if len(batch) >= batch_size:
+            added += write()
+    return added + write()
+
+
+def iter_statements(
+    connection: Connection, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[Row]:
+    """Every `(statement, topic)` of the bank, fetched `batch_size` at a time"""
+    query = (
+        select(StatementModel.text, TopicModel.name)
+        .outerjoin_from(StatementModel, TopicModel)
+        .order_by(StatementModel.id)
+    )
+    result = connection.execution_options(stream_results=True).execute(query)
+    for partition in result.partitions(batch_size):
+        yield from partition
+
+
+def read_statements(file: TextIO, file_format: str) -> Iterator[Row]:
+    """Parses a bank file lazily, a line at a time"""
+    if file_format == "csv":
+        rows = ((row["statement"], row.get("topic")) for row in csv.DictReader(file))
+    elif file_format == "jsonl":
+        rows = (
+            (row["statement"], row.get("topic"))
+            for row in map(json.loads, filter(str.strip, file))
+        )
+    else:
+        raise ValueError(f"Unknown format: {file_format}")
+
+    for text, topic in rows:
+        text = text.strip()
+        if text:
+            yield text, (topic or "").strip() or None
+
+
+def write_statements(rows: Iterable[Row], file: TextIO, file_format: str):
+    if file_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(("statement", "topic"))
+        writer.writerows((text, topic or "") for text, topic in rows)
+    elif file_format == "jsonl":
+        for text, topic in rows:
+            file.write(
+                json.dumps({"statement": text, "topic": topic}, ensure_ascii=False)
+                + "\n"
+            )
+    else:
+        raise ValueError(f"Unknown format: {file_format}")
+
+
+@event.listens_for(StatementModel.__table__, "after_create")
+def seed_statements(target, connection: Connection, **kwargs):
+    """Fills the bank with the default statements as it gets created"""
+    connection.execute(insert(TopicModel), [{"name": i} for i in sorted(topics)])
+    add_statements(connection, statements.items())
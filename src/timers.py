@@ -0,0 +1,181 @@
+"""
+Timers of the rounds in play, moving them through their phases as time runs
+out. Deadlines are kept in a hashed timer wheel ticked from the event loop,
+and their callbacks, database work, run in the threadpool.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from src.lifecycle import GameReleased, on_game_released
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[], None]
+
+
+class TimerWheel:
+    """
+    Timers go into the slot of the first tick they're due at, modulo the size
+    of the wheel: scheduling and cancelling are O(1), and a tick only visits
+    its own slot, however many timers are pending. A timer due further than
+    a revolution away is left in its slot until its turn comes.
+    """
+
+    def __init__(self, tick: float = 1.0, num_slots: int = 512):
+        self.tick = tick
+        self.num_slots = num_slots
+        self._lock = threading.Lock()
+        self._slots: List[Dict[Hashable, Tuple[float, Callback]]] = [
+            {} for _ in range(num_slots)
+        ]
+        self._slot_of: Dict[Hashable, int] = {}
+        # The last tick advanced through
+        self._last_tick: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callback):
+        """Calls `callback` from `deadline` (epoch seconds) on, replacing `key`'s"""
+        with self._lock:
+            self._cancel(key)
+            tick = math.ceil(deadline / self.tick)
+            if self._last_tick is not None:
+                # Overdue timers fire on the next tick, not a revolution later
+                tick = max(tick, self._last_tick + 1)
+            slot = tick % self.num_slots
+            self._slots[slot][key] = (deadline, callback)
+            self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable):
+        with self._lock:
+            self._cancel(key)
+
+    def advance(self, now: float) -> List[Callback]:
+        """Takes the timers due by `now` off the wheel, returns their callbacks"""
+        now_tick = math.floor(now / self.tick)
+        with self._lock:
+            if self._last_tick is not None and now_tick <= self._last_tick:
+                return []
+            if self._last_tick is None:
+                # Timers may have been scheduled anywhere before the first tick
+                first_tick = now_tick - self.num_slots + 1
+            else:
+                first_tick = self._last_tick + 1
+            self._last_tick = now_tick
+            num_ticks = min(now_tick - first_tick + 1, self.num_slots)
+
+            due = []
+            for tick in range(now_tick - num_ticks + 1, now_tick + 1):
+                slot = self._slots[tick % self.num_slots]
+                for key, (deadline, callback) in list(slot.items()):
+                    if deadline <= now:
+                        del slot[key]
+                        del self._slot_of[key]
+                        due.append((deadline, callback))
+        return [callback for deadline, callback in sorted(due, key=lambda i: i[0])]
+
+    def clear(self):
+        with self._lock:
+            for slot in self._slots:
+                slot.clear()
+            self._slot_of.clear()
+            self._last_tick = None
+
+    def _cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+
+class Timers:
+    """Runs the callbacks of a timer wheel as they come due"""
+
+    def __init__(self, wheel: TimerWheel):
+        self.wheel = wheel
+        self._task: Optional[asyncio.Task] = None
+        # Referenced until done, the loop only keeps weak references
+        self._firing: Set[asyncio.Task] = set()
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callback):
+        self.wheel.schedule(key, deadline, callback)
+
+    def cancel(self, key: Hashable):
+        self.wheel.cancel(key)
+
+    def release(self, released: GameReleased):
+        for round_id in released.round_ids:
+            self.wheel.cancel(round_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            for callback in self.wheel.advance(time.time()):
+                task = asyncio.create_task(self._fire(callback))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+
+    @staticmethod
+    async def _fire(callback: Callback):
+        try:
+            await run_in_threadpool(callback)
+        except Exception:
+            logger.exception("Timer callback failed")
+
+
+class Periodic:
+    """Runs `func` in the threadpool every `interval` seconds, never with 0"""
+
+    def __init__(self, interval: float, func: Callable[[], Any], name: str):
+        self.interval = interval
+        self.func = func
+        self.name = name
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_in_threadpool(self.func)
+            except Exception:
+                logger.exception("%s failed", self.name)
+
+
+@lru_cache
+def get_timers() -> Timers:
+    timers = Timers(TimerWheel())
+    on_game_released(timers.release)
+    return timers
@@ -1,26 +1,69 @@
-import operator
-import random
-from typing import Tuple, List
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from typing import Callable, Tuple, List, Optional, Union, Sequence
 
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.interfaces import LoaderOption
 
+from src.config import get_settings
 from src.constants import Status
-from src.db import transaction, not_found_converter
-from src.models import GameModel, PlayerModel, RoundModel, VoteModel
-from src.schemas import PlayerCreate, GameCreate, JWTPayload, Candidate
+from src.db import get_session_local, transaction, not_found_converter, NoResultFound
+from src.events import (
+    publish_game_finished,
+    publish_player_joined,
+    publish_round_started,
+    publish_round_updated,
+    publish_round_voted,
+)
+from src.game_state import (
+    GameState,
+    PlayerState,
+    RoundState,
+    VoteState,
+    get_game_state_store,
+)
+from src.leaderboard import count_round_results
+from src.lifecycle import GameReleased, release_game
+from src.models import GameModel, PlayerModel, RoundModel, TopicModel, VoteModel
+from src.participants import ParticipationQueue
+from src.statement_bank import find_topics, next_statement
+from src.schemas import (
+    PlayerCreate,
+    GameCreate,
+    JWTPayload,
+    Candidate,
+    Player,
+    Standing,
+)
+from src.timers import Periodic, get_timers
+
+# Loader options per use, so serializing a round never lazy loads per row
+ROUND_DETAILS = (
+    joinedload(RoundModel.player_for),
+    joinedload(RoundModel.player_against),
+    selectinload(RoundModel.votes),
+)
+GAME_PLAYERS = selectinload(GameModel.players)
+GAME_ROUNDS = selectinload(GameModel.rounds)
+GAME_ROUNDS_DETAILS = selectinload(GameModel.rounds).options(*ROUND_DETAILS)
+
+# Votes are taken while either phase lasts
+ROUND_IN_PLAY = (Status.PLAYING, Status.VOTING)
 
 
 def create_game(
     db_session: Session, game_schema: GameCreate, player_schema: PlayerCreate
 ) -> Tuple[GameModel, PlayerModel]:
     with transaction(db_session):
-        new_game = GameModel(**game_schema.dict())
+        new_game = GameModel(**game_schema.dict(exclude={"topics"}))
+        if game_schema.topics:
+            new_game.topics = find_topics(db_session, game_schema.topics)
         db_session.add(new_game)
         db_session.flush()
 
-        player = PlayerModel(
-            **player_schema.dict(), game_id=new_game.id, is_master=True
-        )
+        player = PlayerModel(**player_schema.dict(), game=new_game, is_master=True)
         db_session.add(player)
 
     return new_game, player
@@ -31,154 +74,651 @@ def join_game(
     db_session: Session, join_token: str, player_schema: PlayerCreate
 ) -> Tuple[GameModel, PlayerModel]:
     with transaction(db_session):
-        game = db_session.query(GameModel).filter_by(join_token=join_token).one()
+        game = (
+            db_session.query(GameModel)
+            .options(GAME_PLAYERS)
+            .filter_by(join_token=join_token)
+            .one()
+        )
+        if game.status == Status.FINISHED:
+            raise ValueError("The game is over")
 
-        player = PlayerModel(**player_schema.dict(), game_id=game.id)
+        player = PlayerModel(**player_schema.dict(), game=game)
         db_session.add(player)
+        bump_revision(game)
+
+    get_game_state_store().add_player(player)
+    publish_player_joined(player)
 
     return game, player
 
 
 @not_found_converter
 def info_from_jwt_payload(
-    db_session: Session, jwt_payload: JWTPayload
-) -> Tuple[GameModel, PlayerModel]:
-    game = db_session.query(GameModel).filter_by(id=jwt_payload.game_id).one()
-
-    player = (
-        db_session.query(PlayerModel)
-        .filter_by(id=jwt_payload.player_id, game_id=jwt_payload.game_id)
+    db_session: Session, jwt_payload: JWTPayload, *options: LoaderOption
+) -> Union[Tuple[GameModel, PlayerModel], Tuple[GameState, PlayerState]]:
+    if get_settings().game_state_store:
+        return game_state_from_jwt_payload(db_session, jwt_payload)
+
+    game, player = (
+        db_session.query(GameModel, PlayerModel)
+        .join(GameModel.players)
+        .options(*options)
+        .filter(
+            GameModel.id == jwt_payload.game_id,
+            PlayerModel.id == jwt_payload.player_id,
+        )
         .one()
     )
 
     return game, player
 
 
-topics = {
-    "Abortion",
-    "Capitalism",
-    "Religion",
-    "Marriage",
-    "Feminism",
-    "Vaccination",
-    "Euthanasia",
-    "Porn",
-    "Prostitution",
-    "Guns",
-    "Free Speech",
-    "Government",
-    "Death Penalty",
-}
-
-statements = {
-    "Testing on animals should be banned",
-    "The death penalty is sometimes justified",
-    "Women should be paid less than men in some professions",
-    "Assisted suicide should be made legal",
-    "The voting age should be reduced to 16",
-    "Smoking should be made illegal everywhere",
-    "Prisoners should be allowed to vote",
-    "Drug addicts should get help not punishment",
-    "Advertising to children should be banned",
-    "Beauty competitions create unrealistic beauty standards",
-    "Police should be immune from prosecution",
-    "Violent video games should be banned",
-    "Obese people should pay more for healthcare",
-    "Healthcare should be free for everyone",
-    "Rich people should pay more taxes",
-    "War is never justified",
-    "Some soft drugs should be made legal",
-    "Marriage is no longer necessary",
-    "Children should not have smart phones",
-    "If you have more money you will be happier",
-    "Governments shouldn’t track its citizens",
-    "People should have to take a test to become a parent",
-    "Fast food should be banned",
-    "Men and women should be allowed to compete against each other in the Olympics",
-    "Celebrities should earn less money",
-    "All people should receive a basic income",
-    "Everyone has the right to own a gun",
-    "The age you can buy alcohol should be increased to 25",
-    "Eating meat is unethical",
-    "Social media has ruined society",
-}
-"""
-https://blog.prepscholar.com/good-debate-topics
-https://games4esl.com/controversial-debate-topics/
-"""
-
-
-def create_game_round(db_session: Session, game: GameModel) -> RoundModel:
+def game_state_from_jwt_payload(
+    db_session: Session, jwt_payload: JWTPayload
+) -> Tuple[GameState, PlayerState]:
+    store = get_game_state_store()
+    game = store.get(jwt_payload.game_id) or store.load(db_session, jwt_payload.game_id)
+    player = game.player(jwt_payload.player_id)
+    if player is None:
+        raise NoResultFound
+
+    return game, player
 
-    if len(game.players) < 3:
-        raise ValueError("Not enough players. Minimum 3")
-    if game.rounds and game.rounds[-1].status == Status.PLAYING:
-        raise ValueError("A round is still in play")
 
-    player_for_id, player_against_id = select_participants(round_candidates(game))
-    statement = random.choice(
-        [t for t in statements if t not in {i.statement for i in game.rounds}]
+def get_current_round(
+    db_session: Session, game_id: int
+) -> Union[RoundModel, RoundState, None]:
+    game = get_settings().game_state_store and get_game_state_store().get(game_id)
+    if game:
+        return game.current_round
+
+    # Finished games aren't kept in memory
+    return (
+        db_session.query(RoundModel)
+        .options(*ROUND_DETAILS)
+        .filter_by(game_id=game_id)
+        .order_by(RoundModel.created_at.desc(), RoundModel.id.desc())
+        .first()
     )
 
+
+def create_game_round(
+    db_session: Session, game: Union[GameModel, GameState]
+) -> Union[RoundModel, RoundState]:
+    if isinstance(game, GameState):
+        return create_game_round_in_memory(db_session, game)
+
+    check_round_can_start(game, last_round_status(db_session, game.id))
+    participation = ParticipationQueue.from_players(game.players)
+    player_for_id, player_against_id = participation.next_pair()
+    players = {i.id: i for i in game.players}
+    count_participation(players[player_for_id], players[player_against_id])
+
+    statement = next_statement(db_session, game)
+    game.statement_cursor = statement.shuffle_key
+    game.status = Status.PLAYING
+    bump_revision(game)
+
     game_round = RoundModel(
-        statement=statement,
+        statement=statement.text,
+        statement_id=statement.id,
         player_for_id=player_for_id,
         player_against_id=player_against_id,
-        game_id=game.id,
+        game=game,
+        votes=[],
     )
 
     db_session.add(game_round)
     db_session.commit()
 
+    schedule_round_phase(
+        game_round.id, game_round.status, game_round.created_at, game.secs_per_round
+    )
+    publish_round_started(game_round)
+
     return game_round
 
 
-def round_candidates(game: GameModel) -> List[Candidate]:
-    player_stats = {
-        i.id: Candidate(player_id=i.id, score=i.score) for i in game.players
-    }
-    for game_round in game.rounds:
-        player_stats[game_round.player_for.id].num_rows += 1
-        player_stats[game_round.player_for.id].num_for += 1
-        player_stats[game_round.player_against.id].num_rows += 1
-        player_stats[game_round.player_against.id].num_against += 1
+def create_game_round_in_memory(db_session: Session, game: GameState) -> RoundState:
+    with game.lock:
+        current_round = game.current_round
+        check_round_can_start(game, current_round and current_round.status)
+        if game.round_pending:
+            raise ValueError("A round is still in play")
+        player_for_id, player_against_id = game.participation.next_pair()
+        game.round_pending = True
 
-    return list(player_stats.values())
+    # The statement and the round's id come from the database, outside the lock
+    game_round = get_game_state_store().insert_round(
+        db_session, game, player_for_id, player_against_id
+    )
 
+    schedule_round_phase(
+        game_round.id, game_round.status, game_round.created_at, game.secs_per_round
+    )
+    publish_round_started(game_round)
 
-def select_participants(candidates: List[Candidate]) -> Tuple[int, int]:
-    sorted_by_participation = sorted(candidates, key=operator.attrgetter("num_rows"))
-    sorted_by_position = sorted(
-        sorted_by_participation[:2], key=operator.attrgetter("num_for")
+    return game_round
+
+
+def bump_revision(game: GameModel):
+    # Incremented in SQL, flushed along with the change
+    game.revision = GameModel.revision + 1
+
+
+def get_rounds(
+    db_session: Session,
+    game: Union[GameModel, GameState],
+    cursor: Optional[int] = None,
+    since: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Tuple[List[Union[RoundModel, RoundState]], Optional[int]]:
+    """
+    The game's rounds in order, `limit` at most, and the cursor of the next
+    page if any: the id of the page's last round, the rounds after it follow.
+
+    `since` is the id of the latest round a client fetched. Rounds are final
+    once finished and only the latest can still be playing, so the delta is
+    that round and the ones after it.
+    """
+    if isinstance(game, GameState):
+        rounds = list(game.rounds)
+        if cursor is not None:
+            rounds = rounds_from_state(rounds, cursor, inclusive=False)
+        if since is not None:
+            rounds = rounds_from_state(rounds, since, inclusive=True)
+        if limit is not None:
+            rounds = rounds[: limit + 1]
+    else:
+        query = (
+            db_session.query(RoundModel)
+            .options(*ROUND_DETAILS)
+            .filter(RoundModel.game_id == game.id)
+        )
+        if cursor is not None:
+            query = query.filter(rounds_from(game.id, cursor, inclusive=False))
+        if since is not None:
+            query = query.filter(rounds_from(game.id, since, inclusive=True))
+        query = query.order_by(RoundModel.created_at, RoundModel.id)
+        if limit is not None:
+            query = query.limit(limit + 1)
+        rounds = query.all()
+
+    if limit is not None and len(rounds) > limit:
+        rounds = rounds[:limit]
+        return rounds, rounds[-1].id
+    return rounds, None
+
+
+def rounds_from(game_id: int, round_id: int, inclusive: bool):
+    """Filters the rounds after a given one, seeking the game's rounds index"""
+    created_at = (
+        select(RoundModel.created_at)
+        .where(RoundModel.id == round_id, RoundModel.game_id == game_id)
+        .scalar_subquery()
     )
-    return sorted_by_position[0].player_id, sorted_by_position[1].player_id
+    # The bound on created_at alone is the range the index seeks
+    return and_(
+        RoundModel.created_at >= created_at,
+        or_(
+            RoundModel.created_at > created_at,
+            RoundModel.id >= round_id if inclusive else RoundModel.id > round_id,
+        ),
+    )
+
+
+def rounds_from_state(
+    rounds: List[RoundState], round_id: int, inclusive: bool
+) -> List[RoundState]:
+    index = next((i for i, r in enumerate(rounds) if r.id == round_id), None)
+    if index is None:
+        return []
+    return rounds[index if inclusive else index + 1 :]
+
+
+def list_topics(db_session: Session) -> List[str]:
+    return (
+        db_session.execute(select(TopicModel.name).order_by(TopicModel.name))
+        .scalars()
+        .all()
+    )
+
+
+def check_round_can_start(
+    game: Union[GameModel, GameState], last_round_status: Optional[Status]
+):
+    if game.status == Status.FINISHED:
+        raise ValueError("The game is over")
+    if len(game.players) < 3:
+        raise ValueError("Not enough players. Minimum 3")
+    if last_round_status in ROUND_IN_PLAY:
+        raise ValueError("A round is still in play")
+
+
+def last_round_status(db_session: Session, game_id: int) -> Optional[Status]:
+    return (
+        db_session.query(RoundModel.status)
+        .filter_by(game_id=game_id)
+        .order_by(RoundModel.created_at.desc(), RoundModel.id.desc())
+        .limit(1)
+        .scalar()
+    )
+
+
+def count_participation(player_for: PlayerModel, player_against: PlayerModel):
+    # Incremented in SQL, flushed along with the round
+    player_for.num_rows = PlayerModel.num_rows + 1
+    player_for.num_for = PlayerModel.num_for + 1
+    player_against.num_rows = PlayerModel.num_rows + 1
+    player_against.num_against = PlayerModel.num_against + 1
+
+
+def select_participants(candidates: List[Candidate]) -> Tuple[int, int]:
+    return ParticipationQueue(
+        (i.num_rows, i.player_id, i.num_for) for i in candidates
+    ).next_pair()
 
 
 def add_vote_to_round(
-    db_session: Session, game_round: RoundModel, player: PlayerModel, verdict: bool
-) -> RoundModel:
+    db_session: Session,
+    game_round: Union[RoundModel, RoundState],
+    player: Union[PlayerModel, PlayerState],
+    verdict: bool,
+) -> Union[RoundModel, RoundState]:
+    if isinstance(game_round, RoundState):
+        return add_vote_to_round_in_memory(game_round, player, verdict)
+
+    check_can_vote(game_round, player)
+    num_voters = len(game_round.game.players) - 2
+
+    try:
+        with transaction(db_session):
+            # The unique constraint settles concurrent votes of the same player
+            vote = VoteModel(verdict=verdict, player=player, round=game_round)
+            db_session.add(vote)
+            db_session.flush()
+
+            tally = (
+                RoundModel.num_votes_for if verdict else RoundModel.num_votes_against
+            )
+            counted = db_session.execute(
+                update(RoundModel)
+                .where(RoundModel.id == game_round.id)
+                .where(RoundModel.status.in_(ROUND_IN_PLAY))
+                .values({tally: tally + 1})
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not counted:
+                raise ValueError("The round is over")
+            bump_revision(game_round.game)
+
+            db_session.refresh(game_round, ["num_votes_for", "num_votes_against"])
+            if game_round.num_votes >= num_voters:
+                finish_round(db_session, game_round)
+    except IntegrityError:
+        raise ValueError("You already voted")
+
+    publish_round_voted(game_round)
+
+    return game_round
+
 
-    if player in game_round.participants:
+def finish_round(db_session: Session, game_round: RoundModel) -> bool:
+    """
+    Settles the round from its tally. Only the transaction that moves it out of
+    play scores it, however many reach the last vote or its deadline at once.
+    Returns whether it was this one.
+    """
+    verdict = tally_verdict(game_round.num_votes_for, game_round.num_votes_against)
+    finished = db_session.execute(
+        update(RoundModel)
+        .where(RoundModel.id == game_round.id)
+        .where(RoundModel.status.in_(ROUND_IN_PLAY))
+        .values(status=Status.FINISHED, verdict=verdict)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    if finished and verdict is not None:
+        winner = game_round.player_for if verdict else game_round.player_against
+        db_session.execute(
+            update(PlayerModel)
+            .where(PlayerModel.id == winner.id)
+            .values(score=PlayerModel.score + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db_session.expire(winner, ["score"])
+    if finished:
+        count_round_results(db_session, [game_round.id])
+
+    db_session.refresh(game_round, ["status", "verdict"])
+    return bool(finished)
+
+
+def add_vote_to_round_in_memory(
+    game_round: RoundState, player: PlayerState, verdict: bool
+) -> RoundState:
+    game = game_round.game
+    writer = get_game_state_store().writer
+
+    with game.lock:
+        check_can_vote(game_round, player)
+
+        game_round.votes.append(VoteState(player.id, verdict))
+        game.revision += 1
+        writer.add_vote(game.id, game_round.id, player.id, verdict)
+
+        if len(game_round.votes) >= (len(game.players) - 2):
+            finish_round_in_memory(game_round)
+
+    publish_round_voted(game_round)
+
+    return game_round
+
+
+def finish_round_in_memory(game_round: RoundState):
+    """Settles the round from its votes, under its game's lock"""
+    game_round.status = Status.FINISHED
+    game_round.verdict = round_verdict(game_round.votes)
+    winner = None
+    if game_round.verdict is True:
+        winner = game_round.player_for
+    elif game_round.verdict is False:
+        winner = game_round.player_against
+    if winner is not None:
+        winner.score += 1
+    get_game_state_store().writer.finish_round(
+        game_round.id, game_round.verdict, winner and winner.id
+    )
+
+
+def finish_game(
+    db_session: Session, game: Union[GameModel, GameState]
+) -> List[Standing]:
+    """
+    Ends the game, settling the round in play with the votes it got, and
+    releases it. Returns the final standings.
+    """
+    round_ids: Tuple[int, ...] = ()
+    if isinstance(game, GameState):
+        with game.lock:
+            if game.status == Status.FINISHED:
+                raise ValueError("The game is over")
+            game.status = Status.FINISHED
+            game.revision += 1
+            current_round = game.current_round
+            if current_round is not None and current_round.status in ROUND_IN_PLAY:
+                finish_round_in_memory(current_round)
+                round_ids = (current_round.id,)
+        # Scores go in before the standings are read back
+        get_game_state_store().writer.flush()
+
+    with transaction(db_session):
+        finished = db_session.execute(
+            update(GameModel)
+            .where(GameModel.id == game.id)
+            .where(GameModel.status != Status.FINISHED)
+            .values(status=Status.FINISHED, revision=GameModel.revision + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not finished:
+            raise ValueError("The game is over")
+
+        if isinstance(game, GameModel):
+            current_round = get_current_round(db_session, game.id)
+            if current_round is not None and current_round.status in ROUND_IN_PLAY:
+                finish_round(db_session, current_round)
+                round_ids = (current_round.id,)
+        standings = get_standings(db_session, game.id)
+
+    release_game(GameReleased(game.id, round_ids))
+    publish_game_finished(game.id, standings)
+    return standings
+
+
+def get_standings(db_session: Session, game_id: int) -> List[Standing]:
+    """The players of a game by score, in a single aggregate query"""
+    num_votes = func.count(VoteModel.id)
+    rows = db_session.execute(
+        select(
+            PlayerModel.id,
+            PlayerModel.name,
+            PlayerModel.score,
+            PlayerModel.num_rows,
+            num_votes,
+            func.rank().over(order_by=PlayerModel.score.desc()),
+        )
+        .outerjoin(VoteModel, VoteModel.player_id == PlayerModel.id)
+        .where(PlayerModel.game_id == game_id)
+        .group_by(PlayerModel.id)
+        .order_by(PlayerModel.score.desc(), PlayerModel.created_at)
+    )
+    return [
+        Standing(
+            rank=rank,
+            player=Player(id=player_id, name=name, score=score),
+            rounds_played=num_rows,
+            votes_cast=votes_cast,
+        )
+        for player_id, name, score, num_rows, votes_cast, rank in rows
+    ]
+
+
+def finish_idle_games(db_session: Session, now: Optional[datetime] = None) -> int:
+    """
+    Finishes the games nobody joined or started a round of for the last
+    `game_idle_timeout_secs`. Returns how many.
+    """
+    settings = get_settings()
+    idle_since = (now or datetime.utcnow()) - timedelta(
+        seconds=settings.game_idle_timeout_secs
+    )
+    joined = select(PlayerModel.id).where(
+        PlayerModel.game_id == GameModel.id, PlayerModel.created_at >= idle_since
+    )
+    played = select(RoundModel.id).where(
+        RoundModel.game_id == GameModel.id, RoundModel.created_at >= idle_since
+    )
+    game_ids = (
+        db_session.execute(
+            select(GameModel.id).where(
+                GameModel.created_at < idle_since,
+                GameModel.status != Status.FINISHED,
+                ~joined.exists(),
+                ~played.exists(),
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+    num_finished = 0
+    for game_id in game_ids:
+        game = settings.game_state_store and get_game_state_store().get(game_id)
+        game = game or db_session.get(GameModel, game_id)
+        if game is None:
+            # Archived meanwhile
+            continue
+        try:
+            finish_game(db_session, game)
+        except ValueError:
+            # Finished meanwhile
+            continue
+        num_finished += 1
+    return num_finished
+
+
+def run_idle_sweeper() -> int:
+    db_session = get_session_local()
+    try:
+        return finish_idle_games(db_session)
+    finally:
+        db_session.close()
+
+
+@lru_cache
+def get_idle_sweeper() -> Periodic:
+    return Periodic(
+        get_settings().idle_sweep_interval, run_idle_sweeper, "Sweeping idle games"
+    )
+
+
+def schedule_round_phase(
+    round_id: int, status: Status, created_at: datetime, secs_per_round: int
+):
+    """Sets the timer ending the round's current phase"""
+    settings = get_settings()
+    if not settings.round_timers:
+        return
+
+    timers = get_timers()
+    voting_at = created_at.replace(tzinfo=timezone.utc).timestamp() + secs_per_round
+    if status == Status.PLAYING:
+        timers.schedule(round_id, voting_at, partial(run_phase, open_voting, round_id))
+    elif status == Status.VOTING:
+        timers.schedule(
+            round_id,
+            voting_at + settings.voting_secs,
+            partial(run_phase, close_voting, round_id),
+        )
+    else:
+        timers.cancel(round_id)
+
+
+def schedule_round_timers(db_session: Session) -> int:
+    """
+    Sets the timers of every round in play from when it was created, as the
+    app starts. Returns how many.
+    """
+    rounds = (
+        db_session.query(
+            RoundModel.id,
+            RoundModel.status,
+            RoundModel.created_at,
+            GameModel.secs_per_round,
+        )
+        .join(RoundModel.game)
+        .filter(RoundModel.status.in_(ROUND_IN_PLAY))
+        .all()
+    )
+    for round_id, status, created_at, secs_per_round in rounds:
+        schedule_round_phase(round_id, status, created_at, secs_per_round)
+    return len(rounds)
+
+
+def rebuild_round_timers() -> int:
+    db_session = get_session_local()
+    try:
+        return schedule_round_timers(db_session)
+    finally:
+        db_session.close()
+
+
+def run_phase(phase: Callable[[Session, int], None], round_id: int):
+    db_session = get_session_local()
+    try:
+        phase(db_session, round_id)
+    finally:
+        db_session.close()
+
+
+def open_voting(db_session: Session, round_id: int):
+    """Ends the debate of a round whose time is up"""
+    with transaction(db_session):
+        game_round = round_with_details(db_session, round_id)
+        if game_round is None:
+            return
+        opened = db_session.execute(
+            update(RoundModel)
+            .where(RoundModel.id == round_id)
+            .where(RoundModel.status == Status.PLAYING)
+            .values(status=Status.VOTING)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not opened:
+            return
+        bump_revision(game_round.game)
+        db_session.refresh(game_round, ["status"])
+
+    round_state = get_round_state(game_round.game_id, round_id)
+    if round_state is not None:
+        with round_state.game.lock:
+            # Unless its last vote finished it meanwhile
+            if round_state.status == Status.PLAYING:
+                round_state.status = Status.VOTING
+                round_state.game.revision += 1
+
+    schedule_round_phase(
+        round_id, Status.VOTING, game_round.created_at, game_round.game.secs_per_round
+    )
+    publish_round_updated(round_state or game_round)
+
+
+def close_voting(db_session: Session, round_id: int):
+    """Finishes a round whose voting time is up, with the votes it got"""
+    game_round = round_with_details(db_session, round_id)
+    if game_round is None:
+        return
+
+    round_state = get_round_state(game_round.game_id, round_id)
+    if round_state is not None:
+        game = round_state.game
+        with game.lock:
+            if round_state.status == Status.FINISHED:
+                return
+            finish_round_in_memory(round_state)
+            game.revision += 1
+            get_game_state_store().writer.add_revision(game.id)
+        publish_round_updated(round_state)
+        return
+
+    with transaction(db_session):
+        finished = finish_round(db_session, game_round)
+        if finished:
+            bump_revision(game_round.game)
+    if finished:
+        publish_round_updated(game_round)
+
+
+def round_with_details(db_session: Session, round_id: int) -> Optional[RoundModel]:
+    return (
+        db_session.query(RoundModel)
+        .options(*ROUND_DETAILS)
+        .filter_by(id=round_id)
+        .one_or_none()
+    )
+
+
+def get_round_state(game_id: int, round_id: int) -> Optional[RoundState]:
+    """The round as served from memory, when it is"""
+    if not get_settings().game_state_store:
+        return None
+    game = get_game_state_store().get(game_id)
+    if game is None:
+        return None
+    return next((i for i in reversed(game.rounds) if i.id == round_id), None)
+
+
+def check_can_vote(
+    game_round: Union[RoundModel, RoundState], player: Union[PlayerModel, PlayerState]
+):
+    if game_round.status == Status.FINISHED:
+        raise ValueError("The round is over")
+    if player.id in {game_round.player_for_id, game_round.player_against_id}:
         raise ValueError("Participants can't vote")
-    if player in {i.player for i in game_round.votes}:
+    if player.id in {i.player_id for i in game_round.votes}:
         raise ValueError("You already voted")
 
-    with transaction(db_session):
-        vote = VoteModel(verdict=verdict, player=player, round=game_round)
-        db_session.add(vote)
-        db_session.flush()
 
-        if (len(game_round.votes) + 1) >= (len(game_round.game.players) - 2):
-            game_round.status = Status.FINISHED
+def round_verdict(votes: Sequence[Union[VoteModel, VoteState]]) -> Optional[bool]:
+    return tally_verdict(
+        sum(1 for _ in votes if _.verdict is True),
+        sum(1 for _ in votes if _.verdict is False),
+    )
 
-            total_true_votes = sum(1 for _ in game_round.votes if _.verdict is True)
-            total_false_votes = sum(1 for _ in game_round.votes if _.verdict is False)
-            if total_true_votes != total_false_votes:
-                verdict = total_true_votes > total_false_votes
-                game_round.verdict = verdict
-                if verdict is True:
-                    game_round.player_for.score += 1
-                else:
-                    game_round.player_against.score += 1
 
-    return game_round
+def tally_verdict(num_votes_for: int, num_votes_against: int) -> Optional[bool]:
+    """The verdict of the majority, None on a tie"""
+    if num_votes_for == num_votes_against:
+        return None
+    return num_votes_for > num_votes_against
@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterator, List, Tuple
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from src.admission import get_game_rate_limiter, get_player_rate_limiter
+from src.config import get_settings
+from src.constants import GAME_SESSION_KEY
+from src.db import Base, get_engine
+from src.game_state import get_game_state_store
+from src.main import app as orig_get_app
+from src.migrations import migrate
+from src.timers import get_timers
+
+
+@pytest.fixture(scope="session")
+def app() -> FastAPI:
+    testing_app = orig_get_app
+    yield testing_app
+
+
+@pytest.fixture(scope="session")
+def client(app: FastAPI) -> TestClient:
+    return TestClient(app)
+
+
+@pytest.fixture
+def clear_all():
+    migrate(get_engine())
+    yield
+    Base.metadata.drop_all(get_engine())
+    # Ids start over with the next database
+    get_player_rate_limiter().clear()
+    get_game_rate_limiter().clear()
+
+
+@pytest.fixture(params=(False, True), ids=("sync_db", "async_db"))
+def database_async(request, monkeypatch):
+    monkeypatch.setattr(get_settings(), "database_async", request.param)
+    yield request.param
+
+
+@pytest.fixture(params=(False, True), ids=("orm", "game_state_store"))
+def game_state_store(request, monkeypatch, clear_all):
+    monkeypatch.setattr(get_settings(), "game_state_store", request.param)
+    store = get_game_state_store()
+    store.clear()
+    get_timers().wheel.clear()
+    yield request.param
+    store.writer.flush()
+    store.clear()
+    get_timers().wheel.clear()
+
+
+def create_game(
+    client: TestClient, num_players: int, secs_per_round: int = 30
+) -> Tuple[dict, List[dict]]:
+    payload = {"player": {"name": "Player 1"}, "game": {"secsPerRound": secs_per_round}}
+    response = client.post("/game", json=payload)
+    game = response.json()
+    cookies = [{GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}]
+    for i in range(2, num_players + 1):
+        response = client.post(game["joinLink"], json={"player": {"name": f"P {i}"}})
+        cookies.append({GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)})
+    return game, cookies
+
+
+@pytest.fixture
+def new_game(client):
+    """Creates a game of `num_players`, returns it and the players' session cookies"""
+    return partial(create_game, client)
+
+
+@contextmanager
+def collect_queries() -> Iterator[List[str]]:
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(get_engine(), "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(get_engine(), "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def count_queries():
+    """Context manager collecting the statements run through the (sync) engine"""
+    return collect_queries
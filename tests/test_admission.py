@@ -0,0 +1,85 @@
+import pytest
+
+from src.admission import (
+    Admission,
+    Overloaded,
+    RateLimiter,
+    get_admission,
+    get_game_rate_limiter,
+    get_player_rate_limiter,
+)
+
+
+def test_buckets_refill_at_their_rate():
+    limiter = RateLimiter(rate=2, burst=3, maxsize=10)
+    assert [limiter.take("a", now=100) for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("a", now=100) == pytest.approx(0.5)
+    # Other keys have buckets of their own
+    assert limiter.take("b", now=100) == 0
+
+    assert limiter.take("a", now=100.5) == 0
+    assert limiter.take("a", now=100.5) == pytest.approx(0.5)
+    # Never more than the burst
+    assert [limiter.take("a", now=200) for _ in range(4)][-1] > 0
+
+
+def test_admission_turns_requests_away_past_its_limit():
+    admission = Admission(limit=1)
+    with admission.slot():
+        with pytest.raises(Overloaded):
+            with admission.slot():
+                pass
+    with admission.slot():
+        assert admission.active == 1
+    assert admission.active == 0
+
+
+@pytest.fixture
+def rate_limits(monkeypatch, clear_all):
+    for limiter, burst in (
+        (get_player_rate_limiter(), 3),
+        (get_game_rate_limiter(), 5),
+    ):
+        monkeypatch.setattr(limiter, "rate", 1)
+        monkeypatch.setattr(limiter, "burst", burst)
+
+
+def test_flooding_players_and_games_are_rate_limited(
+    client, new_game, rate_limits, count_queries
+):
+    _, cookies = new_game(num_players=3)
+    _, other_game = new_game(num_players=1)
+
+    statuses = [client.get("/game", cookies=cookies[0]).status_code for _ in range(3)]
+    assert statuses == [200, 200, 200]
+    with count_queries() as queries:
+        response = client.post("/game/rounds", cookies=cookies[0])
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert queries == []
+
+    # The game has tokens left for its other players, then runs out too
+    statuses = [client.get("/game", cookies=cookies[1]).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    assert client.get("/game", cookies=cookies[2]).status_code == 429
+
+    assert client.get("/game", cookies=other_game[0]).status_code == 200
+
+
+def test_requests_past_the_concurrency_cap_are_shed(
+    client, new_game, clear_all, monkeypatch, count_queries
+):
+    _, cookies = new_game(num_players=1)
+    monkeypatch.setattr(get_admission(), "limit", 1)
+
+    with get_admission().slot():
+        with count_queries() as queries:
+            responses = [
+                client.get("/game", cookies=cookies[0]),
+                client.post("/game", json={"player": {"name": "Player 1"}}),
+            ]
+    assert [i.status_code for i in responses] == [503, 503]
+    assert responses[0].headers["Retry-After"] == "1"
+    assert queries == []
+
+    assert client.get("/game", cookies=cookies[0]).status_code == 200
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+from src.archive import archive_games
+from src.config import get_settings
+from src.constants import Status
+from src.db import get_session_local
+from src.models import ArchivedGameModel, GameModel, PlayerModel, RoundModel, VoteModel
+
+
+@pytest.fixture
+def db_session(clear_all):
+    db_session = get_session_local()
+    yield db_session
+    db_session.close()
+
+
+def count(db_session, model) -> int:
+    return db_session.execute(select(func.count()).select_from(model)).scalar()
+
+
+def test_games_over_are_archived(client, new_game, db_session):
+    finished_game, finished = new_game(num_players=3)
+    game_round = client.post("/game/rounds", cookies=finished[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voter_id, voter = next(
+        (i, c) for i, c in enumerate(finished, start=1) if i not in participants
+    )
+    client.post("/game/round/vote", json={"verdict": True}, cookies=voter)
+    game = client.get("/game", cookies=finished[0]).json()
+
+    abandoned_game, abandoned = new_game(num_players=1)
+    playing_game, playing = new_game(num_players=2)
+
+    db_session.execute(
+        update(GameModel)
+        .where(GameModel.id == finished_game["id"])
+        .values(status=Status.FINISHED)
+    )
+    month_ago = datetime.utcnow() - timedelta(days=30)
+    db_session.execute(
+        update(GameModel)
+        .where(GameModel.id == abandoned_game["id"])
+        .values(created_at=month_ago)
+    )
+    db_session.commit()
+
+    assert archive_games(db_session) == 2
+    assert archive_games(db_session) == 0
+
+    # Only the game still played is left in the hot tables
+    assert db_session.execute(select(GameModel.id)).scalars().all() == [
+        playing_game["id"]
+    ]
+    assert count(db_session, PlayerModel) == 2
+    assert count(db_session, RoundModel) == count(db_session, VoteModel) == 0
+    assert count(db_session, ArchivedGameModel) == 2
+
+    assert client.get("/game", cookies=finished[0]).status_code == 404
+    archived = client.get("/game/archived", cookies=finished[1]).json()
+    assert archived["status"] == Status.FINISHED
+    assert archived["players"] == game["players"]
+    assert [i["id"] for i in archived["rounds"]] == [game_round["id"]]
+    assert archived["rounds"][0]["votes"] == [{"verdict": True, "playerId": voter_id}]
+
+    archived = client.get("/game/archived", cookies=abandoned[0]).json()
+    assert archived["createdAt"] == month_ago.isoformat()
+    assert archived["rounds"] == []
+
+    assert client.get("/game/archived", cookies=playing[0]).status_code == 404
+
+
+def test_games_are_archived_in_batches(client, new_game, db_session, monkeypatch):
+    monkeypatch.setattr(get_settings(), "archive_batch_size", 2)
+    game_ids = [new_game(num_players=2)[0]["id"] for _ in range(5)]
+    db_session.execute(update(GameModel).values(status=Status.FINISHED))
+    db_session.commit()
+
+    assert archive_games(db_session) == 5
+    archived_ids = db_session.execute(select(ArchivedGameModel.game_id)).scalars().all()
+    assert sorted(archived_ids) == game_ids
+    assert count(db_session, GameModel) == count(db_session, PlayerModel) == 0
+
+
+def test_ids_of_archived_games_are_not_reused(client, new_game, db_session):
+    game, cookies = new_game(num_players=2)
+    game_id = game["id"]
+    db_session.execute(update(GameModel).values(status=Status.FINISHED))
+    db_session.commit()
+    assert archive_games(db_session) == 1
+
+    game, new_cookies = new_game(num_players=2)
+    new_game_id = game["id"]
+    assert new_game_id != game_id
+    # The archived game's sessions don't open the new one
+    assert client.get("/game", cookies=cookies[1]).status_code == 404
+    assert client.get("/game", cookies=new_cookies[1]).status_code == 200
+
+    db_session.execute(update(GameModel).values(status=Status.FINISHED))
+    db_session.commit()
+    assert archive_games(db_session) == 1
+    game = client.get("/game/archived", cookies=new_cookies[0]).json()
+    assert game["id"] == new_game_id
+    assert client.get("/game/archived", cookies=cookies[0]).json()["id"] == game_id
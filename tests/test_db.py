@@ -0,0 +1,32 @@
+from sqlalchemy import text
+
+from src.config import get_settings
+from src.db import get_engine, get_session_local, pool_metrics
+
+
+def test_session_factory_is_built_once():
+    session_1 = get_session_local()
+    session_2 = get_session_local()
+
+    assert session_1 is not session_2
+    assert session_1.bind is session_2.bind is get_engine()
+
+
+def test_sqlite_pragmas():
+    with get_engine().connect() as connection:
+        journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+
+    assert journal_mode == get_settings().sqlite_journal_mode
+
+
+def test_pool_metrics():
+    checkouts = pool_metrics()["sync"]["checkouts"]
+
+    with get_engine().connect() as connection:
+        connection.execute(text("SELECT 1"))
+        assert pool_metrics()["sync"]["checked_out"] >= 1
+
+    metrics = pool_metrics()["sync"]
+    assert metrics["checkouts"] == checkouts + 1
+    assert metrics["size"] == get_settings().database_pool_size
+    assert metrics["max_wait_seconds"] >= 0
@@ -1,37 +1,18 @@
 import pytest
-from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 
 from src.constants import GAME_SESSION_KEY
-from src.db import Base, get_engine
-from src.main import app as orig_get_app
 from src.schemas import Candidate
 from src.use_cases import select_participants
 
 
-@pytest.fixture(scope="session")
-def app() -> FastAPI:
-    testing_app = orig_get_app
-    yield testing_app
-
-
-@pytest.fixture(scope="session")
-def client(app: FastAPI) -> TestClient:
-    return TestClient(app)
-
-
-@pytest.fixture
-def clear_all():
-    yield
-    Base.metadata.drop_all(get_engine())
-
-
 def test_read_root(client):
     response = client.get("/")
     assert response.status_code == 200
 
 
-def test_full_game_scenario(client, clear_all):
+def test_full_game_scenario(client, clear_all, database_async):
 
     # Creating a Game
     payload = {"player": {"name": "Kevin Lomax"}, "game": {"secsPerRound": 30}}
@@ -144,6 +125,38 @@ def test_full_game_scenario(client, clear_all):
     ]
 
 
+def test_game_events(client, clear_all):
+    payload = {"player": {"name": "Kevin Lomax"}, "game": {"secsPerRound": 30}}
+    response_1 = client.post("/game", json=payload)
+    game = response_1.json()
+    cookies = {GAME_SESSION_KEY: response_1.cookies.get(GAME_SESSION_KEY)}
+
+    with client.websocket_connect("/game/events", cookies=cookies) as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert snapshot["data"]["game"]["id"] == game["id"]
+        assert snapshot["data"]["currentRound"] is None
+
+        for name in ("Mary Ann Lomax", "John Milton"):
+            payload = {"player": {"name": name}}
+            client.post(game["joinLink"], json=payload)
+
+            event = websocket.receive_json()
+            assert event["type"] == "player_joined"
+            assert event["data"]["name"] == name
+
+        client.post("/game/rounds", cookies=cookies)
+        event = websocket.receive_json()
+        assert event["type"] == "round_started"
+        assert event["data"]["numVotes"] == 0
+
+
+def test_game_events_requires_session(app):
+    with pytest.raises(WebSocketDisconnect):
+        with TestClient(app).websocket_connect("/game/events") as websocket:
+            websocket.receive_json()
+
+
 @pytest.mark.parametrize(
     "candidates, expected",
     (
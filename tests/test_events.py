@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.broadcast import MemoryBackend, MessageTooLarge
+from src.events import GameEventBroker, game_event
+
+
+class SizeLimitedBackend(MemoryBackend):
+    """Stands in for NOTIFY's payload limit"""
+
+    def publish(self, message: str):
+        if len(message) > 200:
+            raise MessageTooLarge
+        super().publish(message)
+
+
+def test_events_fan_out_to_other_workers():
+    # Two workers sharing the same backend
+    backend = MemoryBackend()
+    worker_1, worker_2 = GameEventBroker(backend), GameEventBroker(backend)
+
+    changes_1, changes_2 = [], []
+    worker_1.on_remote_change(lambda game_id, event: changes_1.append(game_id))
+    worker_2.on_remote_change(lambda game_id, event: changes_2.append(game_id))
+
+    async def receive():
+        async with worker_1.subscribe(1) as events_1, worker_2.subscribe(1) as events_2:
+            worker_1.publish(1, game_event("player_joined", {"name": "Mary"}))
+            worker_1.publish(2, game_event("player_joined", {"name": "John"}))
+            return await asyncio.wait_for(
+                asyncio.gather(events_1.get(), events_2.get()), timeout=1
+            ), (events_1.qsize(), events_2.qsize())
+
+    (event_1, event_2), pending = asyncio.run(receive())
+
+    assert event_1 == event_2 == {"type": "player_joined", "data": {"name": "Mary"}}
+    assert pending == (0, 0)
+    # Only the other worker sees the change as remote
+    assert changes_1 == []
+    assert changes_2 == [1, 2]
+
+
+@pytest.mark.parametrize("size", (10, 1000))
+def test_large_events_are_broadcast_as_changes(size):
+    backend = SizeLimitedBackend()
+    worker_1, worker_2 = GameEventBroker(backend), GameEventBroker(backend)
+
+    changes = []
+    worker_2.on_remote_change(lambda game_id, event: changes.append(event))
+
+    worker_1.publish(1, game_event("round_voted", {"statement": "x" * size}))
+
+    if size > 200:
+        assert changes == [{"type": "game_changed", "data": None}]
+    else:
+        assert changes == [{"type": "round_voted", "data": {"statement": "x" * size}}]
+
+
+def test_blocking_backends_publish_off_the_callers_thread():
+    sent = threading.Event()
+    release = threading.Event()
+
+    class SlowBackend(MemoryBackend):
+        blocking = True
+
+        def publish(self, message: str):
+            release.wait(timeout=5)
+            super().publish(message)
+            sent.set()
+
+    backend = SlowBackend()
+    worker_1, worker_2 = GameEventBroker(backend), GameEventBroker(backend)
+    changes = []
+    worker_2.on_remote_change(lambda game_id, event: changes.append(game_id))
+
+    # Returns while the backend is still waiting
+    worker_1.publish(1, game_event("player_joined", {"name": "Mary"}))
+    assert changes == []
+
+    release.set()
+    assert sent.wait(timeout=5)
+    assert changes == [1]
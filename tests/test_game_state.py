@@ -0,0 +1,147 @@
+import pytest
+from sqlalchemy import func
+
+from src.config import get_settings
+from src.constants import GAME_SESSION_KEY, Status
+from src.db import get_session_local
+from src.game_state import GameState, get_game_state_store, reload_game_states
+from src.models import VoteModel, RoundModel, PlayerModel
+
+
+@pytest.fixture
+def game_state_store(monkeypatch, clear_all):
+    monkeypatch.setattr(get_settings(), "game_state_store", True)
+    store = get_game_state_store()
+    store.clear()
+    yield store
+    store.writer.flush()
+    store.clear()
+
+
+def test_game_served_from_memory(client, new_game, count_queries, game_state_store):
+    game, cookies = new_game(num_players=4)
+    client.get("/game", cookies=cookies[0])
+
+    with count_queries() as queries:
+        response = client.get("/game", cookies=cookies[1])
+    assert response.status_code == 200
+    assert [i["name"] for i in response.json()["players"]] == [
+        "Player 1",
+        "P 2",
+        "P 3",
+        "P 4",
+    ]
+    assert queries == []
+
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    assert client.post("/game/rounds", cookies=cookies[0]).status_code == 422
+
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voters = [c for i, c in enumerate(cookies, start=1) if i not in participants]
+
+    with count_queries() as queries:
+        response = client.post(
+            "/game/round/vote", json={"verdict": True}, cookies=voters[0]
+        )
+    assert response.status_code == 201
+    assert queries == []
+    assert (
+        client.post(
+            "/game/round/vote", json={"verdict": True}, cookies=voters[0]
+        ).status_code
+        == 422
+    )
+
+    response = client.post(
+        "/game/round/vote", json={"verdict": True}, cookies=voters[1]
+    )
+    game_round = response.json()
+    assert game_round["status"] == "finished"
+    assert game_round["verdict"] is True
+    assert game_round["numVotes"] == 2
+
+
+def test_writes_behind_and_reloads(client, new_game, game_state_store):
+    game, cookies = new_game(num_players=3)
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    (voter,) = [c for i, c in enumerate(cookies, start=1) if i not in participants]
+    client.post("/game/round/vote", json={"verdict": False}, cookies=voter)
+
+    game_state_store.writer.flush()
+
+    db_session = get_session_local()
+    try:
+        assert db_session.query(func.count(VoteModel.id)).scalar() == 1
+        round_model = db_session.query(RoundModel).one()
+        assert (round_model.status, round_model.verdict) == (Status.FINISHED, False)
+        winner = db_session.get(PlayerModel, game_round["playerAgainst"]["id"])
+        assert winner.score == 1
+    finally:
+        db_session.close()
+
+    # As after a restart
+    game_state_store.clear()
+    assert reload_game_states() == 1
+    game_state = game_state_store.get(game["id"])
+    assert game_state.current_round.status == Status.FINISHED
+    assert game_state.current_round.num_votes == 1
+    assert game_state.player(game_round["playerAgainst"]["id"]).score == 1
+
+
+def test_votes_that_cant_be_written_are_dropped(client, new_game, game_state_store):
+    game, cookies = new_game(num_players=4)
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voter_ids = [i for i in range(1, 5) if i not in participants]
+    client.post(
+        "/game/round/vote", json={"verdict": True}, cookies=cookies[voter_ids[0] - 1]
+    )
+    game_state_store.writer.flush()
+
+    # Cast already, it fails the batch it's in for good
+    writer = game_state_store.writer
+    writer.add_vote(game["id"], game_round["id"], voter_ids[0], True)
+    client.post(
+        "/game/round/vote", json={"verdict": False}, cookies=cookies[voter_ids[1] - 1]
+    )
+    writer.flush()
+
+    db_session = get_session_local()
+    try:
+        assert db_session.query(func.count(VoteModel.id)).scalar() == 2
+        round_model = db_session.query(RoundModel).one()
+        assert (round_model.num_votes_for, round_model.num_votes_against) == (1, 1)
+        assert round_model.status == Status.FINISHED
+    finally:
+        db_session.close()
+    # Nothing's left queued
+    assert writer._votes == [] and not writer._verdicts
+
+
+def test_players_joining_as_the_game_loads_are_kept(
+    client, new_game, monkeypatch, game_state_store
+):
+    game, cookies = new_game(num_players=3)
+    game_state_store.clear()
+    joined = []
+
+    # The join commits between the load's query and its state being kept
+    from_model = GameState.from_model
+
+    def join_meanwhile(game_model):
+        state = from_model(game_model)
+        if not joined:
+            response = client.post(game["joinLink"], json={"player": {"name": "P 4"}})
+            joined.append({GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)})
+        return state
+
+    monkeypatch.setattr(GameState, "from_model", join_meanwhile)
+    assert client.get("/game", cookies=cookies[0]).status_code == 200
+    assert joined
+
+    response = client.get("/game", cookies=joined[0])
+    assert response.status_code == 200
+    assert [i["name"] for i in response.json()["players"]][-1] == "P 4"
+    # Once, the join's own add found the game loaded
+    assert len(game_state_store.get(game["id"]).players) == 4
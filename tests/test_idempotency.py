@@ -0,0 +1,155 @@
+import pytest
+
+from src.admission import get_player_rate_limiter
+from src.config import get_settings
+from src.constants import GAME_SESSION_KEY
+from src.idempotency import get_idempotency_cache
+
+
+@pytest.fixture
+def idempotency_cache(client, clear_all):
+    cache = get_idempotency_cache()
+    cache.clear()
+    # Sessions go in explicitly: a retry is sent with the cookies of the
+    # original request, not those of its response
+    client.cookies.clear()
+    yield cache
+    cache.clear()
+    client.cookies.clear()
+
+
+def test_retried_joins_are_replayed(client, new_game, idempotency_cache, count_queries):
+    game, cookies = new_game(num_players=1)
+    join_link = game["joinLink"]
+    client.cookies.clear()
+    payload = {"player": {"name": "Retrying"}}
+    headers = {"Idempotency-Key": "join-1"}
+
+    first = client.post(join_link, json=payload, headers=headers)
+    assert first.status_code == 201
+    client.cookies.clear()
+    with count_queries() as queries:
+        retry = client.post(join_link, json=payload, headers=headers)
+    assert queries == []
+
+    assert retry.status_code == 201
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    # The session of the player who joined
+    assert retry.cookies.get(GAME_SESSION_KEY) == first.cookies.get(GAME_SESSION_KEY)
+    assert len(client.get("/game", cookies=cookies[0]).json()["players"]) == 2
+
+
+def test_retried_votes_are_replayed(client, new_game, idempotency_cache):
+    game, cookies = new_game(num_players=4)
+    join_link = game["joinLink"]
+    client.cookies.clear()
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voter = next(c for i, c in enumerate(cookies, start=1) if i not in participants)
+
+    responses = [
+        client.post(
+            "/game/round/vote",
+            json={"verdict": True},
+            cookies=voter,
+            headers={"Idempotency-Key": "vote-1"},
+        )
+        for _ in range(2)
+    ]
+    assert [i.status_code for i in responses] == [201, 201]
+    assert responses[0].json() == responses[1].json()
+    assert responses[1].json()["numVotes"] == 1
+
+    # Without a key, it's another vote
+    response = client.post("/game/round/vote", json={"verdict": True}, cookies=voter)
+    assert response.status_code == 422
+
+    # Keys are per session: another voter's request runs
+    other_voter = next(
+        c
+        for i, c in enumerate(cookies, start=1)
+        if i not in participants and c != voter
+    )
+    response = client.post(
+        "/game/round/vote",
+        json={"verdict": True},
+        cookies=other_voter,
+        headers={"Idempotency-Key": "vote-1"},
+    )
+    assert response.status_code == 201
+    assert response.json()["numVotes"] == 2
+
+
+def test_keys_reused_for_other_requests_are_rejected(
+    client, new_game, idempotency_cache
+):
+    game, cookies = new_game(num_players=1)
+    join_link = game["joinLink"]
+    client.cookies.clear()
+    headers = {"Idempotency-Key": "join-2"}
+    client.post(join_link, json={"player": {"name": "First"}}, headers=headers)
+    client.cookies.clear()
+
+    response = client.post(
+        join_link, json={"player": {"name": "Second"}}, headers=headers
+    )
+    assert response.status_code == 422
+    assert "idempotent-replayed" not in response.headers
+
+
+def test_keys_without_a_session_are_per_client(client, idempotency_cache):
+    payload = {"player": {"name": "Player 1"}, "game": {"secsPerRound": 30}}
+    headers = {"Idempotency-Key": "create-1"}
+    first = client.post("/game", json=payload, headers=headers)
+    client.cookies.clear()
+
+    # Same key and body from another client: it runs, with a session of its own
+    response = client.post(
+        "/game", json=payload, headers={**headers, "User-Agent": "another"}
+    )
+    client.cookies.clear()
+    assert response.status_code == 201
+    assert "idempotent-replayed" not in response.headers
+    assert response.json()["id"] != first.json()["id"]
+    assert response.cookies.get(GAME_SESSION_KEY) != first.cookies.get(GAME_SESSION_KEY)
+
+
+def test_large_bodies_are_turned_away(client, idempotency_cache):
+    response = client.post(
+        "/game",
+        data=b" " * (get_settings().idempotency_max_body + 1),
+        headers={"Idempotency-Key": "large", "Content-Type": "application/json"},
+    )
+    assert response.status_code == 413
+
+
+def test_rate_limited_requests_run_when_retried(
+    client, new_game, idempotency_cache, monkeypatch
+):
+    game, cookies = new_game(num_players=4)
+    client.cookies.clear()
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voter = next(c for i, c in enumerate(cookies, start=1) if i not in participants)
+
+    limiter = get_player_rate_limiter()
+    monkeypatch.setattr(limiter, "rate", 0.001)
+    monkeypatch.setattr(limiter, "burst", 1)
+    limiter.clear()
+    client.get("/game", cookies=voter)
+
+    headers = {"Idempotency-Key": "vote-2"}
+    payload = {"verdict": True}
+    response = client.post(
+        "/game/round/vote", json=payload, cookies=voter, headers=headers
+    )
+    assert response.status_code == 429
+
+    # Past Retry-After
+    limiter.clear()
+    response = client.post(
+        "/game/round/vote", json=payload, cookies=voter, headers=headers
+    )
+    assert response.status_code == 201
+    assert "idempotent-replayed" not in response.headers
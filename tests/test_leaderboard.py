@@ -0,0 +1,173 @@
+from collections import Counter
+from typing import List, Tuple
+
+import pytest
+from sqlalchemy import event, insert, text
+
+from src.db import get_engine, get_session_local
+from src.game_state import get_game_state_store
+from src.leaderboard import encode_cursor
+from src.migrations import add_leaderboards
+from src.models import PlayerStatsModel, StatementStatsModel, TopicStatsModel
+
+
+def play_round(client, game, cookies, verdict: bool) -> dict:
+    """Plays a round of a three players game to its verdict"""
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    first_id = game["players"][0]["id"]
+    voter = next(
+        c for i, c in enumerate(cookies, start=first_id) if i not in participants
+    )
+    client.post("/game/round/vote", json={"verdict": verdict}, cookies=voter)
+    return game_round
+
+
+def read_all(client, path: str, **params) -> List[dict]:
+    rows, cursor = [], None
+    while True:
+        response = client.get(path, params={**params, "limit": 2, "cursor": cursor})
+        assert response.status_code == 200
+        rows.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return rows
+
+
+def test_verdicts_are_counted(client, new_game, game_state_store):
+    rounds = []
+    for verdicts in ((True, False, True), (False,)):
+        game, cookies = new_game(num_players=3)
+        for verdict in verdicts:
+            rounds.append((play_round(client, game, cookies, verdict), verdict))
+    get_game_state_store().writer.flush()
+
+    wins, played = Counter(), Counter()
+    for game_round, verdict in rounds:
+        for side in ("playerFor", "playerAgainst"):
+            played[game_round[side]["name"]] += 1
+        winner = game_round["playerFor" if verdict else "playerAgainst"]
+        wins[winner["name"]] += 1
+
+    players = read_all(client, "/leaderboard/players")
+    # Players of every game, by name
+    assert {i["name"]: i["roundsPlayed"] for i in players} == played
+    assert {i["name"]: i["wins"] for i in players if i["wins"]} == wins
+    assert [i["wins"] for i in players] == sorted(
+        (wins[i] for i in played), reverse=True
+    )
+
+    statements = read_all(client, "/leaderboard/statements", side="against")
+    by_text = {i["statement"]: i for i in statements}
+    for game_round, verdict in rounds:
+        stats = by_text[game_round["statement"]]
+        assert stats["roundsPlayed"] >= 1
+        rate = stats["winsAgainst"] / stats["roundsPlayed"]
+        assert stats["againstWinRate"] == pytest.approx(rate)
+    assert sum(i["roundsPlayed"] for i in statements) == len(rounds)
+    assert sum(i["winsFor"] for i in statements) == 2
+    rates = [i["againstWinRate"] for i in statements]
+    assert rates == sorted(rates, reverse=True)
+
+    topics = read_all(client, "/leaderboard/topics")
+    assert sum(i["roundsPlayed"] for i in topics) <= len(rounds)
+    assert sum(i["numVotes"] for i in topics) <= len(rounds)
+
+
+def test_leaderboards_are_paged(client, clear_all):
+    db_session = get_session_local()
+    try:
+        db_session.execute(
+            insert(PlayerStatsModel),
+            [
+                {"name": f"Player {i:02}", "num_rounds": 10, "num_wins": i % 4}
+                for i in range(25)
+            ],
+        )
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    players = read_all(client, "/leaderboard/players")
+    expected = sorted(
+        ((i % 4, f"Player {i:02}") for i in range(25)), key=lambda i: (-i[0], i[1])
+    )
+    assert [(i["wins"], i["name"]) for i in players] == expected
+
+    for params in ({"cursor": "nope"}, {"limit": 0}, {"limit": 101}):
+        response = client.get("/leaderboard/players", params=params)
+        assert response.status_code == 422
+    for key in ([{"a": 1}, 0], [[1], 0], [1, None], [True, 0], [1, 0, 0], {}):
+        cursor = encode_cursor(key)
+        for path in ("players", "statements", "topics"):
+            response = client.get(f"/leaderboard/{path}", params={"cursor": cursor})
+            assert response.status_code == 422, (key, path)
+    # Cursors of one leaderboard aren't another's
+    cursor = encode_cursor([1, "Player 01"])
+    response = client.get("/leaderboard/topics", params={"cursor": cursor})
+    assert response.status_code == 422
+    response = client.get("/leaderboard/statements", params={"side": "both"})
+    assert response.status_code == 422
+
+
+def test_migration_counts_rounds_played(client, new_game, game_state_store):
+    game, cookies = new_game(num_players=3)
+    for verdict in (True, False):
+        play_round(client, game, cookies, verdict)
+    get_game_state_store().writer.flush()
+    players = read_all(client, "/leaderboard/players")
+    statements = read_all(client, "/leaderboard/statements")
+
+    # As left by the releases before leaderboards
+    with get_engine().begin() as connection:
+        for model in (StatementStatsModel, TopicStatsModel, PlayerStatsModel):
+            model.__table__.drop(connection)
+        connection.execute(text("UPDATE rounds SET statement_id = NULL"))
+    with get_engine().begin() as connection:
+        add_leaderboards(connection)
+
+    assert read_all(client, "/leaderboard/players") == players
+    assert read_all(client, "/leaderboard/statements") == statements
+
+
+def test_leaderboards_are_read_off_their_indexes(client, new_game, clear_all):
+    if get_engine().dialect.name != "sqlite":
+        pytest.skip("Reads SQLite's query plans")
+
+    game, cookies = new_game(num_players=3)
+    play_round(client, game, cookies, verdict=True)
+
+    queries: List[Tuple[str, tuple]] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().startswith("SELECT"):
+            queries.append((statement, parameters))
+
+    event.listen(get_engine(), "before_cursor_execute", before_cursor_execute)
+    try:
+        for path, key in (
+            ("players", [1, "z"]),
+            ("statements", [1, 0]),
+            ("topics", [1, 0]),
+        ):
+            client.get(f"/leaderboard/{path}", params={"limit": 1})
+            params = {"limit": 1, "cursor": encode_cursor(key)}
+            assert client.get(f"/leaderboard/{path}", params=params).status_code == 200
+    finally:
+        event.remove(get_engine(), "before_cursor_execute", before_cursor_execute)
+
+    assert len(queries) == 6
+    with get_engine().connect() as connection:
+        for statement, parameters in queries:
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).all()
+            details = [row[-1] for row in plan]
+            # Walking a leaderboard index in order is fine, sorting isn't
+            assert not [
+                i
+                for i in details
+                if "TEMP B-TREE" in i
+                or (i.startswith("SCAN") and "INDEX idx_" not in i)
+                or i.split()[1] in ("rounds", "votes")
+            ], (statement, details)
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+from starlette.websockets import WebSocketDisconnect
+
+from src.admission import get_game_rate_limiter
+from src.config import get_settings
+from src.constants import Status
+from src.db import get_session_local
+from src.game_state import get_game_state_store
+from src import lifecycle, use_cases
+from src.lifecycle import GameReleased, on_game_released, release_game
+from src.models import GameModel, PlayerModel
+from src.snapshots import get_snapshot_cache
+from src.timers import get_timers
+from src.use_cases import finish_idle_games, get_standings
+
+
+def test_finishing_a_game(client, new_game, game_state_store):
+    game, cookies = new_game(num_players=4)
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    assert client.get("/game", cookies=cookies[0]).json()["status"] == Status.PLAYING
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voter_id, voter = next(
+        (i, c) for i, c in enumerate(cookies, start=1) if i not in participants
+    )
+    client.post("/game/round/vote", json={"verdict": False}, cookies=voter)
+    assert len(get_timers().wheel) == 1
+
+    # Only the master ends it
+    assert client.post("/game/finish", cookies=cookies[1]).status_code == 401
+    response = client.post("/game/finish", cookies=cookies[0])
+    assert response.status_code == 200
+    standings = response.json()
+
+    # The round in play is settled with the votes it got
+    winner_id = game_round["playerAgainst"]["id"]
+    assert [i["player"]["id"] for i in standings][0] == winner_id
+    assert [i["rank"] for i in standings] == [1, 2, 2, 2]
+    assert standings[0]["player"]["score"] == 1
+    assert standings[0]["roundsPlayed"] == 1
+    by_id = {i["player"]["id"]: i for i in standings}
+    assert by_id[voter_id]["votesCast"] == 1
+    assert len(get_timers().wheel) == 0
+    assert get_game_state_store().get(game["id"]) is None
+
+    current = client.get("/game/rounds/current", cookies=cookies[0]).json()
+    assert current["status"] == Status.FINISHED
+    assert current["verdict"] is False
+    assert client.get("/game", cookies=cookies[0]).json()["status"] == Status.FINISHED
+    assert client.get("/game/standings", cookies=cookies[2]).json() == standings
+    # Finished games stay out of memory as they're read
+    assert get_game_state_store().get(game["id"]) is None
+
+    for response in (
+        client.post("/game/finish", cookies=cookies[0]),
+        client.post("/game/rounds", cookies=cookies[0]),
+        client.post(game["joinLink"], json={"player": {"name": "Late"}}),
+    ):
+        assert response.status_code == 422
+
+
+def test_game_events_end_with_the_game(client, new_game, clear_all):
+    game, cookies = new_game(num_players=3)
+
+    with client.websocket_connect("/game/events", cookies=cookies[1]) as websocket:
+        assert websocket.receive_json()["type"] == "snapshot"
+        standings = client.post("/game/finish", cookies=cookies[0]).json()
+
+        event = websocket.receive_json()
+        assert event == {"type": "game_finished", "data": standings}
+        with pytest.raises(WebSocketDisconnect):
+            websocket.receive_json()
+
+
+def test_standings_are_one_query(client, new_game, clear_all, count_queries):
+    game, cookies = new_game(num_players=5)
+    db_session = get_session_local()
+    try:
+        with count_queries() as queries:
+            standings = get_standings(db_session, game["id"])
+    finally:
+        db_session.close()
+    assert len(queries) == 1
+    assert [i.rank for i in standings] == [1] * 5
+    assert [i.player.name for i in standings][:2] == ["Player 1", "P 2"]
+
+
+def test_idle_games_are_finished(client, new_game, game_state_store):
+    idle, idle_cookies = new_game(num_players=3)
+    client.post("/game/rounds", cookies=idle_cookies[0])
+    active, active_cookies = new_game(num_players=2)
+
+    db_session = get_session_local()
+    try:
+        # Created and joined two hours ago, but its round has just started
+        hours_ago = datetime.utcnow() - timedelta(hours=2)
+        for model in (GameModel, PlayerModel):
+            db_session.execute(
+                update(model)
+                .where(model.id.in_([1, 2, 3]))
+                .values(created_at=hours_ago)
+            )
+        db_session.execute(
+            update(GameModel)
+            .where(GameModel.id == active["id"])
+            .values(created_at=hours_ago)
+        )
+        db_session.commit()
+        assert finish_idle_games(db_session) == 0
+
+        later = datetime.utcnow() + timedelta(hours=2)
+        assert finish_idle_games(db_session, now=later) == 2
+        assert finish_idle_games(db_session, now=later) == 0
+    finally:
+        db_session.close()
+
+    for cookies in (idle_cookies, active_cookies):
+        game = client.get("/game", cookies=cookies[0]).json()
+        assert game["status"] == Status.FINISHED
+
+
+def test_idle_games_archived_meanwhile_are_skipped(
+    client, new_game, clear_all, monkeypatch
+):
+    games = [new_game(num_players=2)[0] for _ in range(3)]
+    game_ids = [i["id"] for i in games]
+    finish_game = use_cases.finish_game
+    archived = []
+
+    def archive_the_others(db_session, game):
+        # Archived between the sweep's select and their turn
+        if not archived:
+            archived.extend(i for i in game_ids if i != game.id)
+            db_session.execute(delete(GameModel).where(GameModel.id.in_(archived)))
+            db_session.commit()
+        return finish_game(db_session, game)
+
+    monkeypatch.setattr(use_cases, "finish_game", archive_the_others)
+    db_session = get_session_local()
+    try:
+        later = datetime.utcnow() + timedelta(hours=2)
+        assert finish_idle_games(db_session, now=later) == 1
+    finally:
+        db_session.close()
+
+
+def test_releasing_games_drops_their_state(client, new_game, clear_all, monkeypatch):
+    monkeypatch.setattr(get_settings(), "fast_json", True)
+    game, cookies = new_game(num_players=1)
+    client.get("/game", cookies=cookies[0])
+    cache, wheel = get_snapshot_cache(), get_timers().wheel
+    assert cache._games.get(game["id"]) is not None
+    wheel.schedule(10, 0, lambda: None)
+    limiter = get_game_rate_limiter()
+    assert limiter._buckets.get(game["id"]) is not None
+
+    released = []
+    monkeypatch.setattr(lifecycle, "_release_hooks", list(lifecycle._release_hooks))
+    on_game_released(released.append)
+    release_game(GameReleased(game["id"], round_ids=(10,)))
+
+    assert released == [GameReleased(game["id"], (10,))]
+    assert cache._games.get(game["id"]) is None
+    assert len(wheel) == 0
+    assert limiter._buckets.get(game["id"]) is None
@@ -0,0 +1,54 @@
+import re
+
+from src.constants import GAME_SESSION_KEY
+from src.metrics import Histogram
+
+
+def server_timing(response) -> dict:
+    return {
+        name: (float(duration), rest)
+        for name, duration, rest in re.findall(
+            r"(\w+);dur=([\d.]+)([^,]*)", response.headers["server-timing"]
+        )
+    }
+
+
+def test_requests_are_timed(client, clear_all, database_async):
+    payload = {"player": {"name": "Kevin Lomax"}, "game": {"secsPerRound": 30}}
+    response = client.post("/game", json=payload)
+    assert response.status_code == 201
+    assert set(server_timing(response)) == {"app", "db", "jwt"}
+
+    cookies = {GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}
+    response = client.get("/game", cookies=cookies)
+    timings = server_timing(response)
+    # Counted from the threadpool or the async engine alike
+    assert timings["db"][1] == ';desc="2 queries"'
+    assert timings["jwt"][0] > 0
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/game",status="200"}'
+        in response.text
+    )
+    assert 'http_request_db_queries_bucket{method="GET",route="/game",le="1"}' in (
+        response.text
+    )
+    assert "jwt_decode_duration_seconds_count" in response.text
+    assert 'db_pool_checkouts_total{engine="sync"}' in response.text
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency", "Latency", (0.1, 1), ("route",))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value, "/game")
+
+    assert histogram.render()[2:] == [
+        'latency_bucket{route="/game",le="0.1"} 2',
+        'latency_bucket{route="/game",le="1"} 3',
+        'latency_bucket{route="/game",le="+Inf"} 4',
+        'latency_sum{route="/game"} 2.65',
+        'latency_count{route="/game"} 4',
+    ]
@@ -0,0 +1,210 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import pytest
+from sqlalchemy import event, inspect, text
+from sqlalchemy.future import create_engine
+from sqlalchemy.orm import Session
+
+from src.constants import GAME_SESSION_KEY
+from src.db import Base, get_engine
+from src.migrations import MIGRATIONS, migrate
+from src.models import GameModel, PlayerModel, PlayerStatsModel, RoundModel
+
+# The schema of the first release, as `create_all` left it on SQLite
+ORIGINAL_SCHEMA = (
+    """CREATE TABLE games (
+        id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        secs_per_round INTEGER NOT NULL,
+        join_token VARCHAR(50) NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (join_token)
+    )""",
+    "CREATE INDEX ix_games_id ON games (id)",
+    """CREATE TABLE players (
+        id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        score INTEGER,
+        is_master BOOLEAN,
+        game_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT idx_uniq_part_name_per_game UNIQUE (name, game_id),
+        CONSTRAINT player_game_id_fkey FOREIGN KEY(game_id)
+            REFERENCES games (id) ON DELETE CASCADE
+    )""",
+    "CREATE INDEX ix_players_id ON players (id)",
+    """CREATE TABLE rounds (
+        id INTEGER NOT NULL,
+        statement VARCHAR(500) NOT NULL,
+        verdict BOOLEAN,
+        created_at DATETIME NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        player_for_id INTEGER NOT NULL,
+        player_against_id INTEGER NOT NULL,
+        game_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(player_for_id) REFERENCES players (id),
+        FOREIGN KEY(player_against_id) REFERENCES players (id),
+        CONSTRAINT round_game_id_fkey FOREIGN KEY(game_id)
+            REFERENCES games (id) ON DELETE CASCADE
+    )""",
+    "CREATE INDEX ix_rounds_id ON rounds (id)",
+    """CREATE TABLE votes (
+        id INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        verdict BOOLEAN NOT NULL,
+        player_id INTEGER NOT NULL,
+        round_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT uniq_player_round_vote UNIQUE (player_id, round_id),
+        FOREIGN KEY(player_id) REFERENCES players (id),
+        CONSTRAINT vote_round_id_fkey FOREIGN KEY(round_id)
+            REFERENCES rounds (id) ON DELETE CASCADE
+    )""",
+    "CREATE INDEX ix_votes_id ON votes (id)",
+)
+
+HOT_INDEXES = {
+    "players": "idx_player_game_created",
+    "rounds": "idx_round_game_created",
+    "votes": "idx_vote_round",
+}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    yield engine
+    engine.dispose()
+
+
+def index_names(engine, table: str) -> List[str]:
+    return [i["name"] for i in inspect(engine).get_indexes(table)]
+
+
+def test_empty_databases_are_created_up_to_date(engine):
+    assert migrate(engine) == [i.version for i in MIGRATIONS]
+    assert migrate(engine) == []
+    for table, index in HOT_INDEXES.items():
+        assert index in index_names(engine, table)
+    assert "ix_games_id" not in index_names(engine, "games")
+
+
+def test_databases_created_before_migrations_are_migrated(engine):
+    with engine.begin() as connection:
+        for statement in ORIGINAL_SCHEMA:
+            connection.execute(text(statement))
+        for statement in (
+            "INSERT INTO games VALUES"
+            " (1, '2021-11-01 10:00:00', 'playing', 30, 'token')",
+            "INSERT INTO players VALUES"
+            " (1, '2021-11-01 10:00:00', 'Ann', 1, 1, 1),"
+            " (2, '2021-11-01 10:00:00', 'Bob', 0, 0, 1),"
+            " (3, '2021-11-01 10:00:00', 'Cat', 0, 0, 1)",
+            "INSERT INTO rounds VALUES (1, 'The death penalty is sometimes"
+            " justified', 1, '2021-11-01 10:00:00', 'finished', 1, 2, 1)",
+            "INSERT INTO votes VALUES (1, '2021-11-01 10:00:00', 1, 3, 1)",
+        ):
+            connection.execute(text(statement))
+
+    assert migrate(engine) == [i.version for i in MIGRATIONS[1:]]
+    assert migrate(engine) == []
+    for table, index in HOT_INDEXES.items():
+        assert index in index_names(engine, table)
+    assert "ix_games_id" not in index_names(engine, "games")
+    with engine.connect() as connection:
+        created = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE name IN ('games', 'players')")
+        ).scalars()
+        assert all("AUTOINCREMENT" in i for i in created)
+
+    with Session(engine) as db_session:
+        game_round = db_session.get(RoundModel, 1)
+        assert (game_round.num_votes_for, game_round.num_votes_against) == (1, 0)
+        assert game_round.statement_id is not None
+        ann = db_session.get(PlayerModel, 1)
+        assert (ann.num_rows, ann.num_for, ann.num_against) == (1, 1, 0)
+        game = db_session.get(GameModel, 1)
+        assert game.statement_start and game.revision == 0
+        assert db_session.get(PlayerStatsModel, "Ann").num_wins == 1
+
+        # What the app writes fits the migrated tables
+        db_session.add(GameModel(secs_per_round=30, players=[PlayerModel(name="Dan")]))
+        db_session.commit()
+
+
+def test_renumbered_migrations_are_applied_again(engine):
+    migrate(engine)
+    version = next(i.version for i in MIGRATIONS if i.name == "hot_path_indexes")
+    with engine.begin() as connection:
+        connection.execute(
+            text("UPDATE schema_migrations SET name = 'renamed' WHERE version = :v"),
+            {"v": version},
+        )
+        connection.execute(text("DROP INDEX idx_vote_round"))
+
+    assert migrate(engine) == [version]
+    assert "idx_vote_round" in index_names(engine, "votes")
+    assert migrate(engine) == []
+
+
+def test_workers_migrate_one_at_a_time():
+    if get_engine().dialect.name != "postgresql":
+        pytest.skip("Takes Postgres' advisory lock")
+
+    Base.metadata.drop_all(get_engine())
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        applied = list(executor.map(lambda _: migrate(get_engine()), range(4)))
+    assert sorted(applied, key=len) == [[], [], [], [i.version for i in MIGRATIONS]]
+
+
+def test_hot_queries_use_indexes(client, clear_all):
+    if get_engine().dialect.name != "sqlite":
+        pytest.skip("Reads SQLite's query plans")
+
+    payload = {"player": {"name": "Player 1"}, "game": {"secsPerRound": 30}}
+    response = client.post("/game", json=payload)
+    join_link = response.json()["joinLink"]
+    cookies = [{GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}]
+    for i in range(2, 5):
+        response = client.post(join_link, json={"player": {"name": f"Player {i}"}})
+        cookies.append({GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)})
+
+    queries: List[Tuple[str, tuple]] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().startswith("SELECT") and not many:
+            queries.append((statement, parameters))
+
+    event.listen(get_engine(), "before_cursor_execute", before_cursor_execute)
+    try:
+        client.post(join_link, json={"player": {"name": "Latecomer"}})
+        game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+        for voter_cookies in cookies[1:]:
+            client.post(
+                "/game/round/vote", json={"verdict": True}, cookies=voter_cookies
+            )
+        for path in ("/game", "/game/rounds", "/game/rounds/current"):
+            client.get(path, cookies=cookies[0])
+        client.get(
+            "/game/rounds",
+            params={"since": game_round["id"], "limit": 1},
+            cookies=cookies[0],
+        )
+    finally:
+        event.remove(get_engine(), "before_cursor_execute", before_cursor_execute)
+
+    assert queries
+    with get_engine().connect() as connection:
+        for statement, parameters in queries:
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).all()
+            details = [row[-1] for row in plan]
+            # Full scans, or sorts the index should have spared
+            assert not [
+                i for i in details if i.startswith("SCAN") or "TEMP B-TREE" in i
+            ], (statement, details)
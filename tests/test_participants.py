@@ -0,0 +1,78 @@
+from collections import Counter
+
+from src.db import get_session_local
+from src.models import PlayerModel
+from src.participants import ParticipationQueue
+from src.schemas import GameCreate, JWTPayload, PlayerCreate
+from src.use_cases import (
+    create_game,
+    create_game_round,
+    info_from_jwt_payload,
+    join_game,
+    GAME_PLAYERS,
+    GAME_ROUNDS,
+)
+
+
+def play(queue: ParticipationQueue, num_rounds: int) -> list:
+    pairs = []
+    for _ in range(num_rounds):
+        pair = queue.next_pair()
+        queue.count_round(*pair)
+        pairs.append(pair)
+    return pairs
+
+
+def test_participation_rotates_through_players():
+    queue = ParticipationQueue.from_players([])
+    for player_id in (1, 2, 3, 4):
+        queue.add(player_id)
+
+    pairs = play(queue, 4)
+
+    assert pairs[:2] == [(1, 2), (3, 4)]
+    assert Counter(i for pair in pairs for i in pair) == {1: 2, 2: 2, 3: 2, 4: 2}
+    assert Counter(player_for for player_for, _ in pairs) == {1: 1, 2: 1, 3: 1, 4: 1}
+
+
+def test_latecomers_take_part_first():
+    queue = ParticipationQueue()
+    for player_id in (1, 2, 3):
+        queue.add(player_id)
+    play(queue, 3)
+
+    queue.add(4)
+
+    assert 4 in queue.next_pair()
+    assert len(queue) == 4
+
+
+def test_round_creation_counts_participation(clear_all):
+    db_session = get_session_local()
+    try:
+        game, master = create_game(
+            db_session,
+            game_schema=GameCreate(secs_per_round=30),
+            player_schema=PlayerCreate(name="Player 1"),
+        )
+        for i in (2, 3):
+            join_game(db_session, game.join_token, PlayerCreate(name=f"Player {i}"))
+
+        game, master = info_from_jwt_payload(
+            db_session,
+            JWTPayload(game_id=game.id, player_id=master.id, is_master=True),
+            GAME_PLAYERS,
+            GAME_ROUNDS,
+        )
+        game_round = create_game_round(db_session, game)
+        db_session.expire_all()
+
+        counters = {
+            i.id: (i.num_rows, i.num_for, i.num_against)
+            for i in db_session.query(PlayerModel).filter_by(game_id=game.id)
+        }
+        assert counters.pop(game_round.player_for_id) == (1, 1, 0)
+        assert counters.pop(game_round.player_against_id) == (1, 0, 1)
+        assert list(counters.values()) == [(0, 0, 0)]
+    finally:
+        db_session.close()
@@ -0,0 +1,88 @@
+from typing import Dict, List, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.constants import GAME_SESSION_KEY
+
+NUM_PLAYERS = 5
+
+# Upper bound of queries per endpoint, whatever the number of rounds played
+MAX_QUERIES = {
+    # Game, player insert and the game's revision
+    "POST /game/join": 4,
+    "GET /game": 2,
+    "GET /game/rounds": 3,
+    "GET /game/rounds/current": 3,
+    # Last round's status, next statement, round insert, statement cursor
+    # and the participants' counters
+    "POST /game/rounds": 8,
+    # Vote, atomic tally increment, reading the tally back and the game's
+    # revision
+    "POST /game/round/vote": 8,
+}
+
+
+def play_game(client: TestClient, num_rounds: int) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Plays `num_rounds` full rounds.
+    Returns the join link and the cookies of every player, by player id.
+    """
+    payload = {"player": {"name": "Player 1"}, "game": {"secsPerRound": 30}}
+    response = client.post("/game", json=payload)
+    join_link = response.json()["joinLink"]
+    cookies = [{GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}]
+
+    for i in range(2, NUM_PLAYERS + 1):
+        response = client.post(join_link, json={"player": {"name": f"Player {i}"}})
+        cookies.append({GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)})
+
+    for _ in range(num_rounds):
+        game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+        for voter_cookies in voters(game_round, cookies):
+            client.post(
+                "/game/round/vote", json={"verdict": True}, cookies=voter_cookies
+            )
+
+    return join_link, cookies
+
+
+def voters(game_round: dict, cookies: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    return [
+        player_cookies
+        for player_id, player_cookies in enumerate(cookies, start=1)
+        if player_id not in participants
+    ]
+
+
+@pytest.mark.parametrize("num_rounds", (1, 10))
+def test_max_queries_per_endpoint(client, clear_all, count_queries, num_rounds):
+    join_link, cookies = play_game(client, num_rounds)
+    master = cookies[0]
+
+    def assert_max_queries(name: str, request):
+        with count_queries() as queries:
+            response = request()
+        assert response.status_code < 300, name
+        assert len(queries) <= MAX_QUERIES[name], (name, queries)
+        return response.json()
+
+    assert_max_queries(
+        "POST /game/join",
+        lambda: client.post(join_link, json={"player": {"name": "Latecomer"}}),
+    )
+    for path in ("/game", "/game/rounds", "/game/rounds/current"):
+        assert_max_queries(f"GET {path}", lambda: client.get(path, cookies=master))
+
+    game_round = assert_max_queries(
+        "POST /game/rounds", lambda: client.post("/game/rounds", cookies=master)
+    )
+    assert_max_queries(
+        "POST /game/round/vote",
+        lambda: client.post(
+            "/game/round/vote",
+            json={"verdict": False},
+            cookies=voters(game_round, cookies)[0],
+        ),
+    )
@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from src.config import get_settings
+from src.constants import GAME_SESSION_KEY, PRIMARY_READS_KEY
+from src.db import (
+    get_async_replica_engines,
+    get_engine,
+    get_replica_engines,
+    get_session_local,
+)
+
+
+@pytest.fixture
+def replicate(client, tmp_path, monkeypatch, clear_all, database_async):
+    """A replica on a second SQLite file, copied from the primary on demand"""
+    if get_engine().dialect.name != "sqlite":
+        pytest.skip("Replicates SQLite files")
+    replica_path = tmp_path / "replica.db"
+    monkeypatch.setattr(
+        get_settings(), "database_replica_uris", [f"sqlite:///{replica_path}"]
+    )
+    get_replica_engines.cache_clear()
+    get_async_replica_engines.cache_clear()
+    client.cookies.clear()
+
+    def replicate():
+        primary = sqlite3.connect(get_engine().url.database)
+        replica = sqlite3.connect(replica_path)
+        try:
+            primary.backup(replica)
+        finally:
+            primary.close()
+            replica.close()
+
+    replicate()
+    yield replicate
+
+    for engine in get_replica_engines():
+        engine.dispose()
+    get_replica_engines.cache_clear()
+    get_async_replica_engines.cache_clear()
+    client.cookies.clear()
+
+
+def test_sessions_on_replicas():
+    session = get_session_local(replica=True)
+    # Without replicas, reads go to the primary
+    assert session.bind is get_engine()
+    session.close()
+
+
+def test_reads_go_to_replicas_after_a_while(client, replicate):
+    payload = {"player": {"name": "Player 1"}, "game": {"secsPerRound": 30}}
+    response = client.post("/game", json=payload)
+    master = {GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}
+    join_link = response.json()["joinLink"]
+    for name in ("Player 2", "Player 3"):
+        response = client.post(join_link, json={"player": {"name": name}})
+    player = {GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}
+    wrote = {**player, PRIMARY_READS_KEY: response.cookies.get(PRIMARY_READS_KEY)}
+    # Cookies are passed along explicitly from here on
+    client.cookies.clear()
+
+    # A client that just wrote reads its writes from the primary, whichever
+    # worker serves it
+    assert len(client.get("/game", cookies=wrote).json()["players"]) == 3
+
+    # Others read from the replica, which is yet to get the game
+    assert client.get("/game", cookies=master).status_code == 404
+    for expired in ("0", "garbage"):
+        cookies = {**player, PRIMARY_READS_KEY: expired}
+        assert client.get("/game", cookies=cookies).status_code == 404
+    replicate()
+    assert len(client.get("/game", cookies=master).json()["players"]) == 3
+
+    response = client.post("/game/rounds", cookies=master)
+    game_round = response.json()
+    wrote = {**master, PRIMARY_READS_KEY: response.cookies.get(PRIMARY_READS_KEY)}
+    client.cookies.clear()
+    response = client.get("/game/rounds/current", cookies=wrote)
+    assert response.json()["id"] == game_round["id"]
+    # Other players see it as it reaches the replica
+    assert client.get("/game/rounds/current", cookies=player).json() is None
+    assert client.get("/game/rounds", cookies=player).json() == []
+    replicate()
+    response = client.get("/game/rounds/current", cookies=player)
+    assert response.json()["id"] == game_round["id"]
@@ -0,0 +1,145 @@
+import base64
+import time
+from datetime import timedelta
+
+import pytest
+
+from src import cache as cache_module
+from src.cache import TTLCache
+from src.config import get_settings
+from src.constants import GAME_SESSION_KEY
+from src.schemas import GameSession, JWTPayload
+from src.session_token import (
+    CompactSessionToken,
+    ExpiredSession,
+    GameSessionJWT,
+    SessionError,
+    get_session_token,
+)
+
+
+@pytest.fixture
+def jwt_session() -> GameSessionJWT:
+    jwt_session = GameSessionJWT(get_settings())
+    jwt_session.cache.clear()
+    return jwt_session
+
+
+def test_decoded_tokens_are_cached(jwt_session, monkeypatch):
+    token = jwt_session.to_public_token(
+        GameSession(game_id=1, player_id=2, is_master=True)
+    )
+
+    decoded = []
+    decode = jwt_session.decode
+    monkeypatch.setattr(
+        jwt_session, "decode", lambda *args: decoded.append(args) or decode(*args)
+    )
+
+    for _ in range(3):
+        jwt_payload = jwt_session.from_token_str(token)
+        assert (jwt_payload.game_id, jwt_payload.player_id) == (1, 2)
+
+    assert len(decoded) == 1
+
+
+def test_cached_tokens_expire(jwt_session, monkeypatch):
+    jwt_payload = JWTPayload(game_id=1, player_id=2, is_master=False)
+    token = jwt_session.to_jwt(jwt_payload, expires_delta=timedelta(minutes=1))
+    jwt_session.from_token_str(token)
+    assert jwt_session.cache.get(token) is not None
+
+    now = time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 120)
+
+    assert jwt_session.cache.get(token) is None
+
+
+def test_expired_tokens_are_rejected(jwt_session):
+    jwt_payload = JWTPayload(game_id=1, player_id=2, is_master=False)
+    token = jwt_session.to_jwt(jwt_payload, expires_delta=timedelta(minutes=-1))
+
+    with pytest.raises(ExpiredSession):
+        jwt_session.from_token_str(token)
+    assert jwt_session.cache.get(token) is None
+
+
+def test_compact_tokens_roundtrip():
+    session_token = CompactSessionToken(get_settings())
+    token = session_token.to_public_token(
+        GameSession(game_id=1, player_id=2, is_master=True)
+    )
+
+    jwt_payload = session_token.from_token_str(token)
+    assert (jwt_payload.game_id, jwt_payload.player_id) == (1, 2)
+    assert jwt_payload.is_master is True
+    assert jwt_payload.exp > time.time()
+
+
+@pytest.mark.parametrize("tamper", ("flip", "truncate", "garbage"))
+def test_tampered_compact_tokens_are_rejected(tamper):
+    session_token = CompactSessionToken(get_settings())
+    token = session_token.to_public_token(
+        GameSession(game_id=1, player_id=2, is_master=False)
+    )
+    if tamper == "flip":
+        # Player 2 -> 3, signature left as is
+        raw = bytearray(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        raw[16] ^= 1
+        token = base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()
+    elif tamper == "truncate":
+        token = token[:-4]
+    else:
+        token = "not a token!"
+
+    with pytest.raises(SessionError):
+        session_token.from_token_str(token)
+
+
+def test_expired_compact_tokens_are_rejected():
+    session_token = CompactSessionToken(get_settings())
+    token = session_token.to_public_token(
+        GameSession(game_id=1, player_id=2, is_master=False),
+        expires_delta=timedelta(minutes=-1),
+    )
+    with pytest.raises(ExpiredSession):
+        session_token.from_token_str(token)
+
+
+def test_games_played_with_compact_tokens(client, clear_all, monkeypatch):
+    monkeypatch.setattr(get_settings(), "session_token_format", "compact")
+    assert isinstance(get_session_token(get_settings()), CompactSessionToken)
+
+    payload = {"player": {"name": "Kevin Lomax"}, "game": {"secsPerRound": 30}}
+    response = client.post("/game", json=payload)
+    cookies = {GAME_SESSION_KEY: response.cookies.get(GAME_SESSION_KEY)}
+    assert len(cookies[GAME_SESSION_KEY]) < 80
+
+    response = client.get("/game", cookies=cookies)
+    assert response.status_code == 200
+    assert response.json()["players"][0]["name"] == "Kevin Lomax"
+
+
+def test_ttl_cache_is_bounded():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_sessions_last_as_long_in_either_format():
+    settings = get_settings()
+    game_session = GameSession(game_id=1, player_id=2, is_master=False)
+    expected = (
+        time.time() + timedelta(days=settings.session_token_exp_time).total_seconds()
+    )
+
+    for session_token in (GameSessionJWT(settings), CompactSessionToken(settings)):
+        token = session_token.to_public_token(game_session)
+        assert session_token.decode(token).exp == pytest.approx(expected, abs=5)
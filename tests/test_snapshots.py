@@ -0,0 +1,135 @@
+import pytest
+
+from src.config import get_settings
+from src.game_state import get_game_state_store
+from src.snapshots import SnapshotCache, etag_matches, get_snapshot_cache
+
+READS = ("/game", "/game/rounds", "/game/rounds/current")
+
+
+@pytest.fixture(params=(False, True), ids=("orm", "game_state_store"))
+def fast_json(request, monkeypatch, clear_all):
+    monkeypatch.setattr(get_settings(), "game_state_store", request.param)
+    store = get_game_state_store()
+    store.clear()
+    get_snapshot_cache().clear()
+    yield lambda enabled: monkeypatch.setattr(get_settings(), "fast_json", enabled)
+    store.writer.flush()
+    store.clear()
+
+
+def vote(client, game_round: dict, cookies: list):
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voter = next(c for i, c in enumerate(cookies, start=1) if i not in participants)
+    response = client.post("/game/round/vote", json={"verdict": True}, cookies=voter)
+    assert response.status_code == 201
+
+
+def test_snapshots_match_the_regular_responses(client, new_game, fast_json):
+    _, cookies = new_game(num_players=4)
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    vote(client, game_round, cookies)
+
+    expected = {path: client.get(path, cookies=cookies[1]).json() for path in READS}
+    fast_json(True)
+    for path in READS:
+        # Serialized, then served from the cache
+        for _ in range(2):
+            response = client.get(path, cookies=cookies[1])
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/json"
+            assert response.json() == expected[path]
+
+
+def test_unchanged_games_are_not_modified(client, new_game, fast_json, count_queries):
+    fast_json(True)
+    _, cookies = new_game(num_players=4)
+
+    response = client.get("/game", cookies=cookies[0])
+    etag = response.headers["etag"]
+    with count_queries() as queries:
+        response = client.get(
+            "/game", cookies=cookies[1], headers={"If-None-Match": f"W/{etag}"}
+        )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+    assert len(queries) <= 1
+
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    response = client.get("/game/rounds/current", cookies=cookies[0])
+    assert response.json()["numVotes"] == 0
+    round_etag = response.headers["etag"]
+    assert round_etag != etag
+
+    vote(client, game_round, cookies)
+    response = client.get(
+        "/game/rounds/current",
+        cookies=cookies[0],
+        headers={"If-None-Match": round_etag},
+    )
+    assert response.status_code == 200
+    assert response.json()["numVotes"] == 1
+    assert response.headers["etag"] != round_etag
+
+
+def test_etag_matches():
+    assert etag_matches('"1.2"', '"1.2"')
+    assert etag_matches('"1.1", W/"1.2"', '"1.2"')
+    assert etag_matches("*", '"1.2"')
+    assert not etag_matches('"1.1"', '"1.2"')
+    assert not etag_matches(None, '"1.2"')
+
+
+def test_snapshots_per_game_are_capped():
+    cache = SnapshotCache(maxsize=10, max_resources=3)
+    snapshot = (b"[]", {})
+    for limit in range(1, 6):
+        cache.set(1, f"rounds?limit={limit}", 1, snapshot)
+    assert [cache.get(1, f"rounds?limit={i}", 1) for i in range(1, 6)] == [
+        None,
+        None,
+        snapshot,
+        snapshot,
+        snapshot,
+    ]
+
+    # A newer revision drops those of the older ones
+    cache.set(1, "game", 2, snapshot)
+    assert cache.get(1, "rounds?limit=5", 1) is None
+    assert len(cache._games.get(1)) == 1
+    # Not the other way round
+    cache.set(1, "game", 1, (b"{}", {}))
+    assert cache.get(1, "game", 2) == snapshot
+
+
+@pytest.mark.parametrize("enabled", (False, True), ids=("json", "fast_json"))
+def test_rounds_pages_and_deltas(client, new_game, fast_json, enabled):
+    fast_json(enabled)
+    _, cookies = new_game(num_players=3)
+    round_ids = []
+    for _ in range(5):
+        game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+        vote(client, game_round, cookies)
+        round_ids.append(game_round["id"])
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/game/rounds", params=params, cookies=cookies[0])
+        assert response.status_code == 200
+        pages.append([i["id"] for i in response.json()])
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+    assert pages == [round_ids[:2], round_ids[2:4], round_ids[4:]]
+
+    # The latest round fetched, as it may have changed since, and newer ones
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    response = client.get(
+        "/game/rounds", params={"since": round_ids[-1]}, cookies=cookies[0]
+    )
+    assert [i["id"] for i in response.json()] == [round_ids[-1], game_round["id"]]
+
+    response = client.get("/game/rounds", params={"limit": 0}, cookies=cookies[0])
+    assert response.status_code == 422
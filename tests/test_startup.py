@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous: these catch work creeping back into imports, not jitter
+MAX_IMPORT_SECONDS = 5
+MAX_FIRST_REQUEST_SECONDS = 5
+
+STARTUP_SCRIPT = """
+import json, os, sys, time
+
+start = time.perf_counter()
+from src.main import app
+imported = time.perf_counter()
+database_created = os.path.exists(sys.argv[1])
+
+from fastapi.testclient import TestClient
+
+with TestClient(app) as client:
+    response = client.get("/topics")
+first_request = time.perf_counter()
+
+print(json.dumps({
+    "import_seconds": imported - start,
+    "first_request_seconds": first_request - imported,
+    "database_created_on_import": database_created,
+    "status_code": response.status_code,
+}))
+"""
+
+
+def test_startup_time(tmp_path, record_property):
+    """Imports the app and serves its first request in a fresh interpreter"""
+    database_path = tmp_path / "startup.db"
+    env = {
+        **os.environ,
+        "DATABASE_URI": f"sqlite:///{database_path}",
+        "DATABASE_ASYNC": "false",
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, str(database_path)],
+        cwd=BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    timings = json.loads(output.splitlines()[-1])
+    for name in ("import_seconds", "first_request_seconds"):
+        record_property(name, timings[name])
+
+    # The schema is migrated as the app starts, not as it's imported
+    assert not timings["database_created_on_import"]
+    assert timings["status_code"] == 200
+    assert timings["import_seconds"] < MAX_IMPORT_SECONDS
+    assert timings["first_request_seconds"] < MAX_FIRST_REQUEST_SECONDS
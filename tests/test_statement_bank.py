@@ -0,0 +1,104 @@
+import io
+
+import pytest
+
+from src.db import get_session_local
+from src.models import StatementModel, TopicModel
+from src.schemas import GameCreate, PlayerCreate
+from src.statement_bank import (
+    add_statements,
+    iter_statements,
+    next_statement,
+    read_statements,
+    statements,
+    write_statements,
+)
+from src.use_cases import create_game
+
+
+@pytest.fixture
+def db_session(clear_all):
+    db_session = get_session_local()
+    yield db_session
+    db_session.close()
+
+
+def walk(db_session, game) -> list:
+    """Uses up the game's statements"""
+    texts = []
+    with pytest.raises(ValueError, match="No statements left"):
+        while True:
+            statement = next_statement(db_session, game)
+            game.statement_cursor = statement.shuffle_key
+            texts.append(statement.text)
+    return texts
+
+
+def new_game(db_session, **kwargs):
+    game, player = create_game(
+        db_session,
+        game_schema=GameCreate(secs_per_round=30, **kwargs),
+        player_schema=PlayerCreate(name="Player 1"),
+    )
+    return game
+
+
+def test_games_walk_every_statement_once(db_session):
+    game_1, game_2 = new_game(db_session), new_game(db_session)
+
+    texts_1, texts_2 = walk(db_session, game_1), walk(db_session, game_2)
+
+    assert sorted(texts_1) == sorted(texts_2) == sorted(statements)
+    # Each game starts from a random point of the bank
+    assert game_1.statement_start != game_2.statement_start
+
+
+def test_games_pick_statements_from_their_topics(db_session):
+    game = new_game(db_session, topics=["Guns", "Death Penalty"])
+
+    assert sorted(walk(db_session, game)) == [
+        "Everyone has the right to own a gun",
+        "The death penalty is sometimes justified",
+    ]
+
+
+def test_unknown_topics_are_rejected(client, clear_all):
+    payload = {"player": {"name": "Kevin"}, "game": {"topics": ["Guns", "Cats"]}}
+    response = client.post("/game", json=payload)
+    assert response.status_code == 422
+
+    assert "Guns" in client.get("/topics").json()
+
+
+def test_statements_are_added_in_batches(db_session, count_queries):
+    rows = [(f"Statement {i}", "Cats" if i % 2 else None) for i in range(10)]
+    rows.append(("War is never justified", None))
+
+    with count_queries() as queries:
+        added = add_statements(db_session, rows, batch_size=4)
+    db_session.commit()
+
+    assert added == 10
+    # The topics, an insert per batch and the new topic
+    assert len(queries) == 1 + 3 + 1
+    cats = db_session.query(TopicModel).filter_by(name="Cats").one()
+    assert db_session.query(StatementModel).filter_by(topic_id=cats.id).count() == 5
+
+
+@pytest.mark.parametrize("file_format", ("csv", "jsonl"))
+def test_banks_are_exported_and_imported(db_session, file_format):
+    bank = io.StringIO()
+    write_statements(
+        iter_statements(db_session.connection(), batch_size=7), bank, file_format
+    )
+    bank.seek(0)
+
+    rows = list(read_statements(bank, file_format))
+    assert dict(rows) == statements
+    assert add_statements(db_session, rows) == 0
+
+
+def test_csv_banks_may_have_no_topic_column():
+    bank = io.StringIO("statement\nCats are better than dogs\n\n  \n")
+
+    assert list(read_statements(bank, "csv")) == [("Cats are better than dogs", None)]
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+from src.constants import Status
+from src.db import get_session_local
+from src.timers import TimerWheel, Timers, get_timers
+from src.use_cases import close_voting, open_voting, run_phase, schedule_round_timers
+
+
+def test_wheel_fires_timers_once_due():
+    wheel = TimerWheel(tick=1, num_slots=8)
+    fired = []
+    wheel.schedule("a", 100.5, lambda: fired.append("a"))
+    wheel.schedule("b", 102, lambda: fired.append("b"))
+    # A revolution and more away
+    wheel.schedule("c", 111, lambda: fired.append("c"))
+    wheel.schedule("d", 101, lambda: fired.append("d"))
+    wheel.cancel("d")
+
+    for callback in wheel.advance(100.2):
+        callback()
+    assert fired == []
+
+    for now in (101, 102, 103):
+        for callback in wheel.advance(now):
+            callback()
+    assert fired == ["a", "b"]
+
+    # Overdue timers fire on the next tick
+    wheel.schedule("e", 50, lambda: fired.append("e"))
+    for now in (104, 111):
+        for callback in wheel.advance(now):
+            callback()
+    assert fired == ["a", "b", "e", "c"]
+    assert len(wheel) == 0
+
+
+def test_rescheduling_replaces_the_timer():
+    wheel = TimerWheel(tick=1, num_slots=8)
+    wheel.schedule(1, 10, lambda: "voting")
+    wheel.schedule(1, 12, lambda: "finished")
+
+    assert wheel.advance(11) == []
+    assert [callback() for callback in wheel.advance(12)] == ["finished"]
+
+
+def test_timers_run_callbacks_in_the_threadpool():
+    timers = Timers(TimerWheel(tick=0.01))
+    fired = threading.Event()
+
+    async def run():
+        timers.start()
+        timers.schedule("round", time.time(), fired.set)
+        for _ in range(100):
+            if fired.is_set():
+                break
+            await asyncio.sleep(0.01)
+        await timers.stop()
+
+    asyncio.run(run())
+    assert fired.is_set()
+
+
+def new_round(client, new_game, num_players: int):
+    _, cookies = new_game(num_players, secs_per_round=1)
+    game_round = client.post("/game/rounds", cookies=cookies[0]).json()
+    participants = {game_round["playerFor"]["id"], game_round["playerAgainst"]["id"]}
+    voters = [c for i, c in enumerate(cookies, start=1) if i not in participants]
+    return game_round, cookies, voters
+
+
+def test_rounds_move_through_their_phases(client, new_game, game_state_store):
+    game_round, cookies, voters = new_round(client, new_game, num_players=5)
+    assert game_round["status"] == Status.PLAYING
+
+    run_phase(open_voting, game_round["id"])
+    current = client.get("/game/rounds/current", cookies=cookies[0]).json()
+    assert current["status"] == Status.VOTING
+    assert client.post("/game/rounds", cookies=cookies[0]).status_code == 422
+
+    response = client.post(
+        "/game/round/vote", json={"verdict": True}, cookies=voters[0]
+    )
+    assert response.status_code == 201
+
+    # Two votes short: finished as time runs out, with the votes it got
+    run_phase(close_voting, game_round["id"])
+    current = client.get("/game/rounds/current", cookies=cookies[0]).json()
+    assert current["status"] == Status.FINISHED
+    assert current["verdict"] is True
+    assert current["playerFor"]["score"] == 1
+
+    response = client.post(
+        "/game/round/vote", json={"verdict": True}, cookies=voters[1]
+    )
+    assert response.status_code == 422
+    # Late timers change nothing
+    run_phase(close_voting, game_round["id"])
+    run_phase(open_voting, game_round["id"])
+    current = client.get("/game/rounds/current", cookies=cookies[0]).json()
+    assert current["status"] == Status.FINISHED
+    assert client.post("/game/rounds", cookies=cookies[0]).status_code == 201
+
+
+def test_timers_are_rebuilt_from_the_rounds_in_play(client, new_game, game_state_store):
+    game_round, cookies, voters = new_round(client, new_game, num_players=3)
+    get_timers().wheel.clear()
+
+    db_session = get_session_local()
+    try:
+        assert schedule_round_timers(db_session) == 1
+    finally:
+        db_session.close()
+
+    # Due a second after the round started
+    wheel = get_timers().wheel
+    assert wheel.advance(time.time() - 5) == []
+    callbacks = wheel.advance(time.time() + 2)
+    assert len(callbacks) == 1
+    callbacks[0]()
+
+    # The voting phase's timer, set as voting opened
+    assert len(wheel) == 1
+    current = client.get("/game/rounds/current", cookies=cookies[0]).json()
+    assert current["status"] == Status.VOTING
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from sqlalchemy import func
+
+from src.constants import Status
+from src.db import get_session_local
+from src.models import PlayerModel, RoundModel, VoteModel
+from src.schemas import GameCreate, JWTPayload, PlayerCreate
+from src.use_cases import (
+    add_vote_to_round,
+    create_game,
+    create_game_round,
+    get_current_round,
+    info_from_jwt_payload,
+    join_game,
+    GAME_PLAYERS,
+    GAME_ROUNDS,
+)
+
+NUM_GAMES = 3
+NUM_PLAYERS = 101
+
+
+def start_games() -> List[Tuple[int, List[int]]]:
+    """Starts a round in every game, returns the game ids and their voters"""
+    games = []
+    db_session = get_session_local()
+    try:
+        for _ in range(NUM_GAMES):
+            game, master = create_game(
+                db_session,
+                game_schema=GameCreate(secs_per_round=30),
+                player_schema=PlayerCreate(name="Player 1"),
+            )
+            for i in range(2, NUM_PLAYERS + 1):
+                join_game(db_session, game.join_token, PlayerCreate(name=f"Player {i}"))
+
+            game, master = info_from_jwt_payload(
+                db_session,
+                JWTPayload(game_id=game.id, player_id=master.id, is_master=True),
+                GAME_PLAYERS,
+                GAME_ROUNDS,
+            )
+            game_round = create_game_round(db_session, game)
+            participants = {game_round.player_for_id, game_round.player_against_id}
+            voters = [i.id for i in game.players if i.id not in participants]
+            games.append((game.id, voters))
+    finally:
+        db_session.close()
+    return games
+
+
+def vote(game_id: int, player_id: int, verdict: bool) -> str:
+    db_session = get_session_local()
+    try:
+        jwt_payload = JWTPayload(game_id=game_id, player_id=player_id, is_master=False)
+        game, player = info_from_jwt_payload(db_session, jwt_payload, GAME_PLAYERS)
+        game_round = get_current_round(db_session, game_id)
+        add_vote_to_round(db_session, game_round, player, verdict)
+        return "voted"
+    except ValueError as e:
+        return str(e)
+    finally:
+        db_session.close()
+
+
+def test_concurrent_votes_finish_each_round_once(clear_all):
+    games = start_games()
+
+    # Every voter votes twice, two thirds of them for the statement
+    votes = [
+        (game_id, player_id, i % 3 != 0)
+        for game_id, voters in games
+        for i, player_id in enumerate(voters)
+        for _ in range(2)
+    ]
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(lambda args: vote(*args), votes))
+
+    num_voters = NUM_PLAYERS - 2
+    assert results.count("voted") == NUM_GAMES * num_voters
+    assert set(results) <= {"voted", "You already voted", "The round is over"}
+
+    db_session = get_session_local()
+    try:
+        for game_id, voters in games:
+            game_round = db_session.query(RoundModel).filter_by(game_id=game_id).one()
+            assert game_round.status == Status.FINISHED
+            assert game_round.verdict is True
+            assert game_round.num_votes == num_voters
+            assert (
+                db_session.query(func.count(VoteModel.id))
+                .filter_by(round_id=game_round.id)
+                .scalar()
+                == num_voters
+            )
+
+            scores = dict(
+                db_session.query(PlayerModel.id, PlayerModel.score).filter_by(
+                    game_id=game_id
+                )
+            )
+            assert scores[game_round.player_for_id] == 1
+            assert sum(scores.values()) == 1
+    finally:
+        db_session.close()